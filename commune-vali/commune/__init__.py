@@ -8,12 +8,32 @@ from .cli import cli
 # from .modules.subspace import subspace
 # from .model import Model
 
-# set the module functions as globals
-for k,v in Module.__dict__.items():
-    globals()[k] = v
-for f in Module.class_functions() + Module.static_functions():
-    globals()[f] = getattr(Module, f)
-for f in Module.self_functions():
-    globals()[f] = lambda *args, **kwargs: getattr(Module(), f)(*args, **kwargs)
-globals()['cli'] = cli
+# the module functions are resolved as globals on first use (c.<fn>),
+# instead of classifying every function of the Module at import
+def __getattr__(name:str):
+    if name.startswith('__') and name not in Module.__dict__:
+        raise AttributeError(f"module 'commune' has no attribute '{name}'")
+    try:
+        obj = getattr(Module, name)
+    except AttributeError:
+        raise AttributeError(f"module 'commune' has no attribute '{name}'")
+    if callable(obj) and not isinstance(obj, type):
+        try:
+            fn_type = Module.classify_fn(obj)
+        except Exception:
+            fn_type = None
+        if fn_type == 'self':
+            fn = obj
+            obj = lambda *args, **kwargs: getattr(Module(), name)(*args, **kwargs)
+            obj.__name__, obj.__doc__ = name, fn.__doc__
+        globals()[name] = obj
+    return obj
+
+def __dir__():
+    return sorted(set(globals()) | set(dir(Module)))
 
+# the subpackages imported above shadow the functions with their name (c.module)
+for k in [k for k, v in globals().items() if type(v).__name__ == 'module' and hasattr(Module, k)]:
+    del globals()[k]
+
+globals()['cli'] = cli
@@ -35,10 +35,9 @@ class cli(c.Module):
         args, kwargs = self.parse_args(args)
 
 
-        base_module_attributes = list(set(self.base_module.functions()  + self.base_module.get_attributes()))
-        # is it a fucntion, assume it is for the module
+        # is it a fucntion, assume it is for the module (dir covers the functions and attributes)
         # handle module/function
-        is_fn = args[0] in base_module_attributes
+        is_fn = args[0] in dir(self.base_module)
 
 
         if '/' in args[0]:
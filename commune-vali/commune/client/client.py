@@ -2,6 +2,7 @@
 
 from typing import *
 import asyncio
+import inspect
 import commune as c
 import aiohttp
 import json
@@ -21,21 +22,25 @@ class Client(c.Module):
             debug: bool = False,
             serializer= 'serializer',
             default_fn = 'info',
+            content_type = 'json', # json or frames (binary)
+            pool = 'client.pool', # the process wide session pool
 
             **kwargs
         ):
         self.loop = c.get_event_loop() if loop == None else loop
         self.serializer = c.module(serializer)()
+        self.pool = c.module(pool)
         self.key = c.get_key(key)
         self.start_timestamp = c.timestamp()
         self.save_history = save_history
         self.history_path = history_path
         self.debug = debug
         self.default_fn = default_fn
+        self.content_type = content_type
         self.set_client(address = address, network=network)
 
 
-    def prepare_request(self, args: list = None, kwargs: dict = None, params=None, message_type = "v0"):
+    def prepare_request(self, args: list = None, kwargs: dict = None, params=None, message_type = "v0", content_type='json'):
 
         if isinstance(args, dict):
             kwargs = args
@@ -70,8 +75,14 @@ class Client(c.Module):
                         "kwargs": kwargs,
                         "timestamp": c.timestamp(),
                         }
-            request = self.serializer.serialize(input)
-            request = self.key.sign(request, return_json=True)
+            if content_type == 'frames':
+                # we sign the hash of the frames, and send the frames as the raw body
+                frames = self.serializer.serialize(input, mode='frames')
+                request = self.key.sign(self.serializer.frames_hash(frames), return_json=True)
+                request['frames'] = frames
+            else:
+                request = self.serializer.serialize(input)
+                request = self.key.sign(request, return_json=True)
             # key emoji 
         elif message_type == "v1":
 
@@ -111,10 +122,26 @@ class Client(c.Module):
         # start a client session and send the request
         url = 'http://' + url if not url.startswith('http') else url
         c.print(f"🛰️ Call {url} 🛰️  (🔑{self.key.ss58_address})", color='green', verbose=verbose)
-        if not hasattr(self, 'session'):
-            self.session = aiohttp.ClientSession()
-        response =  await self.session.post(url, json=request, headers=headers)
-        if response.content_type == 'application/json':
+        # the session is shared by every client on this loop, so connections are kept alive across calls
+        session = self.pool.session(url.split('://')[-1].split('/')[0])
+        if 'frames' in request:
+            headers = {'Content-Type': self.serializer.frames_content_type, 
+                       'Accept': self.serializer.frames_content_type,
+                       'x-signature': request['signature'],
+                       'x-address': request['address'],
+                       'x-crypto-type': str(request['crypto_type'])}
+            response = await session.post(url, data=request['frames'], headers=headers)
+            if response.status in [415, 422]:
+                # the server does not speak frames, so we fall back to json for this client
+                response.release() # the connection goes back to the pool for the retry
+                self.content_type = 'json'
+                raise ValueError(f'Server {url} does not support the frames content type')
+        else:
+            response =  await session.post(url, json=request, headers=headers)
+        if response.content_type == self.serializer.frames_content_type:
+            result = await asyncio.wait_for(response.read(), timeout=timeout)
+            result = self.serializer.deserialize(result)
+        elif response.content_type == 'application/json':
             result = await asyncio.wait_for(response.json(), timeout=timeout)
         elif response.content_type == 'text/plain':
             result = await asyncio.wait_for(response.text(), timeout=timeout)
@@ -156,7 +183,11 @@ class Client(c.Module):
         else:
             raise ValueError(f"Invalid response content type: {response.content_type}")
 
-        
+        # the frames are deserialized as they are read, the rest is deserialized here (once)
+        if response.content_type != self.serializer.frames_content_type:
+            result = self.serializer.deserialize(result)
+        if isinstance(result, dict) and 'data' in result:
+            result = result['data']
         return result
 
 
@@ -183,7 +214,8 @@ class Client(c.Module):
         fn = fn or self.default_fn
         if '/' in address.split('://')[-1]:
             address = address.split('://')[-1]
-        url = f"{address}/{fn}/"
+        # no trailing slash, as the server redirects /{fn}/ to /{fn} (an extra round trip)
+        url = f"{address}/{fn}"
         return url
     
 
@@ -202,27 +234,36 @@ class Client(c.Module):
         key : str = None,
         verbose = False,
         stream = False,
+        content_type = None,
         **extra_kwargs
         ):
         try:
             key = self.resolve_key(key)
             url = self.prepare_url(address, fn)
+            content_type = content_type or self.content_type
             # resolve the kwargs at least
             kwargs =kwargs or {}
             kwargs.update(extra_kwargs)
             timestamp = c.time()
-            request = self.prepare_request(args=args, kwargs=kwargs, params=params, message_type=message_type)
-            result = await self.send_request(url=url, request=request, headers=headers, verbose=verbose, stream=stream)
-
-            if type(result) in [str, dict, int, float, list, tuple]:
-                result = self.serializer.deserialize(result)
-                if isinstance(result, dict) and 'data' in result:
-                    result = result['data']
+            request = self.prepare_request(args=args, kwargs=kwargs, params=params, message_type=message_type, content_type=content_type)
+            try:
+                result = await self.send_request(url=url, request=request, headers=headers, verbose=verbose, stream=stream)
+            except ValueError as e:
+                if content_type != 'frames' or self.content_type != 'json':
+                    raise e
+                # the server does not support frames, so we retry with json
+                request = self.prepare_request(args=args, kwargs=kwargs, params=params, message_type=message_type)
+                result = await self.send_request(url=url, request=request, headers=headers, verbose=verbose, stream=stream)
+
+            if not inspect.isasyncgen(result):
                 latency = c.time() - timestamp
                 if self.save_history:
-                    output = { 'input': request, 'output': result, 'latency': latency}
-                    path =  self.history_path+ '/' + self.key.ss58_address + '/' + self.address+ '/'+  str(timestamp)
-                    self.put(path, output)
+                    # we dont save the raw frames, just the signed request
+                    input = {k:v for k,v in request.items() if k != 'frames'}
+                    output = { 'input': input, 'output': result, 'latency': latency, 
+                              'address': self.address, 'fn': fn, 'timestamp': timestamp}
+                    # buffered and flushed in batches by the history module (off the request path)
+                    self.history_store().add(output)
             else: 
                 result = self.iter_over_async(result)
 
@@ -231,11 +272,6 @@ class Client(c.Module):
         return result
 
 
-    def __del__(self):
-        if hasattr(self , 'session'):
-            self.loop.run_until_complete(self.session.close())
-    
-    
     def age(self):
         return  self.start_timestamp - c.timestamp()
 
@@ -262,10 +298,14 @@ class Client(c.Module):
         self.address = address
         return {'address': self.address}
 
+    def history_store(self):
+        return c.module('history').shared(self.resolve_path(self.history_path + '/' + self.key.ss58_address))
+
     @classmethod
-    def history(cls, key=None, history_path='history'):
+    def history(cls, key=None, history_path='history', address:str=None, start:int=None, end:int=None, n:int=None):
         key = c.get_key(key)
-        return cls.ls(history_path + '/' + key.ss58_address)
+        history = c.module('history').shared(cls.resolve_path(history_path + '/' + key.ss58_address))
+        return history.query(address=address, start=start, end=end, n=n)
     
 
 
@@ -281,6 +321,7 @@ class Client(c.Module):
                 key:str = None,
                 stream = False,
                 timeout=40,
+                content_type = None,
                 **extra_kwargs) -> None:
           
         # if '
@@ -306,7 +347,7 @@ class Client(c.Module):
 
         kwargs.update(extra_kwargs)
 
-        return  module.forward(fn=fn, args=args, kwargs=kwargs, stream=stream, timeout=timeout)
+        return  module.forward(fn=fn, args=args, kwargs=kwargs, stream=stream, timeout=timeout, content_type=content_type)
 
     @classmethod
     def call_search(cls, 
@@ -350,7 +391,8 @@ class Client(c.Module):
     def __repr__ ( self ):
         return self.__str__()
     def __exit__ ( self ):
-        self.__del__()
+        # the sessions are shared by the pool, which closes them when they are idle
+        pass
 
     def virtual(self):
         from .virtual import VirtualClient
@@ -391,7 +433,3 @@ class Client(c.Module):
         key  = c.get_key(module)
         assert info['ss58_address'] == key.ss58_address
         return {'info': info, 'key': str(key)}
-
-    def __del__(self):
-        if hasattr(self, 'session'):
-            asyncio.run(self.session.close())
@@ -0,0 +1,197 @@
+import commune as c
+import asyncio
+import aiohttp
+import threading
+import atexit
+from typing import *
+
+class Pool(c.Module):
+    """
+    A process wide pool of keep-alive aiohttp sessions, shared by every Client.
+
+    aiohttp sessions are bound to an event loop, so there is one session per loop,
+    whose connector keeps the connections to each address (host:port) alive and reuses them.
+    """
+    limit = 1000 # max connections per session (0 is unlimited)
+    limit_per_host = 32 # max connections per address
+    keepalive_timeout = 60 # seconds an idle connection is kept alive
+    ttl_dns_cache = 300 # seconds a dns lookup is cached
+    idle_timeout = 600 # seconds an unused session is kept before it is evicted
+    sessions = {} # loop -> session
+    last_used = {} # loop -> timestamp
+    owners = {} # loop -> id of the thread that last used it
+    pending = {} # loop -> evicted session, closed by the owner thread on its next session call
+    address2calls = {} # address -> number of calls
+    lock = threading.Lock()
+
+    @classmethod
+    def configure(cls,
+                  limit:int = None,
+                  limit_per_host:int = None,
+                  keepalive_timeout:int = None,
+                  ttl_dns_cache:int = None,
+                  idle_timeout:int = None) -> dict:
+        """
+        Sets the pool limits, these apply to the sessions created after this call
+        """
+        config = dict(limit=limit, limit_per_host=limit_per_host, keepalive_timeout=keepalive_timeout,
+                      ttl_dns_cache=ttl_dns_cache, idle_timeout=idle_timeout)
+        for k,v in config.items():
+            if v != None:
+                setattr(cls, k, v)
+        return cls.config_info()
+
+    @classmethod
+    def config_info(cls) -> dict:
+        return {'limit': cls.limit,
+                'limit_per_host': cls.limit_per_host,
+                'keepalive_timeout': cls.keepalive_timeout,
+                'ttl_dns_cache': cls.ttl_dns_cache,
+                'idle_timeout': cls.idle_timeout}
+
+    @classmethod
+    def session(cls, address:str = None) -> aiohttp.ClientSession:
+        """
+        Returns the session of the running loop, must be called inside a coroutine
+        """
+        loop = asyncio.get_running_loop()
+        with cls.lock:
+            stale = cls.pending.pop(loop, None)
+            if stale != None and not stale.closed:
+                loop.create_task(stale.close())
+            session = cls.sessions.get(loop)
+            if session == None or session.closed:
+                connector = aiohttp.TCPConnector(limit=cls.limit,
+                                                 limit_per_host=cls.limit_per_host,
+                                                 keepalive_timeout=cls.keepalive_timeout,
+                                                 use_dns_cache=True,
+                                                 ttl_dns_cache=cls.ttl_dns_cache)
+                session = aiohttp.ClientSession(connector=connector)
+                cls.sessions[loop] = session
+            cls.last_used[loop] = c.time()
+            cls.owners[loop] = threading.get_ident()
+            if address != None:
+                cls.address2calls[address] = cls.address2calls.get(address, 0) + 1
+        cls.evict()
+        return session
+
+    @classmethod
+    def evict(cls, idle_timeout:int = None, loop:'asyncio.AbstractEventLoop' = None) -> List[str]:
+        """
+        Closes the sessions of closed loops and the ones that were not used for idle_timeout seconds (of the loop if given),
+        the sessions of live loops owned by other threads are marked for closing instead
+        """
+        target_loop = loop
+        idle_timeout = cls.idle_timeout if idle_timeout == None else idle_timeout
+        now = c.time()
+        thread_id = threading.get_ident()
+        evicted = []
+        with cls.lock:
+            for loop in list(cls.pending.keys()):
+                # the owner never came back to close it, so close it once its loop is closed
+                if loop.is_closed():
+                    cls.close_connector(cls.pending.pop(loop))
+                    cls.owners.pop(loop, None)
+            for loop in list(cls.sessions.keys()):
+                if target_loop != None and loop is not target_loop:
+                    continue
+                session = cls.sessions[loop]
+                if loop.is_closed():
+                    cls.close_connector(session)
+                    cls.owners.pop(loop, None)
+                else:
+                    if now - cls.last_used.get(loop, now) <= idle_timeout:
+                        continue
+                    # the session is bound to its loop, so it is only closed here if this thread owns
+                    # the loop and is not running it, otherwise its owner closes it on its next session call
+                    if cls.owners.get(loop) == thread_id and not loop.is_running():
+                        loop.run_until_complete(session.close())
+                        cls.owners.pop(loop, None)
+                    else:
+                        cls.pending[loop] = session
+                cls.sessions.pop(loop)
+                cls.last_used.pop(loop, None)
+                evicted.append(str(loop))
+        return evicted
+
+    @staticmethod
+    def close_connector(session:aiohttp.ClientSession):
+        """
+        Closes the connector of a session whose loop is closed (so session.close cant be awaited),
+        its transports cant be closed through the loop either, so their sockets are closed directly
+        """
+        connector = session.connector
+        if connector == None:
+            return
+        for conns in list(getattr(connector, '_conns', {}).values()):
+            for proto, _ in conns:
+                transport = proto.transport
+                sock = getattr(transport, '_sock', None)
+                if sock != None:
+                    sock.close()
+                    transport._sock = None # closed, so the transport does not warn when it is collected
+        connector._close()
+
+    @classmethod
+    def close(cls, loop:'asyncio.AbstractEventLoop' = None) -> dict:
+        return {'evicted': cls.evict(idle_timeout=-1, loop=loop)}
+
+    @classmethod
+    def stats(cls) -> dict:
+        connections = 0
+        for session in cls.sessions.values():
+            connector = session.connector
+            if connector != None:
+                connections += sum(len(v) for v in getattr(connector, '_conns', {}).values())
+        return {'sessions': len(cls.sessions),
+                'idle_connections': connections,
+                'address2calls': dict(cls.address2calls),
+                **cls.config_info()}
+
+    @classmethod
+    def test(cls):
+        async def get_sessions():
+            return cls.session('0.0.0.0:8888'), cls.session('0.0.0.0:8889')
+        loop = asyncio.new_event_loop()
+        a, b = loop.run_until_complete(get_sessions())
+        assert a is b, 'the sessions of the same loop should be shared'
+        cls.close()
+        assert a.closed, 'the session should be closed'
+        loop.close()
+        # the sessions of the loops that were closed (asyncio.run) are closed, not leaked
+        async def get_session():
+            return cls.session('0.0.0.0:8888')
+        sessions = [asyncio.run(get_session()) for i in range(2)]
+        cls.evict()
+        assert all(s.closed for s in sessions), 'the sessions of closed loops should be closed'
+        assert not any(s in cls.sessions.values() for s in sessions)
+        # the idle loop of another thread is not run from here, its owner closes the session
+        loop = asyncio.new_event_loop()
+        evicted, resumed = threading.Event(), threading.Event()
+        result = {}
+        def owner():
+            result['old'] = loop.run_until_complete(get_session())
+            evicted.set()
+            resumed.wait()
+            async def reuse():
+                session = cls.session('0.0.0.0:8888')
+                await asyncio.sleep(0)
+                return session
+            result['new'] = loop.run_until_complete(reuse())
+            loop.close()
+        thread = threading.Thread(target=owner)
+        thread.start()
+        evicted.wait()
+        cls.close()
+        assert not result['old'].closed, 'the session of another thread loop should not be closed here'
+        assert cls.pending.get(loop) is result['old'], 'the session should be marked for closing'
+        resumed.set()
+        thread.join()
+        assert result['old'].closed, 'the owner should close the marked session'
+        assert result['new'] is not result['old'] and loop not in cls.pending
+        cls.evict()
+        assert result['new'].closed, 'the session of the closed loop should be closed'
+        return {'success': True, 'msg': 'client pool test passed'}
+
+# close the sessions on exit, so the connections are not left unclosed
+atexit.register(Pool.close)
@@ -1,57 +1,247 @@
 import commune as c
 import os
+import json
+import threading
+import atexit
+from typing import *
 
 class History(c.Module):
-    def __init__(self, folder_path='history'):
+    """
+    An append only history log. Items are buffered in memory and flushed in batches
+    by a background thread into jsonl segments ({start_timestamp}.jsonl), which are
+    rotated every segment_interval seconds and removed after retention seconds.
+    """
+    instances = {} # folder_path -> history (shared within the process)
+    instances_lock = threading.Lock()
+
+    def __init__(self,
+                 folder_path='history',
+                 flush_interval:float = 1.0, # seconds between flushes
+                 max_buffer:int = 1000, # flush as soon as the buffer has this many items
+                 segment_interval:int = 3600, # seconds before rotating to a new segment
+                 retention:int = 7*24*3600, # seconds a segment is kept (None keeps them forever)
+                 sweep_interval:int = 600, # seconds between the removals of the expired segments
+                 fsync:bool = False):
         self.folder_path = self.resolve_path(folder_path)
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.segment_interval = segment_interval
+        self.retention = retention
+        self.sweep_interval = sweep_interval
+        self.fsync = fsync
+        self.segment = None # the path of the current segment (found once, then rotated in memory)
+        self.last_sweep = 0
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock() # one writer at a time, so rotations dont race
+        self.flush_event = threading.Event()
+        self.flush_thread = None
+        atexit.register(self.flush)
+
+    @classmethod
+    def shared(cls, folder_path='history', **kwargs) -> 'History':
+        """
+        Returns the history of the folder, so all writers in the process share one buffer
+        """
+        folder_path = cls.resolve_path(folder_path)
+        with cls.instances_lock:
+            if folder_path not in cls.instances:
+                cls.instances[folder_path] = cls(folder_path=folder_path, **kwargs)
+            return cls.instances[folder_path]
 
     def set_folder_path(self, path):
         self.folder_path = self.resolve_path(path) # set the folder path to the resolved path
         assert os.path.isdir(self.folder_path), f"History path {self.folder_path} does not exist" # check if the path exists
         c.print(f"History path: {self.folder_path}", color='green') # print the path
-        
+
     def add(self, item:dict, path=None):
+        """
+        Buffers the item, which is written by the flush thread (path is kept for compatibility)
+        """
         if 'timestamp' not in item:
             item['timestamp'] = c.timestamp()
-        path = path or (self.folder_path + '/' + str(item['timestamp']))
-        return self.put(path, item)
-    
-    def paths(self, key=None, max_age=None):
-        files = []
-        current_timestamp = c.timestamp()
-        for file in c.ls(self.folder_path):
-            timestamp = self.get_file_timestamp(file)
-            if max_age and current_timestamp - timestamp > max_age:
-                continue
-            files.append(file)
-        return files
-    
-    def get_file_timestamp(self, file):
-        return int(file.split('/')[-1].split('.')[0])
+        with self.lock:
+            self.buffer.append(item)
+            n = len(self.buffer)
+        if self.flush_thread == None or not self.flush_thread.is_alive():
+            self.start_flush_thread()
+        if n >= self.max_buffer:
+            self.flush_event.set()
+        return {'success': True, 'buffered': n}
+
+    def start_flush_thread(self):
+        with self.lock:
+            if self.flush_thread == None or not self.flush_thread.is_alive():
+                self.flush_thread = threading.Thread(target=self.flush_loop, daemon=True, name='history_flush')
+                self.flush_thread.start()
+
+    def flush_loop(self):
+        while True:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                c.print(f'Error flushing history {c.detailed_error(e)}', color='red')
+
+    def item2line(self, item:dict) -> str:
+        try:
+            return json.dumps(item)
+        except (TypeError, ValueError):
+            # non json values (numpy, torch, ...) are serialized
+            return json.dumps(c.serialize(item, mode='dict'))
+
+    def flush(self) -> dict:
+        """
+        Writes the buffered items to the current segment in one append
+        """
+        with self.lock:
+            items, self.buffer = self.buffer, []
+        if len(items) == 0:
+            return {'success': True, 'n': 0}
+        lines = ''.join([self.item2line(item) + '\n' for item in items])
+        with self.write_lock:
+            path = self.current_segment()
+            try:
+                f = open(path, 'a')
+            except FileNotFoundError:
+                # the folder was removed, so the segment starts over
+                self.segment = None
+                path = self.current_segment()
+                f = open(path, 'a')
+            with f:
+                f.write(lines)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            if c.time() - self.last_sweep > self.sweep_interval:
+                self.last_sweep = c.time()
+                self.rm_expired_segments()
+        return {'success': True, 'n': len(items), 'path': path}
+
+    def segment_timestamp(self, path:str) -> int:
+        return int(path.split('/')[-1].split('.')[0])
+
+    def segments(self) -> List[str]:
+        """
+        The segments of this folder (and its subfolders), sorted by their start timestamp
+        """
+        if not os.path.isdir(self.folder_path):
+            return []
+        paths = []
+        for root, dirs, files in os.walk(self.folder_path):
+            for file in files:
+                if file.endswith('.jsonl') and file.split('.')[0].isdigit():
+                    paths.append(os.path.join(root, file))
+        return sorted(paths, key=self.segment_timestamp)
+
+    def current_segment(self) -> str:
+        """
+        The segment to append to, the folder is only listed for the first one (to continue the last segment)
+        """
+        now = c.timestamp()
+        if self.segment == None and os.path.isdir(self.folder_path):
+            segments = sorted([f for f in os.listdir(self.folder_path) if f.endswith('.jsonl') and f.split('.')[0].isdigit()], 
+                              key=self.segment_timestamp)
+            if len(segments) > 0:
+                self.segment = os.path.join(self.folder_path, segments[-1])
+        if self.segment == None or now - self.segment_timestamp(self.segment) >= self.segment_interval:
+            os.makedirs(self.folder_path, exist_ok=True)
+            self.segment = os.path.join(self.folder_path, f'{now}.jsonl')
+        return self.segment
+
+    def rm_expired_segments(self) -> List[str]:
+        if self.retention == None:
+            return []
+        now = c.timestamp()
+        removed = []
+        for path in self.segments():
+            # a segment ends at most segment_interval after it starts
+            if now - self.segment_timestamp(path) - self.segment_interval > self.retention:
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+    def query(self,
+              start:int = None,
+              end:int = None,
+              address:str = None,
+              search:str = None,
+              n:int = None,
+              reverse:bool = True) -> List[dict]:
+        """
+        Scans the segments that overlap [start, end] and returns the items in that
+        time range, optionally filtered by address and a search string
+        """
+        self.flush()
+        segments = self.segments()
+        if start != None:
+            segments = [s for s in segments if self.segment_timestamp(s) + self.segment_interval >= start]
+        if end != None:
+            segments = [s for s in segments if self.segment_timestamp(s) <= end]
+        if reverse:
+            segments = segments[::-1]
+        items = []
+        for path in segments:
+            segment_items = []
+            with open(path, 'r') as f:
+                for line in f:
+                    if search != None and search not in line:
+                        continue
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue # a partial line from a crashed writer
+                    timestamp = item.get('timestamp', 0)
+                    if (start != None and timestamp < start) or (end != None and timestamp > end):
+                        continue
+                    if address != None and item.get('address', None) != address:
+                        continue
+                    segment_items.append(item)
+            items += sorted(segment_items, key=lambda x: x.get('timestamp', 0), reverse=reverse)
+            if n != None and len(items) >= n:
+                return items[:n]
+        return items
 
     def history_paths(self, search=None, n=1000, reverse=False):
-        paths =  self.ls(self.folder_path)
-        sorted_paths = sorted(paths, reverse=reverse)
+        paths = self.segments()
+        sorted_paths = paths[::-1] if reverse else paths
         if search:
-            sorted_paths = [p for p in sorted_paths if search in p] 
+            sorted_paths = [p for p in sorted_paths if search in p]
         return sorted_paths[:n]
-    
-    def history(self, search=None, n=100, reverse=True, idx=None):
-        history_paths = self.history_paths(n=n, reverse=reverse, search=search)
-        history = [c.get(s) for s in history_paths]
+
+    paths = history_paths
+
+    def history(self, search=None, n=100, reverse=True, idx=None, **kwargs):
+        history = self.query(search=search, n=n, reverse=reverse, **kwargs)
         if idx:
             return history[idx]
         return history
-    
+
     def rm_history(self, search=None, n=100, reverse=True):
         history_paths = self.history_paths(n=n, reverse=reverse, search=search)
         for path in history_paths:
-            c.rm(path)
+            os.remove(path)
         return history_paths
-    
+
     def last_n(self, n=1):
         return self.history(n=n)
-    
-
 
-    
+    def test(self, folder_path='history_test'):
+        self = History(folder_path=folder_path, flush_interval=0.1)
+        self.rm(folder_path)
+        now = c.timestamp()
+        for i in range(10):
+            self.add({'address': f'a{i%2}', 'timestamp': now - i, 'i': i})
+        assert len(self.query()) == 10
+        assert len(self.query(address='a0')) == 5
+        assert [item['i'] for item in self.query(start=now-2)] == [0, 1, 2]
+        assert [item['i'] for item in self.query(n=2, reverse=False)] == [9, 8]
+        assert len(self.segments()) == 1
+        # the flushes append to the segment in memory, and a new writer continues it
+        history = History(folder_path=folder_path)
+        history.add({'address': 'a2', 'timestamp': now, 'i': 10})
+        history.flush()
+        assert history.segment == self.segment and len(self.segments()) == 1 and len(self.query()) == 11
+        self.rm(folder_path)
+        return {'success': True, 'msg': 'history test passed'}
@@ -5,18 +5,13 @@ import threading
 from copy import deepcopy
 from typing import Optional, Union, Dict, List, Any, Tuple, Callable
 from munch import Munch
-from rich.console import Console
 import json
 from glob import glob
 import sys
 import argparse
-import asyncio
 from typing import Union, Dict, Optional, Any, List, Tuple
-import nest_asyncio
 import random
 
-nest_asyncio.apply()
-
 # AGI BEGINS 
 class c:
     whitelist = ['info',
@@ -43,12 +38,12 @@ class c:
     datapath = os.path.join(root_path, 'data') # the path to the data folder
     modules_path = os.path.join(lib_path, 'modules') # the path to the modules folder
     repo_path  = os.path.dirname(root_path) # the path to the repo
-    console = Console() # the consolve
     blacklist = [] # blacklist of functions to not to access for outside use
     server_mode = 'http' # http, grpc, ws (websocket)
     default_network = 'local' # local, subnet
     cache = {} # cache for module objects
     home = os.path.expanduser('~') # the home directory
+    process_manager = 'supervisor' # the module behind the pm2_* fns (supervisor or pm2)
     __ss58_format__ = 42 # the ss58 format for the substrate address
 
     def __init__(self, config:Dict=None, **kwargs):
@@ -464,8 +459,14 @@ class c:
         
         data = {'data': v, 'encrypted': encrypt, 'timestamp': c.timestamp()}            
         
-        # default json 
-        getattr(cls,f'put_{mode}')(k, data)
+        storage_cache = c.storage_cache()
+        path = cls.resolve_path(k, extension='json') if mode == 'json' else None
+        if path in storage_cache.entries:
+            # write through to the memory tier if the path is cached
+            storage_cache.write(path, json.dumps(data), data)
+        else:
+            # default json 
+            path = getattr(cls,f'put_{mode}')(k, data)
 
         if verbose:
             c.print(f'put {k} = {v}')
@@ -492,16 +493,17 @@ class c:
 
         Return the value
         '''
-        if cache:
-            if k in cls.cache:
-                return cls.cache[k]
-
-        data = getattr(cls, f'get_{mode}')(k,default=default, **kwargs)
+        if cache and mode == 'json':
+            # the memory tier, which returns a copy of the cached value
+            path = cls.resolve_path(k, extension='json')
+            data = c.storage_cache().get(path, lambda : cls.get_json(path, default=None, **kwargs))
+        else:
+            data = getattr(cls, f'get_{mode}')(k,default=default, **kwargs)
             
 
         if password != None:
             assert data['encrypted'] , f'{k} is not encrypted'
-            data['data'] = c.decrypt(data['data'], password=password, key=key)
+            data = {**data, 'data': c.decrypt(data['data'], password=password, key=key)}
 
         data = data or default
         
@@ -523,12 +525,25 @@ class c:
                 if 'data' in data:
                     data = data['data']
 
-        # local cache
-        if cache:
-            cls.cache[k] = data
-
         return data
 
+    storage_cache_config = {'max_items': 1024, 'max_bytes': 256 * 1024**2, 'ttl': None}
+    _storage_cache = None
+
+    @classmethod
+    def storage_cache(cls, **kwargs) -> 'FileCache':
+        """
+        The memory tier of get(cache=True), shared by every module in the process
+        """
+        if c._storage_cache == None or len(kwargs) > 0:
+            from commune.utils.cache import FileCache
+            c._storage_cache = FileCache(**{**c.storage_cache_config, **kwargs})
+        return c._storage_cache
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        return c.storage_cache().stats()
+
     @classmethod
     def putc(cls, k, v, password=None) -> Munch:
         '''
@@ -880,6 +895,9 @@ class c:
 
     @classmethod
     def port_used(cls, port: int, ip: str = '0.0.0.0', timeout: int = 1):
+        if ip in ['0.0.0.0', '127.0.0.1', 'localhost']:
+            # the local ports are read from the listening sockets (no connect)
+            return c.module('server.ports').port_used(port)
         import socket
         
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
@@ -906,31 +924,17 @@ class c:
     @classmethod
     def used_ports(cls, ports:List[int] = None, ip:str = '0.0.0.0', port_range:Tuple[int, int] = None):
         '''
-        Get availabel ports out of port range
+        Get the used ports of the port range (or ports), from the listening sockets
         
         Args:
             ports: list of ports
             ip: ip address
         
         '''
-        port_range = cls.resolve_port_range(port_range=port_range)
-        if ports == None:
-            ports = list(range(*port_range))
-        
-        async def check_port(port, ip):
-            return cls.port_used(port=port, ip=ip)
-        
-        used_ports = []
-        jobs = []
-        for port in ports: 
-            jobs += [check_port(port=port, ip=ip)]
-                
-        results = cls.gather(jobs)
-        for port, result in zip(ports, results):
-            if isinstance(result, bool) and result:
-                used_ports += [port]
-            
-        return used_ports
+        if ip not in ['0.0.0.0', '127.0.0.1', 'localhost']:
+            ports = ports or list(range(*cls.resolve_port_range(port_range=port_range)))
+            return [port for port in ports if cls.port_used(port=port, ip=ip)]
+        return c.module('server.ports').used_ports(port_range=port_range, ports=ports)
     
 
     get_used_ports = used_ports
@@ -1022,14 +1026,8 @@ class c:
     def get_available_ports(cls, port_range: List[int] = None , ip:str =None) -> int:
         port_range = cls.resolve_port_range(port_range)
         ip = ip if ip else c.default_ip
-        
-        available_ports = []
-        # return only when the port is available
-        for port in range(*port_range): 
-            if not cls.port_used(port=port, ip=ip):
-                available_ports.append(port)
-                  
-        return available_ports
+        used_ports = set(cls.used_ports(port_range=port_range, ip=ip))
+        return [port for port in range(*port_range) if port not in used_ports]
     available_ports = get_available_ports
     
     
@@ -1106,15 +1104,6 @@ class c:
                 
         return ports
     
-    @classmethod
-    def used_ports(cls, ip='0.0.0.0') -> List[int]:
-        used_ports = []
-        for port in range(*cls.port_range()): 
-            if not cls.port_available(port=port, ip=ip):
-                used_ports += [port]
-                
-        return used_ports
-    
     @classmethod
     def free_address(cls, **kwargs):
         return f'{c.ip()}:{c.free_port(**kwargs)}'
@@ -1125,13 +1114,23 @@ class c:
                   port_range: List[int] = None , 
                   ip:str =None, 
                   avoid_ports = None,
-                  random_selection:bool = True) -> int:
+                  random_selection:bool = True,
+                  name:str = None,
+                  reserve:bool = True) -> int:
         
         '''
         
         Get an availabldefe port within the {port_range} [start_port, end_poort] and {ip}
+        Local ports are reserved (for name) until the server binds them (see server.ports)
         '''
         avoid_ports = avoid_ports if avoid_ports else []
+        if ip in [None, '0.0.0.0', '127.0.0.1', 'localhost']:
+            return c.module('server.ports').free_port(ports=ports, 
+                                                      port_range=port_range, 
+                                                      avoid_ports=avoid_ports, 
+                                                      random_selection=random_selection, 
+                                                      name=name, 
+                                                      reserve=reserve)
         
         if ports == None:
             port_range = cls.resolve_port_range(port_range)
@@ -1685,9 +1684,14 @@ class c:
 
         return list(obj.__mro__[1:-1])
 
+    storage_dir_cache = {}
+
     @classmethod
     def storage_dir(cls):
-        return f'{c.cache_path()}/{cls.module_path()}'
+        # resolving the module path is slow, and it does not change for a class
+        if cls not in c.storage_dir_cache:
+            c.storage_dir_cache[cls] = f'{c.cache_path()}/{cls.module_path()}'
+        return c.storage_dir_cache[cls]
     tmp_dir = cache_dir   = storage_dir
     
     @classmethod
@@ -2185,10 +2189,14 @@ class c:
 
     @classmethod
     def get_event_loop(cls, nest_asyncio:bool = True) -> 'asyncio.AbstractEventLoop':
+        import asyncio
         try:
             loop = asyncio.get_event_loop()
         except Exception as e:
             loop = c.new_event_loop(nest_asyncio=nest_asyncio)
+        if nest_asyncio:
+            # applied on the first loop rather than at import
+            cls.nest_asyncio()
         return loop
 
 
@@ -2477,7 +2485,7 @@ class c:
         if port == None:
             # now if we have the server_name, we can repeat the server
             address = c.get_address(name, network=server_network)
-            port = int(address.split(':')[-1]) if address else c.free_port()
+            port = int(address.split(':')[-1]) if address else c.free_port(name=name)
 
         # NOTE REMOVE THIS FROM THE KWARGS REMOTE
         if remote:
@@ -2628,7 +2636,6 @@ class c:
         if 'description' in features:
             info['description'] = self.description
 
-        c.put_json('info', info)
         if cost:
             if hasattr(self, 'cost'):
                 info['cost'] = self.cost
@@ -2957,7 +2964,7 @@ class c:
     
     @classmethod
     def pm2_kill_many(cls, search=None, verbose:bool = True, timeout=10):
-        return c.module('pm2').kill_many(search=search, verbose=verbose, timeout=timeout)
+        return c.module(cls.process_manager).kill_many(search=search, verbose=verbose, timeout=timeout)
     
     @classmethod
     def pm2_kill_all(cls, verbose:bool = True, timeout=10):
@@ -2965,32 +2972,32 @@ class c:
                 
     @classmethod
     def pm2_servers(cls, search=None,  verbose:bool = False) -> List[str]:
-        return  c.module('pm2').servers(verbose=verbose)
+        return  c.module(cls.process_manager).servers(verbose=verbose)
     pm2ls  = pm2_list = pm2_servers
     # commune.run_command('pm2 status').stdout.split('\n')[5].split('    │')[0].split('  │ ')[-1]commune.run_command('pm2 status').stdout.split('\n')[5].split('    │')[0].split('  │ ')[-1] 
     
     @classmethod
     def pm2_exists(cls, name:str) -> bool:
-        return c.module('pm2').exists(name=name)
+        return c.module(cls.process_manager).exists(name=name)
     
     @classmethod
     def pm2_start(cls, *args, **kwargs):
-        return c.module('pm2').start(*args, **kwargs)
+        return c.module(cls.process_manager).start(*args, **kwargs)
     
     @classmethod
     def pm2_launch(cls, *args, **kwargs):
-        return c.module('pm2').launch(*args, **kwargs)
+        return c.module(cls.process_manager).launch(*args, **kwargs)
                               
     @classmethod
     def pm2_restart(cls, name:str, verbose:bool = False, prefix_match:bool = True):
-        return c.module('pm2').restart(name=name, verbose=verbose, prefix_match=prefix_match)
+        return c.module(cls.process_manager).restart(name=name, verbose=verbose, prefix_match=prefix_match)
     @classmethod
     def pm2_restart_prefix(cls, name:str = None, verbose:bool=False):
-        return c.module('pm2').restart_prefix(name=name, verbose=verbose)  
+        return c.module(cls.process_manager).restart_prefix(name=name, verbose=verbose)  
     
     @classmethod
     def pm2_kill(cls, name:str, verbose:bool = False, prefix_match:bool = True):
-        return c.module('pm2').kill(name=name, verbose=verbose, prefix_match=prefix_match)
+        return c.module(cls.process_manager).kill(name=name, verbose=verbose, prefix_match=prefix_match)
     
     @classmethod
     def restart(cls, name:str, mode:str='pm2', verbose:bool = False, prefix_match:bool = True):
@@ -3014,14 +3021,14 @@ class c:
     refresh = reset = restart
     @classmethod
     def pm2_status(cls, verbose=True):
-        return c.module('pm2').status(verbose=verbose)
+        return c.module(cls.process_manager).status(verbose=verbose)
 
     @classmethod
     def pm2_logs_path_map(cls, name=None):
-        return c.module('pm2').logs_path_map(name=name)
+        return c.module(cls.process_manager).logs_path_map(name=name)
     @classmethod
     def pm2_rm_logs( cls, name):
-        return c.module('pm2').rm_logs(name=name)
+        return c.module(cls.process_manager).rm_logs(name=name)
 
     @classmethod
     def pm2_logs(cls, 
@@ -3030,7 +3037,7 @@ class c:
                 verbose: bool=True ,
                 mode: str ='cmd',
                 **kwargs):
-        return c.module('pm2').logs(module=module,
+        return c.module(cls.process_manager).logs(module=module,
                                      tail=tail, 
                                      verbose=verbose, 
                                      mode=mode, 
@@ -3088,8 +3095,49 @@ class c:
             else:
                 module = cls
 
-            return getattr(module, args.function)(*args.args, **args.kwargs)     
-    
+            return getattr(module, args.function)(*args.args, **args.kwargs)
+
+    @classmethod
+    def import_profile(cls, cmd:str = None, code:str = 'import commune', n:int = 20, package:bool = False) -> dict:
+        """
+        Profiles the imports (python -X importtime) of the code, or of a cli command (cmd='namespace'),
+        and returns the top n imports by their own time in ms (or by the top level package if package=True)
+        """
+        import subprocess
+        if cmd != None:
+            argv = cmd.split(' ') if isinstance(cmd, str) else list(cmd)
+            code = f'import sys; sys.argv = {["c"] + argv}; from commune.cli import main; main()'
+        t0 = c.time()
+        p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+        wall_time = c.time() - t0
+        imports = []
+        errors = []
+        for line in p.stderr.split('\n'):
+            if not line.startswith('import time:'):
+                errors.append(line)
+                continue
+            self_time, cum_time, name = line[len('import time:'):].split('|')
+            if not self_time.strip().isdigit():
+                continue # the header
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            imports.append({'module': name.strip(), 'self': int(self_time) / 1000, 'cumulative': int(cum_time) / 1000, 'depth': depth})
+        if package:
+            package2time = {}
+            for x in imports:
+                p_name = x['module'].split('.')[0]
+                package2time[p_name] = package2time.get(p_name, 0) + x['self']
+            top = [{'package': k, 'self': round(v, 2)} for k, v in package2time.items()]
+        else:
+            top = [{'module': x['module'], 'self': round(x['self'], 2), 'cumulative': round(x['cumulative'], 2)} for x in imports]
+        top = sorted(top, key=lambda x: x['self'], reverse=True)[:n]
+        response = {'wall_time': round(wall_time, 3),
+                    'import_time': round(sum(x['cumulative'] for x in imports if x['depth'] == 0) / 1000, 3),
+                    'n': len(imports),
+                    'top': top}
+        if p.returncode != 0:
+            response['error'] = '\n'.join(errors[-10:])
+        return response
+
     @classmethod
     def learn(cls, *args, **kwargs):
         return c.module('model.hf').learn(*args, **kwargs)
@@ -3562,18 +3610,13 @@ class c:
 
     @classmethod
     def resolve_console(cls, console = None, **kwargs):
-        if hasattr(cls,'console'):
-            return cls.console
-    
-        
-        import logging
-        from rich.logging import RichHandler
-        from rich.console import Console
-        logging.basicConfig(level=logging.DEBUG, handlers=[RichHandler()])   
-            # print the line number
-        console = Console()
-        cls.console = console
-        return console
+        if console != None:
+            return console
+        # the console (and rich) is loaded on the first print
+        if not hasattr(c, 'console'):
+            from rich.console import Console
+            c.console = Console()
+        return c.console
     
     @classmethod
     def critical(cls, *args, **kwargs):
@@ -3597,7 +3640,7 @@ class c:
     def print(cls, *text:str, 
               color:str=None, 
               verbose:bool = True,
-              console: Console = None,
+              console: 'Console' = None,
               flush:bool = False,
               **kwargs):
               
@@ -5097,6 +5140,7 @@ class c:
         # wait until they finish, and if they dont, give them none
 
         # return the futures that done timeout or not
+        import asyncio
         async def wait_for(future, timeout):
             try:
                 result = await asyncio.wait_for(future, timeout=timeout)
@@ -5117,6 +5161,7 @@ class c:
     def split_gather(cls,jobs:list, n=3,  **kwargs)-> list:
         if len(jobs) < n:
             return c.gather(jobs, **kwargs)
+        import asyncio
         gather_jobs = [asyncio.gather(*job_chunk) for job_chunk in c.chunk(jobs, num_chunks=n)]
         gather_results = c.gather(gather_jobs, **kwargs)
         results = []
@@ -5137,6 +5182,7 @@ class c:
     def task(cls, fn, timeout=1, mode='asyncio'):
         
         if mode == 'asyncio':
+            import asyncio
             assert callable(fn)
             future = asyncio.wait_for(fn, timeout=timeout)
             return future
@@ -5269,6 +5315,16 @@ class c:
         c.print(dir(fn))
         return hasattr(fn, '__self__') and fn.__self__ == self
 
+    @staticmethod
+    def cache_response(ttl:float = 10):
+        """
+        Marks a fn as idempotent, so its server caches its responses for ttl seconds (see server.cache)
+        """
+        def decorator(fn):
+            fn.__cache__ = {'ttl': ttl}
+            return fn
+        return decorator
+
     @staticmethod
     def retry(fn, trials:int = 3, verbose:bool = True):
         # if fn is a self method, then it will be a bound method, and we need to get the function
@@ -15,6 +15,31 @@ class Test(c.Module):
         assert not os.path.exists(self.resolve_path(k))
         return {'success': True, 'msg': 'test_file passed'}
  
+    def test_cache(self, k='test_cache'):
+        self.put(k, {'a': 1})
+        stats = c.cache_stats()
+        assert self.get(k, cache=True) == {'a': 1}
+        assert self.get(k, cache=True) == {'a': 1}
+        assert c.cache_stats()['hits'] > stats['hits'], 'second read should hit'
+        # another process writing the file invalidates the cached value
+        path = self.resolve_path(k, extension='json')
+        c.put_text(path, c.python2str({'data': {'a': 2}, 'encrypted': False, 'timestamp': c.timestamp()}))
+        assert self.get(k, cache=True) == {'a': 2}, 'stale value after the file changed'
+        self.put(k, {'a': 3})
+        assert self.get(k, cache=True) == {'a': 3}
+        # the readers get copies, so mutating a value does not change the cached one
+        self.get(k, cache=True)['a'] = 4
+        assert self.get(k, cache=True) == {'a': 3}, 'the cached value was mutated'
+        # the write through is stamped with the file it wrote, not the one at the path
+        storage_cache = c.storage_cache()
+        storage_cache.write(path, c.python2str({'data': {'a': 5}}), {'data': {'a': 5}})
+        stamp = storage_cache.entries[path][0]
+        c.put_text(path, c.python2str({'data': {'a': 6}}))
+        assert storage_cache.stamp(path) != stamp and self.get(k, cache=True) == {'a': 6}
+        self.rm(k)
+        assert self.get(k, None, cache=True) == None
+        return {'success': True, 'msg': 'test_cache passed'}
+
     def test_folder_module_detector(self,positives = ['module', 'vali', 'client']):
         for p in positives:
             assert self.is_folder_module(p) == True, f'{p} is a folder module'
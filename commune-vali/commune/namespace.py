@@ -1,4 +1,7 @@
 import commune as c
+import json
+import fcntl
+from contextlib import contextmanager
 from typing import *
 
 # THIS IS WHAT THE INTERNET IS, A BUNCH OF NAMESPACES, AND A BUNCH OF SERVERS, AND A BUNCH OF MODULES.
@@ -27,7 +30,7 @@ class Namespace(c.Module):
         
         path = network 
         
-        namespace = cls.get(path, None, max_age=max_age)
+        namespace = cls.read_namespace(path, max_age=max_age)
 
         if 'subspace' in network:
             if '.' in network:
@@ -48,47 +51,42 @@ class Namespace(c.Module):
                 namespace = cls.build_namespace(network=network)  
    
         namespace = {} if namespace == None else namespace
-        
-        if search != None:
-            namespace = {k:v for k,v in namespace.items() if search in k}
-
-        namespace = {k:v for k,v in namespace.items() if 'Error' not in k} 
 
-        if public:
-            namespace = {k:v.replace(c.default_ip, c.ip()) for k,v in namespace.items()}
-        
         if network == 'local':
-            to_local_ip = lambda x: '0.0.0.0:' + x.split(':')[-1]
-            namespace = {k:to_local_ip(v) for k,v in namespace.items() }
-        
-        namespace = {k:v for k,v in sorted(namespace.items(), key=lambda x: x[0])}
-        
-        namespace = dict(sorted(namespace.items(), key=lambda x: x[0]))
+            to_address = lambda x: '0.0.0.0:' + x.split(':')[-1]
+        elif public:
+            to_address = lambda x: x.replace(c.default_ip, c.ip())
+        else:
+            to_address = lambda x: x
 
-        return namespace
+        # one pass to filter and map, and one sort
+        namespace = {k: to_address(v) for k,v in namespace.items() if 'Error' not in k and (search == None or search in k)}
+        return dict(sorted(namespace.items()))
     
     namespace = namespace
 
     @classmethod
     def register_server(cls, name:str, address:str, network=network) -> None:
-        namespace = cls.namespace(network=network)
-        namespace[name] = address
-        cls.put_namespace(network, namespace)
+        def register(namespace):
+            namespace[name] = address
+            return namespace
+        cls.update_namespace(network, register)
         return {'success': True, 'msg': f'Block {name} registered to {network}.'}
     
     
     @classmethod
     def deregister_server(cls, name:str, network=network) -> Dict:
-
-        namespace = cls.namespace(network=network)
-        address2name = {v: k for k, v in namespace.items()}
-        if name in address2name:
-            name = address2name[name]
-        
-        if name in namespace:
-            del namespace[name]
-            cls.put_namespace(network, namespace)
-            return {'status': 'success', 'msg': f'Block {name} deregistered.'}
+        result = {}
+        def deregister(namespace):
+            address2name = {v: k for k, v in namespace.items()}
+            key = address2name.get(name, name)
+            result['found'] = key in namespace
+            namespace.pop(key, None)
+            result['name'] = key
+            return namespace
+        cls.update_namespace(network, deregister)
+        if result['found']:
+            return {'status': 'success', 'msg': f'Block {result["name"]} deregistered.'}
         else:
             return {'success': False, 'msg': f'Block {name} not found.'}
     
@@ -104,13 +102,73 @@ class Namespace(c.Module):
             address = address.replace(c.default_ip, c.ip()) 
         return address
 
-    
+    ###########################
+    #### NAMESPACE STORE ####
+    # every namespace is a json file that is replaced atomically (write to a temp file + rename)
+    # read-modify-writes hold a file lock, so concurrent servers dont lose each others entries
+    # and reads are cached in the process until the mtime of the file changes
+
+    network2path = {} # resolving a path is slow, so it is done once per network
+
     @classmethod
-    def put_namespace(cls, network:str, namespace:dict) -> None:
+    def namespace_path(cls, network:str) -> str:
+        if network not in cls.network2path:
+            cls.network2path[network] = cls.resolve_path(network, extension='json')
+        return cls.network2path[network]
+
+    @classmethod
+    @contextmanager
+    def lock_namespace(cls, network:str):
+        """
+        Locks the namespace across threads and processes
+        """
+        path = cls.namespace_path(network)
+        with open(path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield path
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    def read_namespace(cls, network:str, max_age:int = None, default=None) -> dict:
+        """
+        Reads the namespace through the storage cache, which is invalidated when the file changes
+        """
+        namespace = cls.get(cls.namespace_path(network), None, max_age=max_age, cache=True)
+        return default if namespace == None else dict(namespace)
+
+    @classmethod
+    def write_namespace(cls, network:str, namespace:dict) -> str:
+        """
+        Writes the namespace atomically, readers see either the old or the new file
+        """
+        path = cls.namespace_path(network)
+        data = {'data': namespace, 'encrypted': False, 'timestamp': c.timestamp()}
+        return c.storage_cache().write(path, json.dumps(data), data)
+
+    @classmethod
+    def update_namespace(cls, network:str, fn:Callable) -> dict:
+        """
+        Applies fn to the latest namespace under the lock, and writes the result
+        """
+        with cls.lock_namespace(network):
+            namespace = cls.read_namespace(network, default={})
+            namespace = fn(namespace)
+            cls.write_namespace(network, cls.dedup_namespace(namespace))
+        return namespace
+
+    @classmethod
+    def dedup_namespace(cls, namespace:dict) -> dict:
+        # one name per address (the last one wins)
         address2name = {v: k for k, v in namespace.items()}
-        namespace = {v:k for k,v in address2name.items()}
+        return {v:k for k,v in address2name.items()}
+
+    @classmethod
+    def put_namespace(cls, network:str, namespace:dict) -> None:
         assert isinstance(namespace, dict), 'Namespace must be a dict.'
-        return cls.put(network, namespace)        
+        with cls.lock_namespace(network):
+            return cls.write_namespace(network, cls.dedup_namespace(namespace))
     
     add_namespace = put_namespace
     
@@ -140,7 +198,7 @@ class Namespace(c.Module):
     
     @classmethod
     def networks(cls) -> dict:
-        return [p.split('/')[-1].split('.')[0] for p in cls.ls()]
+        return [p.split('/')[-1].split('.')[0] for p in cls.ls() if p.endswith('.json')]
     
     @classmethod
     def namespace_exists(cls, network:str) -> bool:
@@ -173,44 +231,6 @@ class Namespace(c.Module):
         return {'success': True, 'msg': 'Servers checked.'}
     
 
-    @classmethod
-    def build_namespace(cls,
-                        timeout:int = 10,
-                        network:str = 'local', 
-                        verbose=True)-> dict:
-        '''
-        The module port is where modules can connect with each othe.
-        When a module is served "module.serve())"
-        it will register itself with the namespace_local dictionary.
-        '''
-        namespace = {}
-        ip = c.ip()
-        addresses = [ip+':'+str(p) for p in c.used_ports()]
-        future2address = {}
-        for address in addresses:
-            f = c.submit(c.call, params=[address+'/server_name'], timeout=timeout)
-            future2address[f] = address
-        futures = list(future2address.keys())
-        c.print(f'Updating namespace {network} with {len(futures)} addresses')
-
-        try:
-            for f in c.as_completed(futures, timeout=timeout):
-                address = future2address[f]
-                try:
-                    name = f.result()
-                    namespace[name] = address
-                    c.print(f'Updated {name} to {address}', color='green', verbose=verbose)
-                except Exception as e:
-                    c.print(f'Error {e} with {address}', color='red', verbose=verbose)
-        except Exception as e:
-            c.print(f'Timeout error {e}', color='red', verbose=verbose)
-
-        cls.put_namespace(network, namespace)
-
-            
-        return namespace
-
-    
     @classmethod
     def migrate_namespace(cls, network:str='local'):
         namespace = cls.get_json('local_namespace', {})
@@ -381,6 +401,11 @@ class Namespace(c.Module):
         assert cls.namespace_exists(network) == False
         cls.rm_namespace(network2)
         assert cls.namespace_exists(network2) == False
+
+        # concurrent registrations should not lose entries
+        c.wait([c.submit(cls.register_server, [f'test{i}', f'0.0.0.0:{i}', network]) for i in range(20)])
+        assert len(cls.namespace(network=network)) == 20, f'Lost registrations {cls.namespace(network=network)}'
+        cls.rm_namespace(network)
         
         return {'success': True, 'msg': 'Namespace tests passed.'}
     
@@ -389,22 +414,32 @@ class Namespace(c.Module):
     def build_namespace(cls,
                         timeout:int = 2,
                         network:str = 'local', 
+                        full:bool = False,
                         verbose=True)-> dict:
         '''
         The module port is where modules can connect with each othe.
         When a module is served "module.serve())"
         it will register itself with the namespace_local dictionary.
+
+        The rebuild is incremental: entries whose port is still used are kept,
+        entries whose port is free are dropped, and only the new ports are probed (all of them if full).
         '''
-        namespace = {}
         ip = c.ip()
-        addresses = [ip+':'+str(p) for p in c.used_ports()]
+        used_ports = set(c.used_ports())
+        port2name = {} if full else {int(v.split(':')[-1]): k for k,v in (cls.read_namespace(network) or {}).items()}
+        # the ports of our servers are named by the port registry, so only unknown ports are called
+        registered = {p: name for p, name in c.module('server.ports').port2name().items() if p in used_ports}
+        port2name.update(registered)
+        new_ports = [p for p in used_ports if p not in port2name]
         future2address = {}
-        for address in addresses:
+        for port in new_ports:
+            address = ip+':'+str(port)
             f = c.submit(c.call, params=[address+'/server_name'], timeout=timeout)
             future2address[f] = address
         futures = list(future2address.keys())
-        c.print(f'Updating namespace {network} with {len(futures)} addresses')
+        c.print(f'Updating namespace {network} with {len(futures)}/{len(used_ports)} addresses')
 
+        probed = {name: ip+':'+str(port) for port, name in registered.items()}
         try:
             for f in c.as_completed(futures, timeout=timeout):
                 address = future2address[f]
@@ -415,17 +450,22 @@ class Namespace(c.Module):
                     if isinstance(name, dict) and 'error' in name:
                         c.print(f'Error {name} with {address}', color='red', verbose=verbose)
                     else:
-                        namespace[name] = address
+                        probed[name] = address
                     c.print(f'Updated {name} to {address}', color='green', verbose=verbose)
                 except Exception as e:
                     c.print(f'Error {e} with {address}', color='red', verbose=verbose)
         except Exception as e:
             c.print(f'Timeout error {e}', color='red', verbose=verbose)
 
-        cls.put_namespace(network, namespace)
+        def rebuild(namespace):
+            # servers registered while probing are kept, as their ports are used
+            if full:
+                namespace = {}
+            namespace = {k:v for k,v in namespace.items() if int(v.split(':')[-1]) in used_ports}
+            namespace.update(probed)
+            return namespace
 
-            
-        return namespace
+        return cls.update_namespace(network, rebuild)
 
     
     @classmethod
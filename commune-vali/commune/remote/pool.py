@@ -0,0 +1,362 @@
+import commune as c
+import socket
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+
+def start_test_server(user:str = 'test', pwd:str = 'test') -> Tuple[dict, dict]:
+    """
+    Starts an in-process ssh server (for the test), that runs the commands in a local shell
+    """
+    import paramiko
+    import subprocess
+    host_key = paramiko.RSAKey.generate(2048)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(100)
+    stats = {'connections': 0, 'transports': []}
+
+    class TestServer(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return 'password'
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL if (username, password) == (user, pwd) else paramiko.AUTH_FAILED
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        def check_channel_exec_request(self, channel, command):
+            def run():
+                p = subprocess.run(command, shell=True, capture_output=True)
+                channel.sendall(p.stdout)
+                channel.sendall_stderr(p.stderr)
+                channel.send_exit_status(p.returncode)
+                channel.close()
+            threading.Thread(target=run, daemon=True).start()
+            return True
+
+    def accept():
+        while True:
+            conn, _ = sock.accept()
+            stats['connections'] += 1
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(host_key)
+            transport.start_server(server=TestServer())
+            stats['transports'].append(transport)
+
+    threading.Thread(target=accept, daemon=True).start()
+    return {'host': '127.0.0.1', 'port': sock.getsockname()[1], 'user': user, 'pwd': pwd}, stats
+
+
+class SSHPool(c.Module):
+    """
+    A pool of authenticated ssh transports, one per host.
+
+    A transport is opened on the first command to its host (and again if it drops), and stays
+    alive (with keepalives) for the next commands. Each command runs as a channel over the transport,
+    so concurrent commands to a host share one handshake, up to max_channels at a time
+    (sshd allows MaxSessions, 10 by default, channels per connection).
+    """
+    connection_errors = (socket.error, EOFError, TimeoutError)
+
+    def __init__(self,
+                 max_channels:int = 8, # concurrent channels per transport
+                 connect_timeout:float = 10, # seconds for the tcp connect, banner and auth
+                 keepalive:int = 30, # seconds between keepalives (0 to disable)
+                 key_policy:str = 'auto_add_policy', # the default, a host can set its own key_policy
+                 poll_interval:float = 0.01, # seconds between reads of the async channels
+                 **kwargs):
+        import paramiko
+        self.paramiko = paramiko
+        self.connection_errors = self.connection_errors + (paramiko.SSHException,)
+        self.max_channels = max_channels
+        self.connect_timeout = connect_timeout
+        self.keepalive = keepalive
+        self.key_policy = key_policy
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.name2conn = {} # host name -> {'client', 'key_policy', 'lock', 'channels', 'connects'}
+        self.executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='ssh_pool') # opens the async channels
+
+    @staticmethod
+    def host_name(host:dict) -> str:
+        return f'{host["user"]}@{host["host"]}:{host["port"]}'
+
+    def conn(self, host:dict) -> dict:
+        name = self.host_name(host)
+        with self.lock:
+            if name not in self.name2conn:
+                self.name2conn[name] = {'client': None,
+                                        'key_policy': None, # the policy the client was connected with
+                                        'lock': threading.Lock(), # held while (re)connecting
+                                        'channels': threading.Semaphore(self.max_channels),
+                                        'connects': 0,
+                                        'commands': 0}
+            return self.name2conn[name]
+
+    def transport(self, host:dict, reconnect:bool = False):
+        """
+        The live transport of the host, which is (re)connected lazily, and again if the
+        host asks for another key policy than the one it was connected with
+        """
+        conn = self.conn(host)
+        key_policy = host.get('key_policy', self.key_policy)
+        with conn['lock']:
+            client = conn['client']
+            if client != None and not reconnect and conn['key_policy'] == key_policy and client.get_transport() != None and client.get_transport().is_active():
+                return client.get_transport()
+            if client != None:
+                client.close()
+            client = self.paramiko.SSHClient()
+            if key_policy == 'auto_add_policy':
+                client.set_missing_host_key_policy(self.paramiko.AutoAddPolicy())
+            else:
+                client.load_system_host_keys()
+            client.connect(host['host'],
+                           port=int(host['port']),
+                           username=host['user'],
+                           password=host.get('pwd'),
+                           key_filename=host.get('key'),
+                           timeout=self.connect_timeout,
+                           banner_timeout=self.connect_timeout,
+                           auth_timeout=self.connect_timeout)
+            if self.keepalive:
+                client.get_transport().set_keepalive(self.keepalive)
+            conn['client'] = client
+            conn['key_policy'] = key_policy
+            conn['connects'] += 1
+            return client.get_transport()
+
+    def open_channel(self, host:dict, command:str, sudo:bool = False, timeout:float = None):
+        """
+        Opens a channel and runs the command on it, reconnecting once if the transport is dead
+        """
+        for trial in range(2):
+            try:
+                channel = self.transport(host, reconnect=trial > 0).open_session(timeout=timeout or self.connect_timeout)
+                break
+            except self.connection_errors as e:
+                if trial == 1:
+                    raise e
+        channel.exec_command(command)
+        if sudo:
+            channel.sendall(host['pwd'] + '\n')
+        self.conn(host)['commands'] += 1
+        return channel
+
+    @staticmethod
+    def build_command(command:str, host:dict, cwd:str = None, sudo:bool = False, container:str = None) -> str:
+        if cwd != None:
+            command = f'cd {cwd} && {command}'
+        if sudo and host['user'] != 'root':
+            command = "sudo -S -p '' %s" % command
+        if container != None:
+            command = f'docker exec {container} {command}'
+        return command
+
+    def run(self, host:dict, command:str, cwd:str = None, sudo:bool = False, container:str = None, timeout:float = None) -> dict:
+        """
+        Runs a command on a host, and returns its exit code, stdout and stderr
+        """
+        t0 = c.time()
+        command = self.build_command(command, host, cwd=cwd, sudo=sudo, container=container)
+        with self.conn(host)['channels']:
+            channel = self.open_channel(host, command, sudo=sudo)
+            try:
+                channel.settimeout(timeout)
+                # stderr is read in a thread, so a full stderr window does not block stdout
+                stderr = []
+                thread = threading.Thread(target=lambda: stderr.append(channel.makefile_stderr('rb').read()), daemon=True)
+                thread.start()
+                stdout = channel.makefile('rb').read().decode(errors='replace')
+                thread.join(timeout)
+                stderr = b''.join(stderr).decode(errors='replace')
+                exit_code = channel.recv_exit_status()
+            finally:
+                channel.close()
+        return {'host': self.host_name(host), 'exit_code': exit_code, 'stdout': stdout, 'stderr': stderr, 'latency': c.time() - t0}
+
+    def stream(self, host:dict, command:str, cwd:str = None, sudo:bool = False, container:str = None):
+        """
+        Yields the lines of stdout, then of stderr, of a command on a host
+        """
+        command = self.build_command(command, host, cwd=cwd, sudo=sudo, container=container)
+        with self.conn(host)['channels']:
+            channel = self.open_channel(host, command, sudo=sudo)
+            try:
+                for f in [channel.makefile('r'), channel.makefile_stderr('r')]:
+                    for line in f:
+                        yield line
+            finally:
+                channel.close()
+
+    # ASYNC FAN OUT
+
+    async def async_run(self, host:dict, command:str, on_output:Callable = None, cwd:str = None, sudo:bool = False, container:str = None) -> dict:
+        """
+        Runs a command on a host without blocking the loop, calling on_output(host_name, stream, line)
+        for every line of its output as it arrives
+        """
+        loop = asyncio.get_running_loop()
+        name = self.host_name(host)
+        t0 = c.time()
+        command = self.build_command(command, host, cwd=cwd, sudo=sudo, container=container)
+        conn = self.conn(host)
+        while not conn['channels'].acquire(blocking=False):
+            await asyncio.sleep(self.poll_interval)
+        # the handshake (if any) runs in a thread
+        future = self.executor.submit(self.open_channel, host, command, sudo)
+        try:
+            channel = await asyncio.wrap_future(future, loop=loop)
+        except asyncio.CancelledError:
+            # the thread may still open the channel, so it is closed (and its slot released) once opened
+            future.add_done_callback(lambda f: self.close_opened(f, conn))
+            raise
+        except BaseException as e:
+            conn['channels'].release()
+            raise e
+        try:
+            channel.setblocking(0)
+            output = {'stdout': [b''], 'stderr': [b'']}
+            readers = {'stdout': (channel.recv_ready, channel.recv), 'stderr': (channel.recv_stderr_ready, channel.recv_stderr)}
+            while True:
+                received = False
+                for stream, (ready, recv) in readers.items():
+                    while ready():
+                        data = recv(32768)
+                        received = True
+                        # complete lines are emitted, the rest waits for the next data
+                        lines = (output[stream].pop() + data).split(b'\n')
+                        output[stream] += [l + b'\n' for l in lines[:-1]] + [lines[-1]]
+                        if on_output != None:
+                            for line in lines[:-1]:
+                                on_output(name, stream, line.decode(errors='replace'))
+                if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
+                if not received:
+                    await asyncio.sleep(self.poll_interval)
+            if on_output != None:
+                for stream in output:
+                    if output[stream][-1]:
+                        on_output(name, stream, output[stream][-1].decode(errors='replace'))
+            return {'host': name,
+                    'exit_code': channel.recv_exit_status(),
+                    'stdout': b''.join(output['stdout']).decode(errors='replace'),
+                    'stderr': b''.join(output['stderr']).decode(errors='replace'),
+                    'latency': c.time() - t0}
+        finally:
+            channel.close()
+            conn['channels'].release()
+
+    @staticmethod
+    def close_opened(future, conn:dict):
+        """
+        Closes the channel of an open whose caller was cancelled, and releases its slot
+        """
+        try:
+            if not future.cancelled() and future.exception() == None:
+                future.result().close()
+        finally:
+            conn['channels'].release()
+
+    async def async_fanout(self, hosts:Dict[str, dict], command:str, timeout:float = 30, on_output:Callable = None, **kwargs) -> dict:
+        """
+        Runs a command on every host concurrently, within one global timeout
+        """
+        async def run(name, host):
+            try:
+                return await self.async_run(host, command, on_output=on_output, **kwargs)
+            except Exception as e:
+                return {'host': self.host_name(host), 'exit_code': None, 'error': str(e)}
+        tasks = {name: asyncio.ensure_future(run(name, host)) for name, host in hosts.items()}
+        done, pending = await asyncio.wait(list(tasks.values()), timeout=timeout)
+        for task in pending:
+            task.cancel() # closes its channel, or the channel it is opening once opened
+        results = {}
+        for name, task in tasks.items():
+            results[name] = task.result() if task in done else {'host': self.host_name(hosts[name]), 'exit_code': None, 'error': f'TimeoutError: {timeout} seconds'}
+        exit_codes = {name: r['exit_code'] for name, r in results.items()}
+        return {'success': all(code == 0 for code in exit_codes.values()),
+                'exit_codes': exit_codes,
+                'failed': [name for name, code in exit_codes.items() if code != 0],
+                'results': results}
+
+    def fanout(self, hosts:Dict[str, dict], command:str, timeout:float = 30, verbose:bool = False, **kwargs) -> dict:
+        on_output = kwargs.pop('on_output', None)
+        if verbose and on_output == None:
+            on_output = lambda name, stream, line: c.print(f'[bold]{name}[/bold]', line, color='red' if stream == 'stderr' else None)
+        return c.gather(self.async_fanout(hosts, command, timeout=timeout, on_output=on_output, **kwargs), timeout=timeout + 1)
+
+    async def async_stream(self, hosts:Dict[str, dict], command:str, timeout:float = 30, **kwargs):
+        """
+        Yields (host name, stream, line) as the output of the hosts arrives, then ('exit_codes', None, exit_codes)
+        """
+        queue = asyncio.Queue()
+        task = asyncio.ensure_future(self.async_fanout(hosts, command, timeout=timeout, on_output=lambda *x: queue.put_nowait(x), **kwargs))
+        while not (task.done() and queue.empty()):
+            try:
+                yield await asyncio.wait_for(queue.get(), timeout=self.poll_interval * 10)
+            except asyncio.TimeoutError:
+                continue
+        yield ('exit_codes', None, task.result()['exit_codes'])
+
+    def info(self) -> List[dict]:
+        return [{'host': name,
+                 'active': conn['client'] != None and conn['client'].get_transport() != None and conn['client'].get_transport().is_active(),
+                 'connects': conn['connects'],
+                 'commands': conn['commands']} for name, conn in self.name2conn.items()]
+
+    def close(self, host:dict = None):
+        for name, conn in list(self.name2conn.items()):
+            if host == None or name == self.host_name(host):
+                if conn['client'] != None:
+                    conn['client'].close()
+                self.name2conn.pop(name)
+
+    @classmethod
+    def test(cls, n_hosts:int = 3, n_commands:int = 20):
+        servers = [start_test_server() for i in range(n_hosts)]
+        hosts = {f'host{i}': host for i, (host, stats) in enumerate(servers)}
+        pool = cls(max_channels=4)
+        # concurrent commands share one transport per host
+        results = c.wait([c.submit(pool.run, [hosts['host0'], f'echo {i}']) for i in range(n_commands)])
+        assert sorted(int(r['stdout']) for r in results) == list(range(n_commands)), results
+        assert servers[0][1]['connections'] == 1, servers[0][1]
+        # the fan out aggregates the output and exit codes of every host
+        lines = []
+        response = pool.fanout(hosts, 'echo out; echo err 1>&2; exit 3', on_output=lambda *x: lines.append(x))
+        assert response['exit_codes'] == {name: 3 for name in hosts}, response
+        assert all(r['stdout'] == 'out\n' and r['stderr'] == 'err\n' for r in response['results'].values()), response
+        assert sorted(lines) == sorted([(pool.host_name(h), s, s.replace('std', '')) for h in hosts.values() for s in ['stdout', 'stderr']]), lines
+        # a dropped transport is reconnected
+        servers[1][1]['transports'][0].close()
+        c.sleep(0.1)
+        assert pool.run(hosts['host1'], 'echo back')['stdout'] == 'back\n'
+        assert servers[1][1]['connections'] == 2
+        # the hosts that do not finish in time have no exit code
+        t0 = c.time()
+        response = pool.fanout({'host2': hosts['host2']}, 'sleep 5', timeout=0.5)
+        assert response['exit_codes'] == {'host2': None} and c.time() - t0 < 2, response
+        # a channel that opens after its command timed out is closed, and its slot released
+        channels, open_channel = [], pool.open_channel
+        def slow_open_channel(*args):
+            c.sleep(0.5)
+            channels.append(open_channel(*args))
+            return channels[-1]
+        pool.open_channel = slow_open_channel
+        response = pool.fanout({'host0': hosts['host0']}, 'echo late', timeout=0.1)
+        assert response['exit_codes'] == {'host0': None}, response
+        c.sleep(1)
+        assert len(channels) == 1 and channels[0].closed, channels
+        assert pool.conn(hosts['host0'])['channels']._value == pool.max_channels
+        pool.open_channel = open_channel
+        # the key policy is per host, and a host with another policy is reconnected under it
+        try:
+            pool.run({**hosts['host0'], 'key_policy': 'reject_policy'}, 'echo rejected')
+            raise AssertionError('the unknown host key was accepted')
+        except pool.paramiko.SSHException:
+            pass
+        assert pool.key_policy == 'auto_add_policy' and pool.run(hosts['host0'], 'echo ok')['stdout'] == 'ok\n'
+        pool.close()
+        return {'success': True, 'msg': 'ssh pool test passed'}
@@ -16,6 +16,32 @@ class Remote(c.Module):
         self.host_data_path = path
         return {'status': 'success', 'msg': f'Host data path set to {path}'}
 
+    _pool = None # the ssh connections are shared by every Remote of the process
+
+    @classmethod
+    def pool(cls):
+        if Remote._pool == None:
+            Remote._pool = c.module('remote.pool')()
+        return Remote._pool
+
+    def resolve_host(self, host:str = None, port = None, user = None, password = None, key = None) -> dict:
+        if host == None:
+            if port == None or user == None or password == None:
+                host = list(self.hosts().values())[0]
+            else:
+                host = {
+                    'host': host,
+                    'port': port,
+                    'user': user,
+                    'pwd': password,
+                }
+        elif isinstance(host, str):
+            host = self.hosts().get(host, None)
+        assert host != None, f'Host not found'
+        if key != None:
+            host['key'] = key
+        return host
+
     def ssh_cmd(self, *cmd_args, 
                 cmd : str = None,
                 port = None, 
@@ -33,6 +59,7 @@ class Remote(c.Module):
                 **kwargs ):
         """s
         Run a command on a remote server using Remote.
+        The connection to the host is kept open in the pool, and reused by the next commands.
 
         :param host: Hostname or IP address of the remote machine.
         :param port: Remote port (typically 22).
@@ -41,98 +68,28 @@ class Remote(c.Module):
         :param command: Command to be executed on the remote machine.
         :return: Command output.
         """
-
-        import paramiko
-        
-        if host == None:
-            if port == None or user == None or password == None:
-                host = list(self.hosts().values())[0]
-            else:
-                host = {
-                    'host': host,
-                    'port': port,
-                    'user': user,
-                    'pwd': password,
-                }
-        else:
-            host = self.hosts().get(host, None)
-        
-
-        host['name'] = f'{host["user"]}@{host["host"]}:{host["port"]}'
-
-            
-
-
-
-        # Create an Remote client instance.
-        client = paramiko.SSHClient()
-        # Automatically add the server's host key (this is insecure and used for demonstration; 
-        # in production, you should have the remote server's public key in known_hosts)
-        if key_policy == 'auto_add_policy':
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        else:
-            client.load_system_host_keys()
-                
-        # Connect to the remote server
-        client.connect(host['host'],
-                       port=host['port'], 
-                       username=host['user'], 
-                       password=host['pwd'])
-
-        # THE COMMAND
-
+        host = {**self.resolve_host(host, port=port, user=user, password=password, key=key), 'key_policy': key_policy}
+        pool = self.pool()
+        name = pool.host_name(host)
         command = ' '.join(cmd_args).strip() if cmd == None else cmd
 
+        c.print(f'Running --> (command={command} host={name} sudo={sudo} cwd={cwd})')
 
-        if cwd != None:
-            command = f'cd {cwd} && {command}'
-
-        # Execute the command on the remote server
-        if sudo and host['user'] != "root":
-            command = "sudo -S -p '' %s" % command
-            
-        if container != None:
-            command = f'docker exec {container} {command}'
-
-        c.print(f'Running --> (command={command} host={host["name"]} sudo={sudo} cwd={cwd})')
-
-        stdin, stdout, stderr = client.exec_command(command)
+        color = c.random_color()
+        def print_output():
+            for line in pool.stream(host, command, cwd=cwd, sudo=sudo, container=container):
+                if verbose:
+                    c.print(f'[bold]{name}[/bold]', line.strip('\n'), color=color)
+                yield line 
 
+        if stream:
+            return print_output()
+        output = ''
         try:
-            if sudo:
-                
-                stdin.write(host['pwd'] + "\n") # Send the password for sudo commands
-                stdin.flush() # Send the password
-
-            color = c.random_color()
-            # Print the output of ls command
-
-            def print_output():
-                for line in stdout.readlines():
-                    if verbose:
-                        c.print(f'[bold]{host["name"]}[/bold]', line.strip('\n'), color=color)
-                    yield line 
-
-                # if there is an stderr, print it
-
-                for line in stderr.readlines():
-                    if verbose:
-                        c.print(f'[bold]{host["name"]}[/bold]', line.strip('\n'))
-                    yield line
-
-            if stream:
-                return print_output()
-            else:
-                output = ''
-                for line in print_output():
-                    output += line 
-
-
-            del stdin, stdout, stderr, client
-
+            for line in print_output():
+                output += line 
         except Exception as e:
             c.print(e)
-
         return output
 
     
@@ -272,39 +229,45 @@ class Remote(c.Module):
 
         assert isinstance(hosts, dict), f'Hosts must be a dict, got {type(hosts)}'
 
-        results = {}
-        errors = {}
-        host2future = {}
-        for host in hosts:
-            host2future[host] = c.submit(self.ssh_cmd, 
-                                            args=commands, 
-                                            kwargs=dict(host=host, cwd=cwd, verbose=verbose,**kwargs),
-                                            return_future=True
-                                            )
-        future2host = {v:k for k,v in host2future.items()}
-
-
-        try:
-            for future in c.as_completed(list(host2future.values()), timeout=timeout):
-                result = future.result()
-                host = future2host[future]
-                if not c.is_error(result):
-                    results[host] = result
-                else:
-                    errors[host]= result
-        except Exception as e:
-            c.print(e)
+        response = self.cmd_exit_codes(*commands, hosts=hosts, cwd=cwd, timeout=timeout, verbose=verbose, **kwargs)
 
+        results = {}
+        for host, result in response['results'].items():
+            if result['exit_code'] == None:
+                c.print(f'{host} --> {result["error"]}', color='red')
+                continue
+            results[host] = (result['stdout'] + result['stderr']).strip('\n')
 
-        if all([v == None for v in results.values()]):
+        if len(results) == 0:
             raise Exception(f'all results are None')
-        
-        for k,v in results.items():
-            if isinstance(v, str):
-                results[k] = v.strip('\n')
 
         return results 
 
+    def cmd_exit_codes(self, *commands, 
+                       hosts:Union[list, dict, str] = None, 
+                       cwd=None, 
+                       timeout=5, 
+                       verbose:bool = True, 
+                       sudo:bool = False,
+                       container:str = None,
+                       key = None,
+                       key_policy = 'auto_add_policy') -> dict:
+        """
+        Runs the commands on the hosts concurrently over the pooled connections, within one global timeout
+        (the key and key_policy apply to every host, as in ssh_cmd)
+        returns {success, exit_codes: {host: exit_code (None if it did not finish)}, failed, results}
+        """
+        if hosts == None:
+            hosts = self.hosts()
+        elif isinstance(hosts, str):
+            hosts = self.hosts(hosts)
+        elif isinstance(hosts, list):
+            all_hosts = self.hosts()
+            hosts = {h:all_hosts[h] for h in hosts}
+        hosts = {name: {**host, 'key_policy': key_policy, **({'key': key} if key != None else {})} for name, host in hosts.items()}
+        command = ' '.join(commands).strip()
+        return self.pool().fanout(hosts, command, timeout=timeout, verbose=verbose, cwd=cwd, sudo=sudo, container=container)
+
     def add_admin(self, timeout=10):
         root_key_address = c.root_key().ss58_address
         return self.cmd(f'c add_admin {root_key_address}', timeout=timeout)
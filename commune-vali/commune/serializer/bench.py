@@ -0,0 +1,204 @@
+import commune as c
+import numpy as np
+import tracemalloc
+import resource
+import subprocess
+import json
+import sys
+import os
+from typing import *
+
+class SerializerBench(c.Module):
+    """
+    Benchmarks the serializer over a sweep of payload shapes and modes,
+    and saves the results per commit so runs can be diffed
+    """
+    modes = ['str', 'bytes', 'frames']
+    payloads = ['nested_dict', 'many_small_arrays', 'few_huge_arrays',
+                'many_small_tensors', 'few_huge_tensors', 'pandas', 'munch']
+
+    def __init__(self, serializer='serializer', **kwargs):
+        self.serializer_name = serializer
+        self.serializer = c.module(serializer)()
+
+    def payload(self, name:str = 'nested_dict', scale:int = 1):
+        if name == 'nested_dict':
+            return {f'k{i}': {'a': i, 'b': [i, str(i), float(i)], 'c': {'d': None, 'e': 'x'*10}} for i in range(1000*scale)}
+        elif name == 'many_small_arrays':
+            return {f'k{i}': np.random.randn(8, 8) for i in range(1000*scale)}
+        elif name == 'few_huge_arrays':
+            return {f'k{i}': np.random.randn(512*scale, 1024).astype(np.float32) for i in range(4)}
+        elif name == 'many_small_tensors':
+            import torch
+            return [torch.randn(8, 8) for i in range(1000*scale)]
+        elif name == 'few_huge_tensors':
+            import torch
+            return [torch.randn(512*scale, 1024) for i in range(4)]
+        elif name == 'pandas':
+            import pandas as pd
+            return pd.DataFrame(np.random.randn(10000*scale, 8), columns=[f'c{i}' for i in range(8)])
+        elif name == 'munch':
+            return c.dict2munch({f'k{i}': {'a': i, 'b': {'c': str(i)}} for i in range(1000*scale)})
+        else:
+            raise ValueError(f'Invalid payload {name}, options are {self.payloads}')
+
+    def payload_size(self, data) -> int:
+        if hasattr(data, 'nbytes'):
+            return int(data.nbytes)
+        if hasattr(data, 'element_size'):
+            return int(data.element_size() * data.nelement())
+        if hasattr(data, 'memory_usage'):
+            return int(data.memory_usage(index=True).sum())
+        if isinstance(data, dict):
+            return sum(self.payload_size(k) + self.payload_size(v) for k,v in data.items())
+        if type(data) in [list, tuple, set]:
+            return sum(self.payload_size(v) for v in data)
+        return sys.getsizeof(data)
+
+    def bench_case(self, payload:str = 'nested_dict', mode:str = 'str', trials:int = 3, scale:int = 1, isolate:bool = True) -> dict:
+        """
+        Benchmarks a payload in a mode. With isolate, the case runs in a fresh process, as the
+        peak rss of a process (ru_maxrss) only grows, so it is only the peak of a case in its own process
+        """
+        if isolate:
+            return self.bench_case_process(payload=payload, mode=mode, trials=trials, scale=scale)
+        rss_start = self.max_rss()
+        data = self.payload(payload, scale=scale)
+        size = self.payload_size(data)
+        serialize_times, deserialize_times = [], []
+        for i in range(trials):
+            t = c.time()
+            serialized = self.serializer.serialize(data, mode=mode)
+            serialize_times.append(c.time() - t)
+            t = c.time()
+            self.serializer.deserialize(serialized)
+            deserialize_times.append(c.time() - t)
+        peak_rss = self.max_rss()
+
+        # a separate traced pass, as tracing slows down the timed ones. the allocations are the
+        # blocks allocated by the pass (the positive diffs per file), and the peak is of the traced memory
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        serialized = self.serializer.serialize(data, mode=mode)
+        deserialized = self.serializer.deserialize(serialized)
+        _, peak_traced = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        not_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diffs = after.filter_traces(not_tracemalloc).compare_to(before.filter_traces(not_tracemalloc), 'filename')
+        allocations = sum(diff.count_diff for diff in diffs if diff.count_diff > 0)
+        del deserialized
+
+        serialize_time = min(serialize_times)
+        deserialize_time = min(deserialize_times)
+        return {
+            'payload': payload,
+            'mode': mode,
+            'payload_bytes': size,
+            'wire_bytes': len(serialized),
+            'wire_ratio': c.round(len(serialized) / max(size, 1), 3),
+            'serialize_mb_per_second': c.round(size / max(serialize_time, 1e-9) / 1e6, 3),
+            'deserialize_mb_per_second': c.round(size / max(deserialize_time, 1e-9) / 1e6, 3),
+            'serialize_seconds': serialize_time,
+            'deserialize_seconds': deserialize_time,
+            'peak_rss_mb': c.round(peak_rss / 1e6, 3),
+            'case_rss_mb': c.round((peak_rss - rss_start) / 1e6, 3), # over the rss of the process before the case
+            'allocations': allocations,
+            'peak_traced_mb': c.round(peak_traced / 1e6, 3),
+        }
+
+    @staticmethod
+    def max_rss() -> int:
+        """
+        The peak rss of this process in bytes (ru_maxrss is in kilobytes on linux)
+        """
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def bench_case_process(self, timeout:float = 600, **kwargs) -> dict:
+        """
+        Runs bench_case in a fresh python process, and returns its result
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([c.libpath] + [p for p in [env.get('PYTHONPATH')] if p])
+        code = ('import json, commune as c; '
+                f'bench = c.module("serializer.bench")(serializer={self.serializer_name!r}); '
+                f'print(json.dumps(bench.bench_case(isolate=False, **{kwargs!r})))')
+        p = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, timeout=timeout)
+        if p.returncode != 0:
+            error = (p.stderr.strip().split('\n') or [''])[-1]
+            if error.startswith(('ImportError', 'ModuleNotFoundError')):
+                raise ImportError(error)
+            raise RuntimeError(f'bench case {kwargs} failed: {error}')
+        return json.loads(p.stdout.strip().split('\n')[-1])
+
+    def bench(self,
+              payloads: List[str] = None,
+              modes: List[str] = None,
+              trials:int = 3,
+              scale:int = 1,
+              tag:str = None,
+              save:bool = True) -> List[dict]:
+        """
+        Runs every payload through every mode, and saves the results under the commit hash (or tag)
+        """
+        payloads = payloads or self.payloads
+        modes = modes or self.modes
+        results = []
+        for payload in payloads:
+            for mode in modes:
+                try:
+                    result = self.bench_case(payload=payload, mode=mode, trials=trials, scale=scale)
+                except ImportError as e:
+                    c.print(f'Skipping {payload} ({e})', color='yellow')
+                    break
+                c.print(result, verbose=False)
+                results.append(result)
+        if save:
+            tag = tag or self.resolve_tag()
+            self.put(f'results/{tag}', {'tag': tag, 'scale': scale, 'trials': trials, 'results': results})
+        return results
+
+    def resolve_tag(self) -> str:
+        try:
+            return c.commit_hash()[:8]
+        except Exception:
+            return str(c.timestamp())
+
+    def runs(self) -> List[str]:
+        return [p.split('/')[-1].replace('.json', '') for p in self.ls('results')]
+
+    def results(self, tag:str = None, df:bool = True):
+        tag = tag or self.resolve_tag()
+        results = self.get(f'results/{tag}', {}).get('results', [])
+        return c.df(results) if df else results
+
+    def diff(self, a:str, b:str = None, threshold:float = 0.1,
+             features = ['serialize_mb_per_second', 'deserialize_mb_per_second', 'wire_bytes', 'peak_traced_mb']) -> List[dict]:
+        """
+        Compares run b (default: the current commit) against run a,
+        and flags every feature that regressed by more than the threshold
+        """
+        b = b or self.resolve_tag()
+        a_results = {(r['payload'], r['mode']): r for r in self.results(a, df=False)}
+        b_results = {(r['payload'], r['mode']): r for r in self.results(b, df=False)}
+        higher_is_better = ['serialize_mb_per_second', 'deserialize_mb_per_second']
+        rows = []
+        for case in sorted(set(a_results) & set(b_results)):
+            row = {'payload': case[0], 'mode': case[1]}
+            for feature in features:
+                a_v, b_v = a_results[case][feature], b_results[case][feature]
+                change = (b_v - a_v) / max(abs(a_v), 1e-9)
+                row[feature] = c.round(change, 3)
+                regressed = change < -threshold if feature in higher_is_better else change > threshold
+                if regressed:
+                    row['regressed'] = row.get('regressed', []) + [feature]
+            rows.append(row)
+        return rows
+
+    def test(self):
+        results = self.bench(payloads=['nested_dict', 'many_small_arrays', 'munch'], trials=1, save=False)
+        assert len(results) == 9, f'expected 9 results, got {len(results)}'
+        for r in results:
+            assert r['wire_bytes'] > 0 and r['serialize_mb_per_second'] > 0, r
+        return {'success': True, 'msg': 'serializer bench passed', 'n': len(results)}
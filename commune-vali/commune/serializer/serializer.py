@@ -8,11 +8,20 @@ from typing import *
 from copy import deepcopy
 import commune as c
 import json
+import struct
+import hashlib
 
 
 class Serializer(c.Module):
+    # binary wire format: magic | header length | msgpack header | raw frames
+    frames_content_type = 'application/x-commune-frames'
+    frames_magic = b'CMF1'
+    frames_prefix = struct.Struct('<4sI')
 
     def serialize(self,x:dict, mode = 'str', copy_value = True):
+        if mode == 'frames':
+            # the frames mode builds a new tree, so we dont need to copy the input
+            return self.dict2frames(x)
         if copy_value:
             x = c.copy(x)
         x = self.resolve_value(x)
@@ -90,6 +99,12 @@ class Serializer(c.Module):
         """Serializes a torch object to DataBlock wire format.
         """
 
+        if isinstance(x, (bytes, bytearray, memoryview)):
+            if self.is_frames(x):
+                return self.frames2dict(x)
+            # the bytes mode (msgpack of the json string)
+            x = self.bytes2dict(x)
+
         if isinstance(x, dict) and isinstance(x.get('data', None), str):
             x = x['data']
 
@@ -130,6 +145,128 @@ class Serializer(c.Module):
             x = x[0]
         return x
 
+    """
+    ################ FRAMES LAND ############################
+    """
+
+    def is_frames(self, data) -> bool:
+        return bytes(data[:len(self.frames_magic)]) == self.frames_magic
+
+    def frames_hash(self, data:bytes) -> str:
+        """
+        The digest that is signed in place of the frames body, so we never hex the payload
+        """
+        return hashlib.sha256(data).hexdigest()
+
+    def dict2frames(self, x) -> bytes:
+        """
+        Packs x into a length prefixed msgpack header followed by the raw buffers 
+        of every numpy array, torch tensor and bytes value (one frame each).
+        """
+        import msgpack
+        frames = []
+        header = {'data': self.resolve_frames(x, frames=frames), 
+                  'frames': [f.nbytes for f in frames]}
+        header = msgpack.packb(header, use_bin_type=True)
+        prefix = self.frames_prefix.pack(self.frames_magic, len(header))
+        return b''.join([prefix, header, *frames])
+
+    def frames2dict(self, data) -> Any:
+        """
+        Unpacks a frames payload, the arrays are views over the payload (no copies)
+        """
+        import msgpack
+        data = memoryview(data)
+        magic, header_size = self.frames_prefix.unpack(data[:self.frames_prefix.size])
+        assert magic == self.frames_magic, f'Invalid frames magic {magic}'
+        offset = self.frames_prefix.size
+        header = msgpack.unpackb(data[offset:offset + header_size], raw=False)
+        offset += header_size
+        frames = []
+        for frame_size in header['frames']:
+            frames.append(data[offset:offset + frame_size])
+            offset += frame_size
+        assert offset == len(data), f'Invalid frames payload, expected {offset} bytes, got {len(data)}'
+        return self.resolve_from_frames(header['data'], frames=frames)
+
+    def resolve_frames(self, x, frames:list):
+        if type(x) == dict:
+            return {k: self.resolve_frames(v, frames=frames) for k,v in x.items()}
+        elif type(x) in [list, tuple, set]:
+            return [self.resolve_frames(v, frames=frames) for v in x]
+        elif type(x) in [int, float, str, bool, type(None)]:
+            return x
+        str_v_type = self.get_type_str(data=x)
+        if hasattr(self, f'{str_v_type}2frame'):
+            frame, meta = getattr(self, f'{str_v_type}2frame')(x)
+            frames.append(frame)
+            return {'data': meta, 
+                    'data_type': str_v_type, 
+                    'frame': len(frames) - 1, 
+                    'serialized': True}
+        # everything else (pandas, munch, ...) uses the string serializers
+        return self.resolve_value(x)
+
+    def resolve_from_frames(self, x, frames:list):
+        if isinstance(x, dict):
+            if self.is_serialized(x):
+                data_type = x['data_type']
+                if 'frame' in x:
+                    return getattr(self, f'frame2{data_type}')(frames[x['frame']], **x['data'])
+                if hasattr(self, f'deserialize_{data_type}'):
+                    return getattr(self, f'deserialize_{data_type}')(data=x['data'])
+                return x
+            return {k: self.resolve_from_frames(v, frames=frames) for k,v in x.items()}
+        elif isinstance(x, list):
+            return [self.resolve_from_frames(v, frames=frames) for v in x]
+        return x
+
+    def numpy2frame(self, data: np.ndarray):
+        data = np.ascontiguousarray(data)
+        assert data.dtype != object, 'object arrays cannot be sent as frames'
+        return memoryview(data.reshape(-1).view(np.uint8)), {'dtype': data.dtype.str, 'shape': list(data.shape)}
+
+    def frame2numpy(self, data, dtype:str, shape:list) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.dtype(dtype)).reshape(shape)
+
+    def torch2frame(self, data: 'torch.Tensor'):
+        import torch
+        data = data.detach().cpu().contiguous()
+        meta = {'dtype': str(data.dtype).split('.')[-1], 'shape': list(data.shape)}
+        # view the tensor as raw bytes so dtypes without a numpy equivalent (bfloat16) work too
+        frame = data.reshape(-1).view(torch.uint8).numpy()
+        return memoryview(frame), meta
+
+    def frame2torch(self, data, dtype:str, shape:list) -> 'torch.Tensor':
+        import torch
+        import warnings
+        if len(data) == 0:
+            return torch.empty(shape, dtype=getattr(torch, dtype))
+        with warnings.catch_warnings():
+            # the tensor shares memory with the (read only) response body
+            warnings.simplefilter('ignore')
+            return torch.frombuffer(data, dtype=getattr(torch, dtype)).reshape(shape)
+
+    def bytes2frame(self, data: bytes):
+        return memoryview(data).cast('B'), {}
+
+    def frame2bytes(self, data) -> bytes:
+        return bytes(data)
+
+    def test_frames(self, size=100):
+        data = {'bro': {'fam': np.random.randn(size, size), 'bro': [np.ones((2,1), dtype=np.int64), b'bytes']}, 
+                'str': 'hey', 'int': 1, 'none': None}
+        serialized = self.serialize(data, mode='frames')
+        assert isinstance(serialized, bytes), f"serialized data must be bytes, not {type(serialized)}"
+        json_size = len(self.serialize(data, mode='str'))
+        assert len(serialized) < json_size, f'frames ({len(serialized)}) are not smaller than json ({json_size})'
+        deserialized = self.deserialize(serialized)
+        assert np.array_equal(deserialized['bro']['fam'], data['bro']['fam'])
+        assert np.array_equal(deserialized['bro']['bro'][0], data['bro']['bro'][0])
+        assert deserialized['bro']['bro'][1] == b'bytes'
+        assert deserialized['str'] == 'hey' and deserialized['int'] == 1 and deserialized['none'] == None
+        return {'success': True, 'frames_size': len(serialized), 'json_size': json_size}
+
     """
     ################ BIG DICT LAND ############################
     """
@@ -333,51 +470,30 @@ class Serializer(c.Module):
     def test(cls, size=1):
         import torch
         self = cls()
+        cases = {
+            'nested': {'bro': {'fam': torch.randn(size,size), 'bro': [np.ones((2,1))]}},
+            'torch': torch.randn(size,size),
+            'numpy': np.random.randn(size,size),
+        }
         stats = {}
-        data = {'bro': {'fam': torch.randn(size,size), 'bro': [np.ones((2,1))]}}
-
-        t = c.time()
-        serialized_data = self.serialize(data)
-        assert isinstance(serialized_data, str), f"serialized_data must be a str, not {type(serialized_data)}"
-        deserialized_data = self.deserialize(serialized_data)
-        c.print(deserialized_data, data)
-    
-        assert deserialized_data['bro']['fam'].shape == data['bro']['fam'].shape
-        assert deserialized_data['bro']['bro'][0].shape == data['bro']['bro'][0].shape
-
-        stats['elapsed_time'] = c.time() - t
-        stats['size_bytes'] = c.sizeof(data)
-        stats['size_bytes_compressed'] = c.sizeof(serialized_data)
-        stats['size_deserialized_data'] = c.sizeof(deserialized_data)
-        stats['compression_ratio'] = stats['size_bytes'] / stats['size_bytes_compressed']
-        stats['mb_per_second'] = c.round((stats['size_bytes'] / stats['elapsed_time']) / 1e6, 3)
-
-        data =  torch.randn(size,size)
-        t = c.time()
-        serialized_data = self.serialize(data)
-        assert isinstance(serialized_data, str), f"serialized_data must be a str, not {type(serialized_data)}"
-        deserialized_data = self.deserialize(serialized_data)
-        assert deserialized_data.shape == data.shape
-
-        stats['elapsed_time'] = c.time() - t
-        stats['size_bytes'] = c.sizeof(data)
-        stats['size_bytes_compressed'] = c.sizeof(serialized_data)
-        stats['size_deserialized_data'] = c.sizeof(deserialized_data)
-        stats['compression_ratio'] = stats['size_bytes'] / stats['size_bytes_compressed']
-        stats['mb_per_second'] = c.round((stats['size_bytes'] / stats['elapsed_time']) / 1e6, 3)
-        
-        data =  np.random.randn(size,size)
-        t = c.time()
-        serialized_data = self.serialize(data, mode='str')
-        assert isinstance(serialized_data, str), f"serialized_data must be a str, not {type(serialized_data)}"
-        deserialized_data = self.deserialize(serialized_data)
-        assert deserialized_data.shape == data.shape
-
-        stats['elapsed_time'] = c.time() - t
-        stats['size_bytes'] = c.sizeof(data)
-        stats['size_bytes_compressed'] = c.sizeof(serialized_data)
-        stats['size_deserialized_data'] = c.sizeof(deserialized_data)
-        stats['compression_ratio'] = stats['size_bytes'] / stats['size_bytes_compressed']
-        stats['mb_per_second'] = c.round((stats['size_bytes'] / stats['elapsed_time']) / 1e6, 3)
-
-        return stats
\ No newline at end of file
+        for name, data in cases.items():
+            t = c.time()
+            serialized_data = self.serialize(data, mode='str')
+            assert isinstance(serialized_data, str), f"serialized_data must be a str, not {type(serialized_data)}"
+            deserialized_data = self.deserialize(serialized_data)
+            if name == 'nested':
+                assert deserialized_data['bro']['fam'].shape == data['bro']['fam'].shape
+                assert deserialized_data['bro']['bro'][0].shape == data['bro']['bro'][0].shape
+            else:
+                assert deserialized_data.shape == data.shape
+
+            case_stats = {}
+            case_stats['elapsed_time'] = c.time() - t
+            case_stats['size_bytes'] = c.sizeof(data)
+            case_stats['size_bytes_compressed'] = c.sizeof(serialized_data)
+            case_stats['size_deserialized_data'] = c.sizeof(deserialized_data)
+            case_stats['compression_ratio'] = case_stats['size_bytes'] / case_stats['size_bytes_compressed']
+            case_stats['mb_per_second'] = c.round((case_stats['size_bytes'] / case_stats['elapsed_time']) / 1e6, 3)
+            stats[name] = case_stats
+
+        return stats
@@ -1,19 +1,33 @@
 import commune as c
+import os
+import threading
 from typing import *
 
 
 class Access(c.Module):
+    """
+    Rate limits the callers of a module with in-memory token buckets.
+
+    Each address has a bucket that holds up to rate_limit tokens and refills at
+    rate_limit tokens per timescale, a call takes one token. The buckets are split
+    over lock stripes, so a check is O(1), thread safe, and never touches the disk.
+    The stakes, users and local keys are refreshed into memory by a background thread.
+
+    The buckets are per process: with workers api processes (forked after this is built), each
+    process has its own sync thread (started on its first check) and allows 1/workers of the rate,
+    so the total stays within the rate, but a caller whose calls land unevenly can be limited earlier.
+    """
 
     sync_time = 0
     timescale_map  = {'sec': 1, 'min': 60, 'hour': 3600, 'day': 86400, 'minute': 60, 'second': 1}
 
-    def __init__(self, 
+    def __init__(self,
                 module : Union[c.Module, str] = None, # the module or any python object
                 network: str =  'main', # mainnet
                 netuid: int = 0, # subnet id
                 timescale:str =  'min', # 'sec', 'min', 'hour', 'day'
                 stake2rate: int =  100.0,  # 1 call per every N tokens staked per timescale
-                stakfrom2rate = 100, 
+                stakfrom2rate = 100,
                 max_rate: int =  1000.0, # 1 call per every N tokens staked per timescale
                 role2rate: dict =  {}, # role to rate map, this overrides the default rate,
                 state_path = f'state_path', # the path to the state
@@ -21,25 +35,48 @@ class Access(c.Module):
                 stake_from_weight = 1.0, # the weight of the staker
                 max_age = 30, # max age of the state in seconds
                 sync_interval: int =  60, #  1000 seconds per sync with the network
-
+                stripes: int = 64, # number of lock stripes over the buckets
+                snapshot_interval: int = None, # seconds between bucket snapshots (None disables them)
+                max_idle: int = 3600, # seconds before an idle bucket is dropped
+                workers: int = 1, # the processes that serve the module, which split the rate
                 **kwargs):
-        
+
         self.set_config(locals())
         self.user_module = c.module("user")()
-        self.address2key = c.address2key()
         self.set_module(module)
         self.state_path = state_path
         if refresh:
             self.rm_state()
-        self.last_time_synced = c.time()
-        self.state = {'sync_time': 0, 
-                      'stake_from': {}, 
-                      'role2rate': role2rate, 
-                      'fn_info': {}}
+        self.period = self.timescale_map[timescale]
+        self.stripes = [{} for _ in range(stripes)] # address -> [tokens, last_refill, rate_limit]
+        self.stripe_locks = [threading.Lock() for _ in range(stripes)]
+        # the state is loaded once, and then only replaced (never mutated) by the sync thread
+        state = self.get(self.state_path, {})
+        self.state = {'sync_time': state.get('sync_time', 0),
+                      'stakes': state.get('stakes', {}),
+                      'role2rate': role2rate,
+                      'fn_info': state.get('fn_info', {})}
+        self.sync_users()
+        if snapshot_interval != None:
+            self.load_snapshot()
+        self.last_snapshot = c.time()
+        self.lock = threading.Lock()
+        self.pid = None
+        self.start()
+
+    def start(self):
+        """
+        Starts the sync thread of this process, again in a forked worker (on its first check)
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                if self.pid != None:
+                    # the locks of the parent may have been copied while held
+                    self.stripe_locks = [threading.Lock() for _ in self.stripes]
+                self.pid = os.getpid()
+                self.thread = c.thread(self.run_loop)
 
-        c.thread(self.run_loop)
 
-        
     def set_module(self, module: c.Module):
         module = module or c.module('module')()
         if isinstance(module, str):
@@ -50,39 +87,92 @@ class Access(c.Module):
         self.blacklist =  list(set(self.module.blacklist + c.blacklist))
 
         return {'success': True, 'msg': f'set module to {module}'}
-    
+
     def run_loop(self):
         while True:
             try:
                 r = self.sync_network()
             except Exception as e:
                 r = c.detailed_error(e)
-            c.sleep(self.config.sync_interval)
+            try:
+                self.sync_users()
+                self.rm_idle_buckets()
+                if self.config.snapshot_interval != None and c.time() - self.last_snapshot > self.config.snapshot_interval:
+                    self.snapshot()
+            except Exception as e:
+                r = c.detailed_error(e)
+            c.sleep(min(self.config.sync_interval, self.config.snapshot_interval or self.config.sync_interval))
 
-    def sync_network(self):
-        state = self.get(self.state_path, {}, max_age=self.config.sync_interval)
-        time_since_sync = c.time() - state.get('sync_time', 0)
-        self.key2address = c.key2address()
+    def sync_users(self):
+        """
+        Refreshes the users, admins and local keys into memory, so verify does not read them from disk
+        """
+        users = self.user_module.users()
+        self.address2role = {k: v.get('role', 'user') for k,v in users.items()}
         self.address2key = c.address2key()
+        return {'success': True, 'users': len(self.address2role), 'keys': len(self.address2key)}
+
+    def sync_network(self):
+        time_since_sync = c.time() - self.state.get('sync_time', 0)
         if time_since_sync > self.config.sync_interval:
-            self.subspace = c.module('subspace')(network=self.config.network)
-            state['stakes'] = self.subspace.stakes(fmt='j', netuid='all', update=False, max_age=self.config.max_age)
-            self.state = state
-            self.put(self.state_path, self.state)
-            c.print(f'🔄 Synced {self.state_path} 🔄\033', color='yellow')
-
-        response = {'success': True, 
-                    'msg': f'synced {self.state_path}', 
+            state = self.get(self.state_path, {}, max_age=self.config.sync_interval)
+            if c.time() - state.get('sync_time', 0) > self.config.sync_interval:
+                self.subspace = c.module('subspace')(network=self.config.network)
+                state['stakes'] = self.subspace.stakes(fmt='j', netuid='all', update=False, max_age=self.config.max_age)
+                state['sync_time'] = c.time()
+                self.put(self.state_path, state)
+                c.print(f'🔄 Synced {self.state_path} 🔄\033', color='yellow')
+            # swap in the new state in one assignment, readers see either the old or the new one
+            self.state = {**self.state, 'stakes': state.get('stakes', {}), 'sync_time': state.get('sync_time', c.time())}
+            time_since_sync = c.time() - self.state['sync_time']
+
+        response = {'success': True,
+                    'msg': f'synced {self.state_path}',
                     'until_sync': int(self.config.sync_interval - time_since_sync),
                     'time_since_sync': int(time_since_sync)}
         return response
 
-    def verify(self, 
-               address='5FNBuR2yVf4A1v5nt3w5oi4ScorraGRjiSVzkXBVEsPHaGq1', 
+    def get_rate_limit(self, address:str, fn:str, role:str = None) -> float:
+        """
+        The calls per timescale of the address, from its role or its stake
+        """
+        role2rate = self.state.get('role2rate', {})
+        if role in role2rate:
+            return role2rate[role]
+        fn_info = self.state.get('fn_info', {}).get(fn, {})
+        stake = self.state.get('stakes', {}).get(address, 0)
+        rate_limit = stake / fn_info.get('stake2rate', self.config.stake2rate)
+        return min(rate_limit, fn_info.get('max_rate', self.config.max_rate))
+
+    def stripe(self, address:str) -> int:
+        return hash(address) % len(self.stripes)
+
+    def consume(self, address:str, rate_limit:float, tokens:float = 1.0) -> Tuple[bool, float]:
+        """
+        Refills the bucket of the address and takes the tokens if it has them
+        """
+        i = self.stripe(address)
+        now = c.time()
+        with self.stripe_locks[i]:
+            bucket = self.stripes[i].get(address)
+            if bucket == None:
+                bucket = self.stripes[i][address] = [rate_limit, now, rate_limit]
+            else:
+                # the stake can change between calls, so the capacity follows the current rate
+                bucket[0] = min(rate_limit, bucket[0] + (now - bucket[1]) * rate_limit / self.period)
+                bucket[1] = now
+                bucket[2] = rate_limit
+            success = bucket[0] >= tokens
+            if success:
+                bucket[0] -= tokens
+            return success, bucket[0]
+
+    def verify(self,
+               address='5FNBuR2yVf4A1v5nt3w5oi4ScorraGRjiSVzkXBVEsPHaGq1',
                fn: str = 'info' ,
               input:dict = None) -> dict:
         """
-        input : dict 
+        input : dict
             fn : str
             address : str
 
@@ -91,93 +181,78 @@ class Access(c.Module):
         if input is not None:
             address = input.get('address', address)
             fn = input.get('fn', fn)
+        if self.pid != os.getpid():
+            self.start()
+
+        role = self.address2role.get(address, None)
 
         # ONLY THE ADMIN CAN CALL ANY FUNCTION, THIS IS A SECURITY FEATURE
         # THE ADMIN KEYS ARE STORED IN THE CONFIG
-        if c.is_admin(address):
+        if role == 'admin':
             return {'success': True, 'msg': f'is verified admin'}
 
-        
         assert fn in self.whitelist , f"Function {fn} not in whitelist={self.whitelist}"
-        assert fn not in self.blacklist, f"Function {fn} is blacklisted={self.blacklist}" 
-        
+        assert fn not in self.blacklist, f"Function {fn} is blacklisted={self.blacklist}"
+
         if address in self.address2key:
             return {'success': True, 'msg': f'address {address} is a local key'}
         if fn.startswith('__') or fn.startswith('_'):
             return {'success': False, 'msg': f'Function {fn} is private'}
-        if address in self.address2key:
-            return {'success': True, 'msg': f'address {address} is in the whitelist'}
 
-        if c.is_user(address):
+        if role != None:
             return {'success': True, 'msg': f'is verified user'}
 
+        role = 'public'
+        rate_limit = self.get_rate_limit(address, fn, role=role)
+        # the rate is split over the worker processes, which keep their own buckets
+        success, tokens = self.consume(address, rate_limit / self.config.workers)
+        user_info = {
+            'success': success,
+            'rate_limit': rate_limit,
+            'tokens': tokens,
+            'period': self.period,
+            'role': role,
+            'stake': self.state.get('stakes', {}).get(address, 0),
+            'timescale': self.config.timescale,
+        }
+        if not success:
+            user_info['error'] = f'Rate limit exceeded, {rate_limit} calls per {self.config.timescale}'
+        return user_info
 
-        current_time = c.time()
-
-        # sync of the state is not up to date 
-        self.sync_network()
+    def buckets(self) -> Dict[str, dict]:
+        buckets = {}
+        for i, stripe in enumerate(self.stripes):
+            with self.stripe_locks[i]:
+                buckets.update({k: list(v) for k,v in stripe.items()})
+        return buckets
 
-        # get the rate limit for the user
-        role2rate = self.state.get('role2rate', {})
+    def rm_idle_buckets(self) -> int:
+        """
+        Drops the buckets that were not used for max_idle seconds (they would be full again anyways)
+        """
+        now = c.time()
+        n = 0
+        for i, stripe in enumerate(self.stripes):
+            with self.stripe_locks[i]:
+                for address in [k for k,v in stripe.items() if now - v[1] > self.config.max_idle]:
+                    del stripe[address]
+                    n += 1
+        return n
+
+    def snapshot(self) -> dict:
+        """
+        Saves the buckets, so the limits survive a restart
+        """
+        buckets = self.buckets()
+        self.put(f'{self.state_path}_buckets', buckets)
+        self.last_snapshot = c.time()
+        return {'success': True, 'buckets': len(buckets)}
 
-        # get the role of the user
-        role = self.user_module.get_role(address) or 'public'
-        rate_limit = role2rate.get(role, 0)
-
-        # stake rate limit
-        stake = self.state.get('stake_from', {}).get(address, 0)
-        # we want to also know if the user has been staked from
-        stake_from = self.state.get('stake_from', {}).get(address, 0)
-        # STEP 1:  FIRST CHECK THE WHITELIST AND BLACKLIST
-
-        total_stake_score = stake 
-
-        # STEP 2: CHECK THE STAKE AND CONVERT TO A RATE LIMIT
-        default_fn_info = {'stake2rate': self.config.stake2rate, 'max_rate': self.config.max_rate}
-        self.state['fn_info'] = self.state.get('fn_info', {})
-        fn2info = self.state['fn_info'].get(fn,default_fn_info)
-        stake2rate = fn2info.get('stake2rate', self.config.stake2rate)
-        
-        rate_limit = (total_stake_score / stake2rate) # convert the stake to a rate
-
-
-        # STEP 3: CHECK THE MAX RATE
-        max_rate = fn2info.get('max_rate', self.config.max_rate)
-        rate_limit = min(rate_limit, max_rate) # cap the rate limit at the max rate
-        
-        # NOW LETS CHECK THE RATE LIMIT
-        self.state['user_info'] = self.state.get('user_info', {})
-        user_info = self.state['user_info'].get(address, {})
-
-        # check if the user has exceeded the rate limit
-        time_since_called = current_time - user_info.get('timestamp', 0)
-        period = self.timescale_map[self.config.timescale]
-        # if the time since the last call is greater than the seconds in the period, reset the requests
-        if time_since_called > period:
-            user_info['rate'] = 0
-        try:
-            assert user_info['rate'] <= rate_limit
-            user_info['success'] = True
-        except Exception as e:
-            user_info['error'] = c.detailed_error(e)
-            user_info['success'] = False
-
-       
-        # update the user info
-        user_info['rate_limit'] = rate_limit
-        user_info['period'] = period
-        user_info['role'] = role
-        user_info['fn2requests'] = user_info.get('fn2requests', {})
-        user_info['fn2requests'][fn] = user_info['fn2requests'].get(fn, 0) + 1
-        user_info['timestamp'] = current_time
-        user_info['stake'] = stake
-        user_info['stake_from'] = stake_from
-        user_info['rate'] = user_info.get('rate', 0) + 1
-        user_info['timescale'] = self.config.timescale
-        # store the user info into the state
-        self.state['user_info'][address] = user_info
-        # check the rate limit
-        return user_info
+    def load_snapshot(self) -> dict:
+        buckets = self.get(f'{self.state_path}_buckets', {})
+        for address, bucket in buckets.items():
+            self.stripes[self.stripe(address)][address] = bucket
+        return {'success': True, 'buckets': len(buckets)}
 
     @classmethod
     def get_access_state(cls, module):
@@ -189,22 +264,41 @@ class Access(c.Module):
         module = cls(module=c.module('module')(),  base_rate=base_rate)
         key = c.get_key(key)
 
-        for i in range(base_rate*3):    
+        for i in range(base_rate*3):
             t1 = c.time()
             result = module.verify(**{'address': key.ss58_address, 'fn': 'info'})
             t2 = c.time()
             c.print(f'🚨 {t2-t1} seconds... 🚨\033', color='yellow')
-    
 
-    
+    @classmethod
+    def test_rate_limit(cls, rate=10, n_threads=8):
+        self = cls(module=c.module('module')(), role2rate={'public': rate}, timescale='hour')
+        from concurrent.futures import ThreadPoolExecutor
+        address = c.module('key').new_key().ss58_address
+        with ThreadPoolExecutor(n_threads) as executor:
+            results = list(executor.map(lambda i: self.verify(address=address, fn='info'), range(rate*3)))
+        n_success = sum([r['success'] for r in results])
+        assert n_success == rate, f'expected {rate} calls to pass, got {n_success}'
+        # a forked worker syncs in its own thread, and allows its share of the rate
+        self = cls(module=c.module('module')(), role2rate={'public': rate}, timescale='hour', workers=2)
+        if hasattr(os, 'fork'):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    results = [self.verify(address=address, fn='info') for i in range(rate)]
+                    synced = self.pid == os.getpid() and self.thread.is_alive()
+                    os._exit(0 if synced and sum(r['success'] for r in results) == rate // 2 else 1)
+                finally:
+                    os._exit(1)
+            assert os.waitpid(pid, 0)[1] == 0, 'the forked worker should sync and allow half of the rate'
+        return {'success': True, 'msg': 'rate limit test passed'}
+
     def rm_state(self):
         self.put(self.state_path, {})
         return {'success': True, 'msg': f'removed {self.state_path}'}
 
-    
+
 
 
 if __name__ == '__main__':
     Access.run()
-
-            
@@ -0,0 +1,174 @@
+import commune as c
+import os
+import math
+import inspect
+import queue
+import threading
+from concurrent.futures import Future
+from typing import *
+
+class Batcher(c.Module):
+    """
+    Collects concurrent calls of a function into dynamic batches.
+
+    The first argument of each call is an item or a list of items. Calls with the same
+    other arguments and a similar item length (the same power of two bucket, so little
+    padding is wasted) are merged, until max_batch_size items are queued or the oldest
+    call waited max_wait seconds. The merged list runs in one call of the function, and
+    its output (a list, an array/tensor along dim 0, or a dict of those) is split back to
+    the callers.
+    """
+
+    def __init__(self,
+                 fn: Callable = None, # the function to batch, it takes a list as its first argument
+                 max_batch_size: int = 16, # the max items per batch
+                 max_wait: float = 0.01, # the max seconds a call waits for others to join its batch
+                 length_fn: Callable = None, # the length of an item (for the buckets)
+                 **kwargs):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.length_fn = length_fn or self.length
+        # the name of the first argument, so it can also be passed as a keyword
+        self.batch_key = next(iter(inspect.signature(fn).parameters), None) if fn != None else None
+        self.queue = queue.Queue()
+        self.pending = {} # key -> [request]
+        self.stats = {'calls': 0, 'batches': 0, 'items': 0, 'max_batch_size': 0}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """
+        Starts the batcher thread of this process, on the first submit (so forked workers start their own)
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.queue = queue.Queue() # the queue of the parent may have been copied mid use
+                self.pending = {}
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run_loop, daemon=True, name='batcher')
+                self.thread.start()
+
+    def length(self, item) -> int:
+        if hasattr(item, 'shape') and len(item.shape) > 0:
+            return int(item.shape[-1])
+        if isinstance(item, (str, list, tuple, dict)):
+            return len(item)
+        return 1
+
+    def bucket(self, items:list) -> int:
+        return max([int(math.log2(max(self.length_fn(x), 1))) for x in items])
+
+    def submit(self, *args, **kwargs) -> Future:
+        """
+        Queues a call, and returns the future of its result
+        """
+        if len(args) == 0 and self.batch_key in kwargs:
+            kwargs = dict(kwargs)
+            args = [kwargs.pop(self.batch_key)]
+        assert len(args) > 0, 'the first argument is the item (or list of items) to batch'
+        if self.pid != os.getpid():
+            self.start()
+        x, args = args[0], tuple(args[1:])
+        is_batch = isinstance(x, list)
+        items = x if is_batch else [x]
+        request = {'items': items,
+                   'is_batch': is_batch,
+                   'args': args,
+                   'kwargs': kwargs,
+                   'future': Future(),
+                   'time': c.time(),
+                   'key': (repr(args), repr(sorted(kwargs.items())), self.bucket(items))}
+        self.queue.put(request)
+        return request['future']
+
+    def __call__(self, *args, **kwargs):
+        return self.submit(*args, **kwargs).result()
+
+    def run_loop(self):
+        while True:
+            timeout = self.max_wait
+            if len(self.pending) > 0:
+                oldest = min([requests[0]['time'] for requests in self.pending.values()])
+                timeout = max(0, oldest + self.max_wait - c.time())
+            try:
+                request = self.queue.get(timeout=timeout if len(self.pending) > 0 else None)
+                self.pending.setdefault(request['key'], []).append(request)
+                # take everything that arrived meanwhile, before deciding what is ready
+                while True:
+                    request = self.queue.get_nowait()
+                    self.pending.setdefault(request['key'], []).append(request)
+            except queue.Empty:
+                pass
+            for key in list(self.pending.keys()):
+                requests = self.pending[key]
+                n = sum([len(r['items']) for r in requests])
+                if n >= self.max_batch_size or c.time() - requests[0]['time'] >= self.max_wait:
+                    self.run_batch(key)
+
+    def run_batch(self, key):
+        requests = self.pending.pop(key)
+        batch, n = [], 0
+        # a call larger than the max batch size runs on its own
+        while len(requests) > 0 and (len(batch) == 0 or n + len(requests[0]['items']) <= self.max_batch_size):
+            request = requests.pop(0)
+            batch.append(request)
+            n += len(request['items'])
+        if len(requests) > 0:
+            self.pending[key] = requests
+        items = [x for r in batch for x in r['items']]
+        try:
+            output = self.fn(items, *batch[0]['args'], **batch[0]['kwargs'])
+            start = 0
+            for r in batch:
+                end = start + len(r['items'])
+                result = self.split(output, start, end)
+                if not r['is_batch'] and isinstance(result, list):
+                    result = result[0]
+                r['future'].set_result(result)
+                start = end
+        except Exception as e:
+            for r in batch:
+                if not r['future'].done():
+                    r['future'].set_exception(e)
+        self.stats['calls'] += len(batch)
+        self.stats['batches'] += 1
+        self.stats['items'] += n
+        self.stats['max_batch_size'] = max(self.stats['max_batch_size'], n)
+
+    def split(self, output, start:int, end:int):
+        if isinstance(output, dict):
+            return {k: self.split(v, start, end) for k,v in output.items()}
+        if isinstance(output, (list, tuple)) or hasattr(output, 'shape'):
+            return output[start:end]
+        raise ValueError(f'Cannot split the output of type {type(output)} over the batch')
+
+    def info(self) -> dict:
+        return {**self.stats,
+                'avg_batch_size': self.stats['items'] / max(self.stats['batches'], 1),
+                'queued': self.queue.qsize() + sum([len(r) for r in self.pending.values()])}
+
+    def test(self, n=32, max_batch_size=8):
+        sizes = []
+        def fn(texts, suffix='!'):
+            sizes.append(len(texts))
+            c.sleep(0.01)
+            return [t + suffix for t in texts]
+        batcher = Batcher(fn=fn, max_batch_size=max_batch_size, max_wait=0.05)
+        futures = [batcher.submit(f'x{i}') for i in range(n)]
+        futures += [batcher.submit(texts=[f'y{i}', f'y{i}'], suffix='?') for i in range(2)]
+        results = [f.result(timeout=10) for f in futures]
+        assert results[:n] == [f'x{i}!' for i in range(n)], results
+        assert results[n:] == [[f'y{i}?', f'y{i}?'] for i in range(2)], results[n:]
+        assert max(sizes) <= max_batch_size and len(sizes) < n, sizes
+        # a forked process starts its own batcher thread
+        if hasattr(os, 'fork'):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    os._exit(0 if batcher.submit('z').result(timeout=10) == 'z!' else 1)
+                finally:
+                    os._exit(1)
+            assert os.waitpid(pid, 0)[1] == 0, 'the batcher should run in the forked process'
+        return {'success': True, 'msg': 'batcher test passed', 'info': batcher.info()}
@@ -0,0 +1,178 @@
+import commune as c
+import json
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import *
+
+class ResponseCache(c.Module):
+    """
+    Caches the responses of the idempotent fns of a server.
+
+    An entry is the response as it is sent (the serialized and signed body, its media type
+    and headers), so a hit skips the fn, the serialization and the signature. Entries are
+    keyed by the sha256 of the fn, its canonical (sorted json) args/kwargs and the content
+    type, expire after the ttl of their fn, and are evicted in lru order once max_bytes of
+    bodies are cached. Concurrent misses of a key are single flight: the first caller
+    computes the response, and the others wait for it (failed responses are shared, not cached).
+    """
+
+    def __init__(self,
+                 fns: Dict[str, dict] = None, # fn -> {'ttl': seconds}
+                 ttl: float = 10, # the default ttl of the fns
+                 max_bytes: int = 64 * 1024**2, # the max bytes of the cached bodies
+                 **kwargs):
+        self.fn2config = {fn: {'ttl': ttl, **(config or {})} for fn, config in (fns or {}).items()}
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> {'body', 'media_type', 'headers', 'expires'}
+        self.inflight = {} # key -> Future of the entry
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'joins': 0, 'expired': 0, 'evictions': 0}
+
+    @property
+    def fns(self) -> List[str]:
+        return list(self.fn2config.keys())
+
+    def key(self, fn:str, args:list = None, kwargs:dict = None, content_type:str = 'json') -> str:
+        data = json.dumps([fn, args or [], kwargs or {}, content_type], sort_keys=True, separators=(',', ':'), default=repr)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def claim(self, key:str) -> Tuple[Optional[dict], Optional[Future], bool]:
+        """
+        Returns (entry, None, False) on a hit, (None, future, False) if the key is being computed
+        by another caller, and (None, future, True) if the caller has to compute it
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None:
+                if entry['expires'] > c.time():
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry, None, False
+                self.pop(key)
+                self.stats['expired'] += 1
+            if key in self.inflight:
+                self.stats['joins'] += 1
+                return None, self.inflight[key], False
+            self.stats['misses'] += 1
+            future = self.inflight[key] = Future()
+            return None, future, True
+
+    def encode(self, response) -> dict:
+        """
+        The body (bytes) of a response, as the api would send it
+        """
+        if isinstance(response, dict):
+            from fastapi.responses import JSONResponse
+            return {'body': JSONResponse(response).body, 'media_type': 'application/json', 'headers': {}}
+        headers = {k: v for k, v in response.headers.items() if k not in ['content-length', 'content-type']}
+        return {'body': response.body, 'media_type': response.media_type, 'headers': headers}
+
+    def resolve(self, fn:str, key:str, future:Future, response, cacheable:bool = True) -> dict:
+        entry = self.encode(response)
+        entry['expires'] = c.time() + self.fn2config[fn]['ttl']
+        with self.lock:
+            self.inflight.pop(key, None)
+            if cacheable and len(entry['body']) <= self.max_bytes:
+                self.pop(key)
+                self.entries[key] = entry
+                self.nbytes += len(entry['body'])
+                while self.nbytes > self.max_bytes:
+                    self.pop(next(iter(self.entries)))
+                    self.stats['evictions'] += 1
+        future.set_result(entry)
+        return entry
+
+    def abort(self, key:str, future:Future, error:Exception):
+        with self.lock:
+            self.inflight.pop(key, None)
+        future.set_exception(error)
+
+    def pop(self, key:str):
+        entry = self.entries.pop(key, None)
+        if entry != None:
+            self.nbytes -= len(entry['body'])
+
+    def get(self, fn:str, args:list, kwargs:dict, compute:Callable, content_type:str = 'json') -> Tuple[dict, bool]:
+        """
+        Returns (entry, hit), where compute() returns (response, success) on a miss
+        """
+        key = self.key(fn, args, kwargs, content_type)
+        entry, future, leader = self.claim(key)
+        if entry != None:
+            return entry, True
+        if not leader:
+            return future.result(), True
+        try:
+            response, success = compute()
+            return self.resolve(fn, key, future, response, cacheable=success), False
+        except Exception as e:
+            if not future.done():
+                self.abort(key, future, e)
+            raise e
+
+    async def async_get(self, fn:str, args:list, kwargs:dict, compute:Callable, content_type:str = 'json') -> Tuple[dict, bool]:
+        """
+        The async version of get, where compute is a coroutine function
+        """
+        key = self.key(fn, args, kwargs, content_type)
+        entry, future, leader = self.claim(key)
+        if entry != None:
+            return entry, True
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            response, success = await compute()
+            return self.resolve(fn, key, future, response, cacheable=success), False
+        except BaseException as e: # including the cancellation of the leader
+            if not future.done():
+                self.abort(key, future, e)
+            raise e
+
+    def response(self, entry:dict):
+        from fastapi.responses import Response
+        return Response(content=entry['body'], media_type=entry['media_type'], headers=entry['headers'])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+        return {'success': True, 'msg': 'cleared the response cache'}
+
+    def info(self) -> dict:
+        n = self.stats['hits'] + self.stats['joins'] + self.stats['misses']
+        return {**self.stats,
+                'hit_rate': (self.stats['hits'] + self.stats['joins']) / n if n > 0 else 0,
+                'items': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'fns': self.fn2config}
+
+    def test(self, n=16):
+        calls = []
+        def compute(x, success=True):
+            calls.append(x)
+            c.sleep(0.1)
+            return {'data': 'x' * x, 'signature': '0x'}, success
+        cache = ResponseCache(fns={'fn': {'ttl': 0.5}}, max_bytes=300)
+        # concurrent misses compute once (single flight), and share the body
+        results = c.wait([c.submit(cache.get, ['fn', [100], {}, lambda: compute(100)]) for i in range(n)])
+        assert len(calls) == 1 and len(set(e['body'] for e, hit in results)) == 1, calls
+        assert sum(not hit for e, hit in results) == 1
+        # the args are canonical
+        assert cache.key('fn', [1], {'a': 1, 'b': 2}) == cache.key('fn', (1,), {'b': 2, 'a': 1})
+        assert cache.get('fn', [100], {}, lambda: compute(100))[1]
+        # the lru entries are evicted over max_bytes
+        cache.get('fn', [101], {}, lambda: compute(101))
+        cache.get('fn', [102], {}, lambda: compute(102))
+        assert cache.info()['evictions'] == 1 and cache.nbytes <= cache.max_bytes, cache.info()
+        # failed responses are not cached, and the entries expire
+        cache.get('fn', [1], {}, lambda: compute(1, success=False))
+        assert not cache.get('fn', [1], {}, lambda: compute(1))[1]
+        c.sleep(0.5)
+        assert not cache.get('fn', [102], {}, lambda: compute(102))[1]
+        assert cache.info()['expired'] == 1, cache.info()
+        return {'success': True, 'msg': 'response cache test passed', 'info': cache.info()}
@@ -0,0 +1,248 @@
+import commune as c
+import os
+import json
+import fcntl
+import socket
+import threading
+from contextlib import contextmanager
+from typing import *
+
+
+class Ports(c.Module):
+    """
+    Allocates the ports of the local servers.
+
+    The used ports are read from the listening sockets in /proc/net/tcp{,6} in one pass
+    (bind probes where there is no /proc), instead of connecting to every port of the range.
+    A registry file maps ports to our servers:
+        {port: {'name', 'pid', 'timestamp', 'state': 'reserved' | 'serving'}}
+    A port is reserved when it is allocated (so concurrent serves dont pick it before the server
+    binds it), and marked as serving by the server once it is up. Reservations expire after
+    reserve_ttl seconds, and serving entries are dropped once their pid is gone.
+    The registry is read and written under a file lock, like the namespace.
+    """
+    reserve_ttl = 60 # seconds a reservation is held until the server binds the port
+    proc_paths = ['/proc/net/tcp', '/proc/net/tcp6']
+    listen_state = '0A'
+
+    @classmethod
+    def listening_ports(cls) -> Optional[Set[int]]:
+        """
+        The ports of the listening tcp sockets (ipv4 and ipv6), or None if there is no /proc
+        """
+        ports = set()
+        found = False
+        for path in cls.proc_paths:
+            try:
+                with open(path) as f:
+                    lines = f.readlines()[1:]
+            except OSError:
+                continue
+            found = True
+            for line in lines:
+                fields = line.split()
+                if len(fields) > 3 and fields[3] == cls.listen_state:
+                    ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+        return ports if found else None
+
+    @classmethod
+    def port_bindable(cls, port:int, ip:str = '0.0.0.0') -> bool:
+        """
+        Probes a port by binding it (no connect, so no timeout)
+        """
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.bind((ip, int(port)))
+                return True
+            except OSError:
+                return False
+
+    @classmethod
+    def used_ports(cls, port_range:List[int] = None, ports:List[int] = None) -> List[int]:
+        if ports == None:
+            port_range = c.resolve_port_range(port_range)
+            ports = range(*port_range)
+        listening = cls.listening_ports()
+        if listening == None:
+            return [p for p in ports if not cls.port_bindable(p)]
+        return [p for p in ports if p in listening]
+
+    @classmethod
+    def port_used(cls, port:int) -> bool:
+        listening = cls.listening_ports()
+        if listening == None:
+            return not cls.port_bindable(port)
+        return int(port) in listening
+
+    # REGISTRY
+
+    @classmethod
+    def registry_path(cls) -> str:
+        if not hasattr(cls, '_registry_path'):
+            cls._registry_path = cls.resolve_path('registry', extension='json')
+        return cls._registry_path
+
+    @classmethod
+    @contextmanager
+    def lock_registry(cls):
+        """
+        Locks the registry across threads and processes
+        """
+        path = cls.registry_path()
+        with open(path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield path
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    def read_registry(cls) -> Dict[int, dict]:
+        try:
+            with open(cls.registry_path()) as f:
+                registry = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {int(k): v for k, v in registry.items()}
+
+    @classmethod
+    def write_registry(cls, registry:Dict[int, dict]):
+        path = cls.registry_path()
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({str(k): v for k, v in registry.items()}))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def pid_alive(pid:int) -> bool:
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True # it exists, but is not ours
+
+    @classmethod
+    def prune(cls, registry:Dict[int, dict], listening:Set[int] = None) -> Dict[int, dict]:
+        """
+        Drops the expired reservations and the servers that are gone
+        """
+        now = c.time()
+        pruned = {}
+        for port, entry in registry.items():
+            if entry['state'] == 'reserved':
+                if now - entry['timestamp'] > cls.reserve_ttl:
+                    continue
+            elif not cls.pid_alive(entry['pid']) or (listening != None and port not in listening):
+                continue
+            pruned[port] = entry
+        return pruned
+
+    @classmethod
+    def update_registry(cls, fn:Callable):
+        """
+        Applies fn to the pruned registry under the lock, and writes the result
+        """
+        with cls.lock_registry():
+            registry = cls.prune(cls.read_registry(), cls.listening_ports())
+            result = fn(registry)
+            cls.write_registry(registry)
+        return result
+
+    @classmethod
+    def registry(cls) -> Dict[int, dict]:
+        return cls.prune(cls.read_registry(), cls.listening_ports())
+
+    @classmethod
+    def free_port(cls,
+                  port_range:List[int] = None,
+                  ports:List[int] = None,
+                  avoid_ports:List[int] = None,
+                  random_selection:bool = True,
+                  name:str = None,
+                  reserve:bool = True) -> int:
+        """
+        Picks a port that is neither used nor reserved, and reserves it (for name)
+        """
+        avoid_ports = set(avoid_ports or [])
+        if ports == None:
+            port_range = c.resolve_port_range(port_range)
+            ports = list(range(*port_range))
+        if random_selection:
+            ports = c.shuffle(list(ports))
+
+        def allocate(registry):
+            listening = cls.listening_ports() or set()
+            for port in ports:
+                if port in avoid_ports or port in listening or port in registry:
+                    continue
+                if not cls.port_bindable(port):
+                    continue # used by a socket that is not listening (or not in /proc)
+                if reserve:
+                    registry[port] = {'name': name, 'pid': os.getpid(), 'timestamp': c.time(), 'state': 'reserved'}
+                return port
+            return None
+
+        port = cls.update_registry(allocate)
+        if port == None:
+            raise Exception(f'ports {ports[0]} to {ports[-1]} are occupied, change the port_range to encompase more ports')
+        return port
+
+    @classmethod
+    def free_ports(cls, n:int = 10, **kwargs) -> List[int]:
+        return [cls.free_port(**kwargs) for i in range(n)]
+
+    @classmethod
+    def register(cls, port:int, name:str, pid:int = None) -> dict:
+        """
+        Marks the port as served by name (from the server process, once it is bound)
+        """
+        entry = {'name': name, 'pid': pid or os.getpid(), 'timestamp': c.time(), 'state': 'serving'}
+        def register(registry):
+            registry[int(port)] = entry
+        cls.update_registry(register)
+        return {'success': True, 'port': int(port), **entry}
+
+    @classmethod
+    def release(cls, port:int = None, name:str = None) -> dict:
+        def release(registry):
+            ports = [p for p, e in registry.items() if p == port or (name != None and e['name'] == name)]
+            for p in ports:
+                registry.pop(p)
+            return ports
+        return {'success': True, 'released': cls.update_registry(release)}
+
+    @classmethod
+    def port2name(cls, port_range:List[int] = None) -> Dict[int, str]:
+        """
+        The names of the servers that are listening on their registered port
+        """
+        listening = cls.listening_ports()
+        return {p: e['name'] for p, e in cls.prune(cls.read_registry(), listening).items()
+                if e['state'] == 'serving' and (listening == None or p in listening)}
+
+    @classmethod
+    def test(cls, n:int = 20):
+        port_range = [52000, 52100]
+        # concurrent allocations never return the same port
+        ports = c.wait([c.submit(cls.free_port, kwargs={'port_range': port_range, 'name': f'test{i}'}) for i in range(n)])
+        assert len(set(ports)) == n, ports
+        # a listening port is used, and is registered to its server
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('0.0.0.0', ports[0]))
+        sock.listen(1)
+        try:
+            assert cls.port_used(ports[0]) and ports[0] in cls.used_ports(port_range)
+            assert ports[0] not in [cls.free_port(port_range=port_range, reserve=False) for i in range(n)]
+            cls.register(ports[0], 'test0')
+            assert cls.port2name(port_range)[ports[0]] == 'test0'
+        finally:
+            sock.close()
+        assert ports[0] not in cls.port2name(port_range) # not listening anymore
+        cls.release(name=None, port=ports[0])
+        for i in range(n):
+            cls.release(name=f'test{i}')
+        assert not any(port_range[0] <= p < port_range[1] for p in cls.registry())
+        return {'success': True, 'msg': 'ports test passed'}
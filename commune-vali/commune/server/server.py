@@ -1,9 +1,17 @@
 import commune as c
 import pandas as pd
 from typing import *
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import os
+import json
+import asyncio
+import inspect
+import socket
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 class Server(c.Module):
     def __init__(
@@ -24,6 +32,11 @@ class Server(c.Module):
         history_path:str = None , 
         nest_asyncio = True,
         new_loop = True,
+        max_workers: int = None, # the max threads for sync functions, verification and serialization
+        workers: int = 1, # the number of processes that share the port
+        batch_fns: Union[List[str], Dict[str, dict]] = None, # fns whose concurrent calls are batched (default: module.batch_fns)
+        cache_fns: Union[List[str], Dict[str, dict]] = None, # fns whose responses are cached (default: module.cache_fns)
+        cache_max_bytes: int = 64 * 1024**2, # the max bytes of the cached responses
         **kwargs
         ) -> 'Server':
 
@@ -36,11 +49,17 @@ class Server(c.Module):
         self.free = free
         self.save_history = save_history
         self.access_token_feature = access_token_feature
+        self.max_workers = max_workers
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
         self.serializer = c.module(serializer)()
-        self.set_history_path(history_path)
+        self.history_path = history_path # resolved once the name is set (see set_module)
+        self.batch_fns = batch_fns
+        self.cache_fns = cache_fns
+        self.cache_max_bytes = cache_max_bytes
         self.set_module(module, key=key,  name=name,  port=port,  access_module=access_module)
 
-    def forward(self, fn:str, input:dict):
+    def forward(self, fn:str, input:dict, content_type:str = 'json'):
         """
         OPTION 1:
         fn (str): the function to call
@@ -56,89 +75,225 @@ class Server(c.Module):
         input (dict): the input to the function
             **kwargs, # the params
             access_token: {timestamp}::{address}::{signature}
-   
+
+        OPTION 3 (frames)
+        input (dict): 
+            data: the sha256 of the frames body (this is what is signed)
+            frames: the binary frames body (see Serializer.dict2frames)
+            signature: the signature of the data
+            address: the address of the caller (ss58_address)
+
+        content_type (str): the content type of the response (json or frames)
+        """
+        request = {'input': input, 'user_info': None}
+        try:
+            request = self.process_input(fn=fn, input=input)
+            if not request['user_info']['success']:
+                return request['user_info']
+        except Exception as e:
+            return self.process_output(fn=fn, request=request, result=c.detailed_error(e), success=False, content_type=content_type)
+        if self.is_cached(fn, request):
+            entry, hit = self.response_cache.get(fn, request['args'], request['kwargs'], 
+                                                 partial(self.execute, fn, request, content_type), content_type=content_type)
+            return self.cached_response(fn, request, entry, hit)
+        return self.execute(fn, request, content_type)[0]
+
+    def execute(self, fn:str, request:dict, content_type:str = 'json') -> Tuple[Any, bool]:
         """
-        user_info = None
+        Calls the fn of a verified request, and returns its response and success
+        """
+        try:
+            if self.is_batched(fn, request):
+                result = self.batchers[fn].submit(*request['args'], **request['kwargs']).result()
+            else:
+                result = self.call_fn(request)
+            if inspect.isawaitable(result):
+                # the fn is async, so we run it on the loop of this thread
+                result = c.get_event_loop().run_until_complete(result)
+            success = not bool(isinstance(result, dict) and 'error' in result) 
+        except Exception as e:
+            result = c.detailed_error(e)
+            success = False 
+        return self.process_output(fn=fn, request=request, result=result, success=success, content_type=content_type), success
 
+    async def async_forward(self, fn:str, input:dict, content_type:str = 'json'):
+        """
+        The async version of forward (see forward for the input format)
+        Async module functions are awaited on the loop, while sync ones, 
+        the verification and the serialization run on the server executor.
+        """
+        loop = asyncio.get_running_loop()
+        request = {'input': input, 'user_info': None}
         try:
-            # you can verify the input with the server key class
-            if 'signature' in input and 'data' in input:
-                assert self.key.verify(input), f"Data not signed with correct key"
-            elif 'access_token' in input:
-                """
-                module_tikcet:
-                {timestamp}::signature::{signature}::address::{address}
-                """
-                assert self.key.verify(input['access_token']), f"Data not signed with correct key"
-                timestamp = int(input['access_token'].split('::signature::')[0])
-                if all([k not in input for k in ['kwargs', 'params', 'args']]):
-                    """
-                    We assume the data is in the input, and the token
-                    """
-                    kwargs = input
-                    kwargspop('access_token')
-                    input['kwargs'] = input
-
-            if 'params' in input:
-                # if the params are in the input, we want to move them to the data
-                if isinstance(input['params'], dict):
-                    input['kwargs'] = input['params']
-                elif isinstance(input['params'], list):
-                    input['args'] = input['params']
-                del input['params']
-
-            if 'args' in input and 'kwargs' in input:
-                input['data'] = {'args': input['args'], 
-                                 'kwargs': input['kwargs'], 
-                                 'timestamp': input['timestamp'], 
-                                 'address': input['address']}
-                
-            # deserialize the data
-            input['data'] = self.serializer.deserialize(input['data'])
-            
-            # here we want to verify the data is signed with the correct key
-            request_staleness = c.timestamp() - input['data'].get('timestamp', 0)
-            assert request_staleness < self.max_request_staleness, f"Request is too old, {request_staleness} > MAX_STALENESS ({self.max_request_staleness})  seconds old"
-            
-            # verify the access module
-            user_info = self.access_module.verify(fn=fn, address=input['address'])
-            if not user_info['success']:
-                return user_info
-            assert 'args' in input['data'], f"args not in input data"
-            data = input['data']
-            args = data.get('args',[])
-            kwargs = data.get('kwargs', {})
-            fn_obj = getattr(self.module, fn)
-            result = fn_obj(*args, **kwargs) if callable(fn_obj) else fn_obj
-            success = bool(isinstance(result, dict) and 'error' in result) 
-
-            # if the result is a future, we need to wait for it to finish
+            request = await loop.run_in_executor(self.executor, partial(self.process_input, fn=fn, input=input))
+            if not request['user_info']['success']:
+                return request['user_info']
+        except Exception as e:
+            return await loop.run_in_executor(self.executor, 
+                                              partial(self.process_output, fn=fn, request=request, result=c.detailed_error(e), success=False, content_type=content_type))
+        if self.is_cached(fn, request):
+            # concurrent misses of the same call wait for the first one (single flight)
+            entry, hit = await self.response_cache.async_get(fn, request['args'], request['kwargs'], 
+                                                             partial(self.async_execute, fn, request, content_type), content_type=content_type)
+            return self.cached_response(fn, request, entry, hit)
+        return (await self.async_execute(fn, request, content_type))[0]
+
+    async def async_execute(self, fn:str, request:dict, content_type:str = 'json') -> Tuple[Any, bool]:
+        """
+        The async version of execute
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if self.is_batched(fn, request):
+                # concurrent calls are merged into one batch by the batcher thread
+                result = await asyncio.wrap_future(self.batchers[fn].submit(*request['args'], **request['kwargs']))
+            elif asyncio.iscoroutinefunction(request['fn_obj']):
+                result = await self.call_fn(request)
+            else:
+                result = await loop.run_in_executor(self.executor, partial(self.call_fn, request))
+            if inspect.isawaitable(result):
+                result = await result
+            success = not bool(isinstance(result, dict) and 'error' in result) 
         except Exception as e:
             result = c.detailed_error(e)
             success = False 
+        response = await loop.run_in_executor(self.executor, 
+                                              partial(self.process_output, fn=fn, request=request, result=result, success=success, content_type=content_type))
+        return response, success
+
+    def process_input(self, fn:str, input:dict) -> dict:
+        """
+        Verifies and deserializes the input, and checks the access of the caller
+        """
+        # the frames are not signed directly (only their hash), so keep them out of the verification
+        frames = input.pop('frames', None)
+
+        # you can verify the input with the server key class
+        if 'signature' in input and 'data' in input:
+            assert self.verifier.verify(input), f"Data not signed with correct key"
+        elif 'access_token' in input:
+            """
+            module_tikcet:
+            {timestamp}::signature::{signature}::address::{address}
+            """
+            assert self.key.verify(input['access_token']), f"Data not signed with correct key"
+            timestamp = int(input['access_token'].split('::signature::')[0])
+            if all([k not in input for k in ['kwargs', 'params', 'args']]):
+                """
+                We assume the data is in the input, and the token
+                """
+                kwargs = input
+                kwargspop('access_token')
+                input['kwargs'] = input
+
+        if 'params' in input:
+            # if the params are in the input, we want to move them to the data
+            if isinstance(input['params'], dict):
+                input['kwargs'] = input['params']
+            elif isinstance(input['params'], list):
+                input['args'] = input['params']
+            del input['params']
+
+        if 'args' in input and 'kwargs' in input:
+            input['data'] = {'args': input['args'], 
+                             'kwargs': input['kwargs'], 
+                             'timestamp': input['timestamp'], 
+                             'address': input['address']}
+            
+        if frames != None:
+            input['data'] = frames
+
+        # deserialize the data
+        input['data'] = self.serializer.deserialize(input['data'])
+        
+        # here we want to verify the data is signed with the correct key
+        request_staleness = c.timestamp() - input['data'].get('timestamp', 0)
+        assert request_staleness < self.max_request_staleness, f"Request is too old, {request_staleness} > MAX_STALENESS ({self.max_request_staleness})  seconds old"
+        
+        # verify the access module
+        user_info = self.access_module.verify(fn=fn, address=input['address'])
+        request = {'input': input, 'user_info': user_info}
+        if not user_info['success']:
+            return request
+        assert 'args' in input['data'], f"args not in input data"
+        data = input['data']
+        request['args'] = data.get('args',[])
+        request['kwargs'] = data.get('kwargs', {})
+        request['fn'] = fn
+        request['fn_obj'] = getattr(self.module, fn)
+        return request
+
+    def set_batchers(self, batch_fns: Union[List[str], Dict[str, dict]] = None):
+        """
+        Creates a batcher per batched fn, whose kwargs are the batcher config (see server.batcher)
+        """
+        batch_fns = batch_fns or getattr(self.module, 'batch_fns', None) or {}
+        if isinstance(batch_fns, list):
+            batch_fns = {fn: {} for fn in batch_fns}
+        self.batchers = {fn: c.module('server.batcher')(fn=getattr(self.module, fn), **kwargs) for fn, kwargs in batch_fns.items()}
+        return {'success': True, 'batch_fns': list(self.batchers.keys())}
+
+    def is_batched(self, fn:str, request:dict) -> bool:
+        # streams are not batched
+        return fn in self.batchers and not request['kwargs'].get('stream', False)
+
+    def set_cache(self, cache_fns: Union[List[str], Dict[str, dict]] = None):
+        """
+        Creates the response cache of the cached fns, whose kwargs are their cache config (see server.cache), 
+        the fns decorated with c.cache_response are cached too
+        """
+        cache_fns = cache_fns or getattr(self.module, 'cache_fns', None) or {}
+        if isinstance(cache_fns, list):
+            cache_fns = {fn: {} for fn in cache_fns}
+        for fn in self.whitelist:
+            config = getattr(getattr(type(self.module), fn, None), '__cache__', None)
+            if isinstance(config, dict) and fn not in cache_fns:
+                cache_fns[fn] = config
+        self.response_cache = c.module('server.cache')(fns=cache_fns, max_bytes=self.cache_max_bytes)
+        return {'success': True, 'cache_fns': self.response_cache.fns}
+
+    def is_cached(self, fn:str, request:dict) -> bool:
+        # streams are not cached
+        return fn in self.response_cache.fn2config and not request['kwargs'].get('stream', False)
+
+    def cached_response(self, fn:str, request:dict, entry:dict, hit:bool):
+        if hit and self.save_history:
+            self.add_history(self.history_item(fn=fn, request=request, result='cached', success=True))
+        return self.response_cache.response(entry)
+
+    def call_fn(self, request:dict):
+        if request.get('fn') in self.fn2cache:
+            return self.cached_fn(request['fn'], *request['args'], **request['kwargs'])
+        fn_obj = request['fn_obj']
+        return fn_obj(*request['args'], **request['kwargs']) if callable(fn_obj) else fn_obj
+
+    def process_output(self, fn:str, request:dict, result, success:bool, content_type:str = 'json'):
+        output = self.history_item(fn=fn, request=request, result=result, success=success)
+        result = self.process_result(result, content_type=content_type)
+
+        if self.save_history:
+            self.add_history(output)
 
+        return result
+
+    def history_item(self, fn:str, request:dict, result, success:bool) -> dict:
+        input = request['input']
+        is_stream = inspect.isgenerator(result) or inspect.isasyncgen(result)
         output = {
             'fn': fn,
             'input': input['data'],
-            'output': result,
+            'output': 'stream' if is_stream else result, # streams are consumed by the response
             'address': input['address'],
             'latency': c.time() - input['data']['timestamp'],
             'datetime': c.time2datetime(input['data']['timestamp']),
-            'user_info': user_info,
+            'user_info': request['user_info'],
             'timestamp': c.timestamp(),
             'success': success,
 
         }
         if not success:
             output['error'] = result
-        result = self.process_result(result)
-
-        if self.save_history:
-            self.add_history(output)
-
-        return result
-
-
+        return output
 
     def set_module(self, module, 
                    key=None, 
@@ -159,11 +314,12 @@ class Server(c.Module):
         self.whitelist = list(set(whitelist + c.whitelist))
         self.blacklist = list(set(blacklist + c.blacklist))
         self.name = module.server_name
+        self.set_history_path(self.history_path)
         self.module = module 
         self.ip = c.ip()
-        port = port or c.free_port()
+        port = port or c.free_port(name=self.name)
         while c.port_used(port):
-            port =  c.free_port()
+            port =  c.free_port(name=self.name)
         self.port = port
         self.address = f"{self.ip}:{self.port}"
         module.address = self.address
@@ -174,16 +330,69 @@ class Server(c.Module):
         module.address  = self.address
         module.network = self.network
         module.subnet = self.subnet
-        self.schema = module.schema() 
         self.key = self.module.key = c.get_key(key or self.name)
-        self.access_module = c.module(access_module)(module=self.module)  
+        self.set_cache(self.cache_fns)
+        self.set_info()
+        self.verifier = c.module('server.verifier')(key=self.key)
+        self.access_module = c.module(access_module)(module=self.module, workers=getattr(self, 'workers', 1))
+        self.set_batchers(self.batch_fns)
         self.set_api()
         return {'success': True, 'msg': f'Set module {module}', 'key': self.key.ss58_address}
 
     def add_fn(self, name:str, fn: str):
         assert callable(fn), 'fn not callable'
         setattr(self.module, name, fn)
-           
+        self.set_info()
+
+    # INFO AND SCHEMA (computed once, served from memory)
+    cached_fns = ['info', 'schema']
+    info_check_interval = 1 # seconds between checks of the module code (for changes)
+
+    def set_info(self):
+        """
+        Computes the info and schema of the module once, and their etag (hash), which clients send back
+        to skip unchanged info. Only the default (not overriden) fns are cached, as others may be dynamic.
+        """
+        self.schema = self.module.schema(defaults=True, include_parents=True)
+        self.fn2cache = {}
+        for fn in self.cached_fns:
+            if self.is_default_fn(fn):
+                self.fn2cache[fn] = self.schema if fn == 'schema' else getattr(self.module, fn)()
+        self.etag = c.hash(json.dumps(self.fn2cache, sort_keys=True, default=str))
+        if 'info' in self.fn2cache:
+            self.fn2cache['info'] = {**self.fn2cache['info'], 'etag': self.etag}
+        self.code_mtime = self.get_code_mtime()
+        self.code_checked = c.time()
+        self.response_cache.clear() # the fns (or their code) changed
+        return {'success': True, 'etag': self.etag, 'cached_fns': list(self.fn2cache.keys())}
+
+    def is_default_fn(self, fn:str) -> bool:
+        if fn in self.module.__dict__: # added with add_fn
+            return False
+        module_fn = getattr(type(self.module), fn, None)
+        base_fn = getattr(c.Module, fn)
+        return getattr(module_fn, '__func__', module_fn) is getattr(base_fn, '__func__', base_fn)
+
+    def get_code_mtime(self) -> float:
+        try:
+            return os.path.getmtime(inspect.getfile(type(self.module)))
+        except (TypeError, OSError):
+            return None
+
+    def cached_fn(self, fn:str, *args, etag:str = None, **kwargs):
+        """
+        Serves the cached info/schema, or {'unchanged': True} if the etag of the caller is the current one
+        """
+        if len(args) > 0 or len(kwargs) > 0:
+            return getattr(self.module, fn)(*args, **kwargs) # custom params are not cached
+        if c.time() - self.code_checked > self.info_check_interval:
+            self.code_checked = c.time()
+            if self.get_code_mtime() != self.code_mtime:
+                self.set_info()
+        if etag == self.etag:
+            return {'etag': self.etag, 'unchanged': True}
+        return self.fn2cache[fn]
+
     def set_api(self):
 
         self.app = FastAPI()
@@ -196,33 +405,58 @@ class Server(c.Module):
             )
        
         @self.app.post("/{fn}")
-        def forward_api(fn:str, input:dict):
-            return self.forward(fn=fn, input=input)
+        async def forward_api(fn:str, request: Request):
+            input = await self.get_request_input(request)
+            content_type = 'frames' if self.serializer.frames_content_type in request.headers.get('accept', '') else 'json'
+            return await self.async_forward(fn=fn, input=input, content_type=content_type)
         
         # start the server
         try:
             c.print(f' Served ( {self.name} --> {self.address} ) 🚀\033 ', color='purple')
             c.print(f'🔑 Key: {self.key} 🔑\033', color='yellow')
             c.register_server(name=self.name, address = self.address, network=self.network)
-            uvicorn.run(self.app, host='0.0.0.0', port=self.port, loop="asyncio")
+            self.run_api()
         except Exception as e:
             c.print(e, color='red')
             c.deregister_server(self.name, network=self.network)
         finally:
             c.deregister_server(self.name, network=self.network)
+            c.module('server.ports').release(port=self.port)
         
+    def run_api(self):
+        """
+        Runs the api on a socket bound here, with workers > 1 it is shared by forked worker processes
+        """
+        import multiprocessing
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('0.0.0.0', self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        # the port is listening, so its reservation becomes a serving entry (pruned once it stops listening)
+        c.module('server.ports').register(self.port, self.name)
+        config = uvicorn.Config(self.app, host='0.0.0.0', port=self.port, loop="asyncio")
+        ctx = multiprocessing.get_context('fork')
+        processes = []
+        for i in range(self.workers - 1):
+            process = ctx.Process(target=uvicorn.Server(config).run, kwargs={'sockets': [sock]}, daemon=True)
+            process.start()
+            processes.append(process)
+        try:
+            uvicorn.Server(config).run(sockets=[sock])
+        finally:
+            for process in processes:
+                process.terminate()
+            sock.close()
+
     @classmethod
     def history_paths(cls, server=None, history_path='history', n=100, key=None):
-        if server == None:
-            dirpath  = f'{history_path}'
-            paths =  cls.glob(dirpath)
-        else:
-            
-            dirpath  = f'{history_path}/{server}'
-            paths =  cls.ls(dirpath)
-        paths = sorted(paths, reverse=True)[:n]
-        return paths
+        return cls.history_module(server=server, history_path=history_path).history_paths(n=n, reverse=True)
 
+    @classmethod
+    def history_module(cls, server=None, history_path='history'):
+        dirpath = history_path if server == None else f'{history_path}/{server}'
+        return c.module('history').shared(cls.resolve_path(dirpath))
 
     def info(self) -> Dict:
         return {
@@ -235,15 +469,42 @@ class Server(c.Module):
             'blacklist': self.blacklist,
             'free': self.free,
             'save_history': self.save_history,
-            
+            'verifier': self.verifier.info(),
+            'batchers': {fn: b.info() for fn, b in self.batchers.items()},
+            'cache': self.response_cache.info(),
+            'etag': self.etag,
         }
 
-    def process_result(self,  result):
+    async def get_request_input(self, request: Request) -> dict:
+        """
+        Resolves the input from the request body, which is either json or frames (binary)
+        """
+        body = await request.body()
+        if request.headers.get('content-type', '').startswith(self.serializer.frames_content_type):
+            return {'data': self.serializer.frames_hash(body), 
+                    'frames': body,
+                    'signature': request.headers.get('x-signature'),
+                    'address': request.headers.get('x-address'),
+                    'crypto_type': request.headers.get('x-crypto-type')}
+        return json.loads(body)
+
+    def process_result(self,  result, content_type:str = 'json'):
         if c.is_generator(result):
             from sse_starlette.sse import EventSourceResponse
             # for sse we want to wrap the generator in an eventsource response
             result = self.generator_wrapper(result)
             return EventSourceResponse(result)
+        elif inspect.isasyncgen(result):
+            from sse_starlette.sse import EventSourceResponse
+            return EventSourceResponse(self.async_generator_wrapper(result))
+        elif content_type == 'frames':
+            # the raw frames are sent as the body, and the signature of their hash in the headers
+            result = self.serializer.serialize({'data': result}, mode='frames')
+            signature = self.key.sign(self.serializer.frames_hash(result), return_json=True)
+            headers = {'x-signature': signature['signature'], 
+                       'x-address': signature['address'], 
+                       'x-crypto-type': str(signature['crypto_type'])}
+            return Response(content=result, media_type=self.serializer.frames_content_type, headers=headers)
         else:
             # if we are not using sse, then we can do this with json
             result = self.serializer.serialize(result)
@@ -251,34 +512,55 @@ class Server(c.Module):
             return result
         
     
-    def generator_wrapper(self, generator):
+    async def generator_wrapper(self, generator):
         """
         This function wraps a generator in a format that the eventsource response can understand
         """
-
-        for item in generator:
-
-            # we wrap the item in a json object, just like the serializer does
-            item = self.serializer.serialize({'data': item})
-            item_size = len(str(item))
-            # we need to add a chunk start and end to the item
-            if item_size > self.chunk_size:
-                # if the item is too big, we need to chunk it
-                chunks =[item[i:i+self.chunk_size] for i in range(0, item_size, self.chunk_size)]
-                # we need to yield the chunks in a format that the eventsource response can understand
-                for chunk in chunks:
+        # each item is produced in the executor, so a slow generator does not block the loop
+        loop = asyncio.get_running_loop()
+        end = object()
+        try:
+            while True:
+                item = await loop.run_in_executor(self.executor, next, generator, end)
+                if item is end:
+                    break
+                for chunk in self.serialize_item(item):
                     yield chunk
-            else:
-                yield item
-
+        finally:
+            # the client disconnected (or the stream ended), so the generator stops producing
+            try:
+                generator.close()
+            except ValueError:
+                pass # it is still computing an item in the executor, and is not resumed after it
+
+    def serialize_item(self, item) -> List[str]:
+        # we wrap the item in a json object, just like the serializer does
+        item = self.serializer.serialize({'data': item})
+        item_size = len(str(item))
+        # if the item is too big, we need to chunk it in a format that the eventsource response can understand
+        if item_size > self.chunk_size:
+            return [item[i:i+self.chunk_size] for i in range(0, item_size, self.chunk_size)]
+        return [item]
+
+    async def async_generator_wrapper(self, generator):
+        """
+        The async version of generator_wrapper, for async generator functions
+        """
+        try:
+            async for item in generator:
+                for chunk in self.serialize_item(item):
+                    yield chunk
+        finally:
+            await generator.aclose()
 
     # HISTORY 
     def add_history(self, item:dict):    
-        path = self.history_path + '/' + item['address'] + '/'+  str(item['timestamp']) 
-        self.put(path, item)
+        # buffered and flushed in batches by the history module (off the request thread)
+        self.history_store.add(item)
 
     def set_history_path(self, history_path):
         self.history_path = self.resolve_path(history_path or f'history/{self.name}')
+        self.history_store = c.module('history').shared(self.history_path)
         return {'history_path': self.history_path}
 
     @classmethod
@@ -293,14 +575,20 @@ class Server(c.Module):
                 history_path='history',
                 features=[ 'module', 'fn', 'seconds_ago', 'latency', 'address'], 
                 to_list=False,
+                server = None,
+                start:int = None,
+                end:int = None,
+                address:str = None,
+                n:int = None,
                 **kwargs
                 ):
-        key = c.get_key(key)
-        history_path = cls.history_paths(key=key, history_path=history_path)
-        df =  c.df([cls.get(path) for path in history_path])
+        history = cls.history_module(server=server, history_path=history_path)
+        df =  c.df(history.query(start=start, end=end, address=address, n=n))
+        if len(df) == 0:
+            return [] if to_list else df
         now = c.timestamp()
         df['seconds_ago'] = df['timestamp'].apply(lambda x: now - x)
-        df = df[features]
+        df = df[[f for f in features if f in df.columns]]
         if to_list:
             return df.to_dict('records')
 
@@ -348,6 +636,7 @@ class Server(c.Module):
               remote:bool = True, # runs the server remotely (pm2, ray)
               tag_seperator:str='::',
               max_workers:int = None,
+              workers:int = 1, # the number of processes that share the port
               free: bool = False,
               mnemonic = None, # mnemonic for the server
               key = None,
@@ -382,6 +671,7 @@ class Server(c.Module):
                             port=port, 
                             network=server_network, 
                             max_workers=max_workers, 
+                            workers=workers,
                             free=free, 
                             key=key)
 
@@ -0,0 +1,162 @@
+import commune as c
+import threading
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+class Verifier(c.Module):
+    """
+    Verifies the signatures of incoming requests, without copying or re-serializing them.
+
+    - the public keys are decoded once per address (lru)
+    - a (signature, data) pair that was verified is not verified again (lru)
+    - the <Bytes> wrapped retry (polkadot-js) is only tried first for addresses that needed it before
+    """
+
+    def __init__(self,
+                 key = None, # the server key (its crypto type is the default)
+                 max_keys:int = 100000, # max decoded public keys to keep
+                 max_signatures:int = 100000, # max verified signatures to keep
+                 wrapped:bool = True, # allow the <Bytes> wrapped retry
+                 max_workers:int = None, # threads for verify_batch
+                 **kwargs):
+        self.key = c.get_key(key)
+        self.max_keys = max_keys
+        self.max_signatures = max_signatures
+        self.wrapped = wrapped
+        self.address2public_key = OrderedDict()
+        self.signature2verified = OrderedDict()
+        self.wrapped_addresses = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'verified': 0, 'failed': 0, 'verify_time': 0.0,
+                      'key_hits': 0, 'key_misses': 0,
+                      'signature_hits': 0, 'wrapped': 0}
+        return self.stats
+
+    def verify_fns(self):
+        import sr25519
+        import ed25519_zebra
+        from substrateinterface.utils.ecdsa_helpers import ecdsa_verify
+        return {0: ed25519_zebra.ed_verify, 1: sr25519.verify, 2: ecdsa_verify}
+
+    def public_key(self, address:str) -> bytes:
+        with self.lock:
+            public_key = self.address2public_key.get(address)
+            if public_key != None:
+                self.address2public_key.move_to_end(address)
+                self.stats['key_hits'] += 1
+                return public_key
+        public_key = bytes.fromhex(c.ss58_decode(address).replace('0x', ''))
+        with self.lock:
+            self.stats['key_misses'] += 1
+            self.address2public_key[address] = public_key
+            if len(self.address2public_key) > self.max_keys:
+                self.address2public_key.popitem(last=False)
+        return public_key
+
+    def resolve_data(self, data) -> bytes:
+        if isinstance(data, bytes):
+            return data
+        if not isinstance(data, str):
+            data = c.python2str(data)
+        if data[0:2] == '0x':
+            return bytes.fromhex(data[2:])
+        return data.encode()
+
+    def resolve_signature(self, signature) -> bytes:
+        if isinstance(signature, bytes):
+            return signature
+        assert isinstance(signature, str), f"Signature should be of type bytes or a hex-string, got {type(signature)}"
+        if signature[0:2] == '0x':
+            signature = signature[2:]
+        return bytes.fromhex(signature)
+
+    def verify(self, input:dict) -> bool:
+        """
+        input (dict):
+            data: the signed data (str)
+            signature: the signature (hex)
+            address: the ss58 address of the signer
+            crypto_type (optional): the crypto type of the signer (default: the server key type)
+        """
+        t0 = c.time()
+        address = input['address']
+        data = self.resolve_data(input['data'])
+        signature = self.resolve_signature(input['signature'])
+        crypto_type = int(input.get('crypto_type', None) or self.key.crypto_type)
+
+        cache_key = hashlib.sha256(signature + data + address.encode()).digest()
+        with self.lock:
+            verified = self.signature2verified.get(cache_key, None)
+            if verified != None:
+                self.stats['signature_hits'] += 1
+        if verified == None:
+            public_key = self.public_key(address)
+            verify_fn = self.verify_fns()[crypto_type]
+            verified, is_wrapped = False, False
+            wrapped_data = b'<Bytes>' + data + b'</Bytes>'
+            # try the format that worked last for this address first
+            datas = [wrapped_data, data] if address in self.wrapped_addresses else [data, wrapped_data]
+            if not self.wrapped:
+                datas = [data]
+            for d in datas:
+                if verify_fn(signature, d, public_key):
+                    verified = True
+                    is_wrapped = d is wrapped_data
+                    break
+            with self.lock:
+                if verified and is_wrapped:
+                    self.stats['wrapped'] += 1
+                    self.wrapped_addresses.add(address)
+                elif verified:
+                    self.wrapped_addresses.discard(address)
+                self.signature2verified[cache_key] = verified
+                if len(self.signature2verified) > self.max_signatures:
+                    self.signature2verified.popitem(last=False)
+
+        with self.lock:
+            self.stats['verified' if verified else 'failed'] += 1
+            self.stats['verify_time'] += c.time() - t0
+        return verified
+
+    def verify_batch(self, inputs:List[dict], parallel:bool = True) -> List[bool]:
+        """
+        Verifies a batch of queued requests, duplicates are verified once
+        """
+        unique = {}
+        for i, input in enumerate(inputs):
+            unique.setdefault((input['address'], str(input['signature']), str(input['data'])), []).append(i)
+        keys = list(unique.keys())
+        first_inputs = [inputs[unique[k][0]] for k in keys]
+        if parallel and len(first_inputs) > 1:
+            results = list(self.executor.map(self.verify, first_inputs))
+        else:
+            results = [self.verify(input) for input in first_inputs]
+        verified = [False] * len(inputs)
+        for k, result in zip(keys, results):
+            for i in unique[k]:
+                verified[i] = result
+        return verified
+
+    def info(self) -> dict:
+        n = self.stats['verified'] + self.stats['failed']
+        return {**self.stats,
+                'avg_verify_time': self.stats['verify_time'] / max(n, 1),
+                'cached_keys': len(self.address2public_key),
+                'cached_signatures': len(self.signature2verified)}
+
+    def test(self, n=10):
+        key = c.get_key('test_verifier')
+        self = Verifier(key=key)
+        inputs = [key.sign(c.python2str({'i': i, 'timestamp': c.time()}), return_json=True) for i in range(n)]
+        assert all(self.verify_batch(inputs + inputs[:2]))
+        assert self.stats['key_misses'] >= 1 and self.stats['verified'] == n
+        bad = {**inputs[0], 'data': inputs[1]['data']}
+        assert not self.verify(bad)
+        assert self.verify(inputs[0]) and self.stats['signature_hits'] == 1
+        return {'success': True, 'msg': 'verifier test passed', 'info': self.info()}
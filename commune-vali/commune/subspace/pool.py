@@ -0,0 +1,287 @@
+import commune as c
+import threading
+from contextlib import contextmanager
+from typing import *
+
+
+class PooledSubstrate:
+    """
+    Looks like a SubstrateInterface, but every call runs on a connection leased from the pool
+    (so it can be shared by threads), and is retried on another node if the connection fails
+    """
+
+    def __init__(self, pool:'SubstratePool'):
+        self.pool = pool
+
+    def __getattr__(self, name:str):
+        if callable(getattr(self.pool.connection_class, name, None)):
+            return lambda *args, **kwargs: self.pool.call(name, *args, **kwargs)
+        with self.pool.lease() as substrate:
+            return getattr(substrate, name)
+
+    def __repr__(self) -> str:
+        return f'<PooledSubstrate urls={self.pool.urls}>'
+
+
+class FakeSubstrate:
+    """
+    A connection for the pool test, that fails on urls with down in them and checks it is never shared
+    """
+    in_use = {}
+
+    def __init__(self, url:str, **kwargs):
+        if 'down' in url:
+            raise ConnectionError(f'{url} is down')
+        self.url = url
+
+    def rpc_request(self, method:str, params:list):
+        assert self.in_use.setdefault(id(self), 0) == 0, 'connection shared between threads'
+        self.in_use[id(self)] += 1
+        c.sleep(0.005)
+        self.in_use[id(self)] -= 1
+        return {'result': self.url}
+
+    def query_map(self, module:str, storage_function:str, params:list = None, page_size:int = 3, 
+                  block_hash:str = None, start_key:int = None, max_results:int = None, n:int = 10, **kwargs):
+        from substrateinterface.base import QueryMapResult
+        start = start_key or 0
+        self.rpc_request('state_getKeysPaged', [start])
+        records = [(i, i) for i in range(start, min(start + page_size, n))]
+        # the next pages are fetched through this connection, like the substrate QueryMapResult
+        return QueryMapResult(records=records, page_size=page_size, module=module, storage_function=storage_function,
+                              params=params, block_hash=block_hash, substrate=self, last_key=start + page_size, max_results=max_results)
+
+    def close(self):
+        pass
+
+
+class SubstratePool(c.Module):
+    """
+    A pool of substrate connections over one or more node urls.
+
+    Each url holds up to `size` connections, which are opened lazily (`warm` of them in the
+    background at start). A lease takes an idle connection of the healthy url with the fewest
+    calls in flight (ties go to the lowest latency), and gives it back when done, so a connection
+    is only used by one thread at a time. A connection that fails is closed, and a url that fails
+    max_failures times in a row is skipped for `backoff` seconds. A background thread pings every
+    url each health_interval seconds to track its latency and bring it back once it responds.
+    """
+    connection_errors = (ConnectionError, OSError, TimeoutError, EOFError, BrokenPipeError)
+
+    def __init__(self,
+                 urls: List[str],
+                 size:int = 4, # max connections per url
+                 warm:int = 1, # connections opened per url at start
+                 health_interval:float = 10, # seconds between health checks
+                 max_failures:int = 3, # failures in a row before a url is skipped
+                 backoff:float = 30, # seconds a failing url is skipped
+                 timeout:float = 60, # max seconds to wait for a connection
+                 trials:int = 3, # attempts of a call (on different connections)
+                 connect_kwargs:dict = None, # the kwargs of SubstrateInterface
+                 **kwargs):
+        self.urls = urls if isinstance(urls, list) else [urls]
+        self.size = size
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.backoff = backoff
+        self.timeout = timeout
+        self.trials = trials
+        self.connect_kwargs = connect_kwargs or {}
+        try:
+            from websocket import WebSocketException
+            self.connection_errors = self.connection_errors + (WebSocketException,)
+        except ImportError:
+            pass
+        self.cond = threading.Condition()
+        self.endpoints = [{'url': url,
+                           'idle': [],
+                           'open': 0, # open connections (idle or leased)
+                           'in_use': 0,
+                           'latency': None, # the moving average of the call latency
+                           'failures': 0, # failures in a row
+                           'down_until': 0,
+                           'calls': 0,
+                           'errors': 0} for url in self.urls]
+        self.substrate = PooledSubstrate(self)
+        c.thread(self.run_loop, kwargs={'warm': warm})
+
+    @property
+    def connection_class(self):
+        if not hasattr(self, '_connection_class'):
+            from substrateinterface import SubstrateInterface
+            self._connection_class = SubstrateInterface
+        return self._connection_class
+
+    @connection_class.setter
+    def connection_class(self, connection_class):
+        self._connection_class = connection_class
+
+    def connect(self, url:str):
+        return self.connection_class(url=url, **self.connect_kwargs)
+
+    def pick(self) -> Optional[dict]:
+        now = c.time()
+        available = [e for e in self.endpoints if len(e['idle']) > 0 or e['open'] < self.size]
+        healthy = [e for e in available if e['down_until'] <= now]
+        # if every url is down, try them anyways rather than failing
+        candidates = healthy or [e for e in available if all(x['down_until'] > now for x in self.endpoints)]
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda e: (e['in_use'], e['latency'] if e['latency'] != None else 0))
+
+    def acquire(self, timeout:float = None) -> Tuple[dict, Any]:
+        timeout = timeout or self.timeout
+        deadline = c.time() + timeout
+        with self.cond:
+            while True:
+                endpoint = self.pick()
+                if endpoint != None:
+                    endpoint['in_use'] += 1
+                    if len(endpoint['idle']) > 0:
+                        return endpoint, endpoint['idle'].pop()
+                    endpoint['open'] += 1
+                    break
+                remaining = deadline - c.time()
+                if remaining <= 0:
+                    raise TimeoutError(f'No substrate connection available after {timeout}s ({self.info()})')
+                self.cond.wait(remaining)
+        # the connection is opened outside of the lock
+        try:
+            return endpoint, self.connect(endpoint['url'])
+        except Exception as e:
+            self.release(endpoint, None, error=e)
+            raise e
+
+    def release(self, endpoint:dict, substrate, error:Exception = None, latency:float = None):
+        with self.cond:
+            endpoint['in_use'] -= 1
+            endpoint['calls'] += 1
+            if error != None:
+                endpoint['open'] -= 1
+                endpoint['errors'] += 1
+                endpoint['failures'] += 1
+                if endpoint['failures'] >= self.max_failures:
+                    endpoint['down_until'] = c.time() + self.backoff
+            else:
+                endpoint['failures'] = 0
+                endpoint['idle'].append(substrate)
+                if latency != None:
+                    endpoint['latency'] = latency if endpoint['latency'] == None else 0.8 * endpoint['latency'] + 0.2 * latency
+            self.cond.notify()
+        if error != None and substrate != None:
+            try:
+                substrate.close()
+            except Exception:
+                pass
+
+    @contextmanager
+    def lease(self, timeout:float = None):
+        """
+        Holds a connection for several calls (e.g. the calls of an extrinsic)
+        """
+        endpoint, substrate = self.acquire(timeout=timeout)
+        t0 = c.time()
+        try:
+            yield substrate
+        except self.connection_errors as e:
+            self.release(endpoint, substrate, error=e)
+            raise e
+        except BaseException as e:
+            # not a connection error, so the connection is fine
+            self.release(endpoint, substrate)
+            raise e
+        else:
+            self.release(endpoint, substrate, latency=c.time() - t0)
+
+    def call(self, fn:str, *args, **kwargs):
+        """
+        Calls a method of the connection, on another connection if it fails
+        """
+        for i in range(self.trials):
+            try:
+                with self.lease() as substrate:
+                    result = getattr(substrate, fn)(*args, **kwargs)
+                    if hasattr(result, 'retrieve_next_page'):
+                        # query_map results fetch their next pages lazily through the connection,
+                        # so every page is fetched within the lease, and the result is detached from it
+                        for _ in result:
+                            pass
+                        result.substrate = None
+                    return result
+            except self.connection_errors as e:
+                if i == self.trials - 1:
+                    raise e
+                c.print(f'Substrate {fn} failed ({e}), retrying on another connection', color='yellow')
+
+    def check(self, endpoint:dict) -> dict:
+        """
+        Pings the url with a new request, and updates its latency and health
+        """
+        with self.cond:
+            substrate = endpoint['idle'].pop() if len(endpoint['idle']) > 0 else None
+            if substrate == None and endpoint['open'] >= self.size:
+                return {'url': endpoint['url'], 'checked': False} # all of its connections are busy, so it is in use
+            endpoint['in_use'] += 1
+            if substrate == None:
+                endpoint['open'] += 1
+        t0 = c.time()
+        try:
+            substrate = substrate or self.connect(endpoint['url'])
+            substrate.rpc_request('system_health', [])
+        except Exception as e:
+            self.release(endpoint, substrate, error=e)
+            return {'url': endpoint['url'], 'healthy': False, 'error': str(e)}
+        with self.cond:
+            endpoint['down_until'] = 0
+        self.release(endpoint, substrate, latency=c.time() - t0)
+        return {'url': endpoint['url'], 'healthy': True, 'latency': endpoint['latency']}
+
+    def warm_up(self, n:int = 1):
+        for endpoint in self.endpoints:
+            for i in range(max(n - endpoint['open'], 0)):
+                r = self.check(endpoint)
+                if not r.get('healthy', False):
+                    break
+
+    def run_loop(self, warm:int = 1):
+        try:
+            self.warm_up(warm)
+        except Exception as e:
+            c.print(f'Error warming up the substrate pool: {e}', color='red')
+        while self.health_interval != None:
+            c.sleep(self.health_interval)
+            for endpoint in self.endpoints:
+                try:
+                    self.check(endpoint)
+                except Exception as e:
+                    c.print(f'Error checking {endpoint["url"]}: {e}', color='red')
+
+    def info(self) -> List[dict]:
+        now = c.time()
+        return [{'url': e['url'],
+                 'open': e['open'],
+                 'idle': len(e['idle']),
+                 'in_use': e['in_use'],
+                 'latency': e['latency'],
+                 'healthy': e['down_until'] <= now,
+                 'calls': e['calls'],
+                 'errors': e['errors']} for e in self.endpoints]
+
+    def test(self, n_calls:int = 64, n_threads:int = 16):
+        """
+        Runs concurrent calls on fake connections, one of the urls is down
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        pool = SubstratePool(urls=['ws://a', 'ws://down', 'ws://b'], size=3, warm=0, health_interval=None, backoff=60, max_failures=1)
+        pool.connection_class = FakeSubstrate
+        with ThreadPoolExecutor(n_threads) as executor:
+            results = list(executor.map(lambda i: pool.substrate.rpc_request('system_health', [])['result'], range(n_calls)))
+        assert set(results) == {'ws://a', 'ws://b'}, set(results)
+        # the pages of query maps are fetched on their leased connection
+        with ThreadPoolExecutor(n_threads) as executor:
+            qmaps = list(executor.map(lambda i: list(pool.substrate.query_map('SubspaceModule', 'StakeFrom')), range(n_calls)))
+        assert all(qmap == [(i, i) for i in range(10)] for qmap in qmaps), qmaps[0]
+        info = {e['url']: e for e in pool.info()}
+        assert info['ws://down']['healthy'] == False and info['ws://down']['open'] == 0, info
+        assert all(e['open'] <= pool.size and e['in_use'] == 0 for e in info.values()), info
+        return {'success': True, 'msg': 'substrate pool test passed', 'info': pool.info()}
@@ -0,0 +1,283 @@
+import commune as c
+import os
+import json
+import threading
+from typing import *
+
+
+class ChainState(c.Module):
+    """
+    Follows the chain and keeps the maps that most readers need (Stake, Keys, Name, Address
+    and SubnetNames) up to date in memory, by reading only what the events of each block changed.
+
+    The maps are loaded once at a block, then every new block header is diffed:
+        StakeAdded/StakeRemoved -> the stake of the staked module
+        ModuleRegistered/ModuleDeregistered -> the uid maps of the subnet (uids can move on deregistration)
+        ModuleUpdated -> the name and address of the module
+        NetworkAdded/NetworkRemoved/... -> the subnet names and the uid maps of the subnet
+    The state is written to disk (snapshot.json, and head.json with the block of every update),
+    where Subspace.stakes/namespace/uid2key read it instead of the chain.
+    """
+    maps = ['Stake', 'Keys', 'Name', 'Address']
+    uid_maps = ['Keys', 'Name', 'Address']
+    stake_events = ['StakeAdded', 'StakeRemoved']
+    module_events = ['ModuleUpdated']
+    uid_events = ['ModuleRegistered', 'ModuleDeregistered']
+    subnet_events = ['NetworkAdded', 'NetworkRemoved', 'NetworkUpdated', 'SubnetRemoved', 'SubnetAdded']
+
+    def __init__(self,
+                 network:str = 'main',
+                 resync_interval:int = 3600, # blocks between full reloads (a safety net for missed changes)
+                 max_catchup:int = 300, # the max blocks replayed from the snapshot before a full reload
+                 **kwargs):
+        self.network = network
+        self.resync_interval = resync_interval
+        self.max_catchup = max_catchup
+        self.lock = threading.RLock()
+        self.state = {'block': None, 'block_hash': None, 'synced_block': None, 'maps': {}, 'subnets': {}}
+        self.subspace = None
+
+    def get_subspace(self):
+        if self.subspace == None:
+            self.subspace = c.module('subspace')(network=self.network)
+        return self.subspace
+
+    @classmethod
+    def state_path(cls, network:str = 'main') -> str:
+        return cls.resolve_path(f'{network}')
+
+    ## READS (used by Subspace)
+
+    @classmethod
+    def read(cls, network:str = 'main', max_age:float = None) -> Optional[dict]:
+        """
+        The state of the follower, or None if there is none (or it stopped updating for max_age seconds)
+        """
+        path = cls.state_path(network)
+        head = cls.get(path + '/head.json', None, cache=True)
+        if head == None or (max_age != None and c.time() - head['timestamp'] > max_age):
+            return None
+        state = cls.get(path + '/snapshot.json', None, cache=True)
+        if state == None:
+            return None
+        return {**state, 'block': head['block'], 'timestamp': head['timestamp']}
+
+    ## UPDATES
+
+    def sync(self, block:int = None) -> dict:
+        """
+        Loads the maps at a block (the latest by default)
+        """
+        subspace = self.get_subspace()
+        substrate = subspace.get_substrate(network=self.network)
+        block = block if block != None else substrate.get_block_number(None)
+        block_hash = substrate.get_block_hash(block)
+        maps = {}
+        for name in self.maps:
+            value = subspace.query_map(name, netuid='all', block=block, network=self.network, update=True)
+            maps[name] = {str(netuid): {str(k): v for k,v in subnet_map.items()} for netuid, subnet_map in value.items()}
+        subnets = {str(k): v for k,v in subspace.query_map('SubnetNames', block=block, network=self.network, update=True).items()}
+        with self.lock:
+            self.state = {'block': block, 'block_hash': block_hash, 'synced_block': block, 'maps': maps, 'subnets': subnets}
+        self.save(snapshot=True)
+        return {'success': True, 'block': block, 'subnets': len(subnets)}
+
+    def changes(self, events: List[dict]) -> dict:
+        """
+        The storage entries changed by the events of a block
+        """
+        changes = {'stakes': set(), 'modules': set(), 'subnets': set(), 'subnet_names': False}
+        for event in events:
+            event = event.get('event', event)
+            if event.get('module_id') != 'SubspaceModule':
+                continue
+            event_id = event.get('event_id')
+            attributes = event.get('attributes', [])
+            if isinstance(attributes, dict):
+                attributes = list(attributes.values())
+            elif not isinstance(attributes, (list, tuple)):
+                attributes = [attributes]
+            keys = [a for a in attributes if isinstance(a, str) and c.valid_ss58_address(a)]
+            ints = [a for a in attributes if isinstance(a, int) and not isinstance(a, bool)]
+            if event_id in self.stake_events and len(keys) > 0:
+                # the netuid is only in the event if it has an int besides the amount
+                netuid = ints[0] if len(ints) > 1 else None
+                changes['stakes'].add((netuid, keys[-1]))
+            elif event_id in self.uid_events and len(ints) > 0:
+                changes['subnets'].add(ints[0])
+            elif event_id in self.module_events and len(ints) > 0 and len(keys) > 0:
+                changes['modules'].add((ints[0], keys[-1]))
+            elif event_id in self.subnet_events:
+                changes['subnet_names'] = True
+                if len(ints) > 0:
+                    changes['subnets'].add(ints[0])
+        # the modules of the reloaded subnets are read anyways
+        changes['modules'] = {(n, k) for n, k in changes['modules'] if n not in changes['subnets']}
+        return changes
+
+    def fetch(self, changes:dict, block:int, block_hash:str) -> dict:
+        """
+        Reads the changed entries at the block
+        """
+        subspace = self.get_subspace()
+        values = {'stakes': {}, 'modules': {}, 'subnets': {}, 'subnet_names': None}
+        netuids = [int(n) for n in self.state['maps'].get('Stake', {})]
+        queries = []
+        for netuid, key in changes['stakes']:
+            for n in ([netuid] if netuid != None else netuids):
+                queries.append(('stakes', f'{n}:{key}', ['Stake', [n, key]]))
+        for netuid, key in changes['modules']:
+            uid = self.key2uid(netuid).get(key)
+            if uid == None:
+                changes['subnets'].add(netuid)
+                continue
+            for name in ['Name', 'Address']:
+                queries.append(('modules', f'{netuid}:{key}:{name}', [name, [netuid, uid]]))
+        if len(queries) > 0:
+            results = subspace.query_batch([q[2] for q in queries], block_hash=block_hash, network=self.network)
+            for (kind, k, _), v in zip(queries, results):
+                values[kind][k] = v
+        for netuid in changes['subnets']:
+            values['subnets'][str(netuid)] = {name: subspace.query_map(name, netuid=netuid, block=block, network=self.network, update=True)
+                                              for name in self.maps}
+        if changes['subnet_names']:
+            values['subnet_names'] = subspace.query_map('SubnetNames', block=block, network=self.network, update=True)
+        return values
+
+    def apply(self, changes:dict, values:dict, block:int, block_hash:str = None) -> dict:
+        """
+        Writes the fetched values of the changes into the maps
+        """
+        n = 0
+        with self.lock:
+            maps = self.state['maps']
+            for k, v in values['stakes'].items():
+                netuid, key = k.split(':')
+                subnet_stakes = maps['Stake'].setdefault(netuid, {})
+                if v:
+                    subnet_stakes[key] = v
+                elif key in subnet_stakes:
+                    del subnet_stakes[key]
+                n += 1
+            for k, v in values['modules'].items():
+                netuid, key, name = k.split(':')
+                uid = self.key2uid(int(netuid)).get(key)
+                if uid != None:
+                    maps[name].setdefault(netuid, {})[str(uid)] = v
+                    n += 1
+            for netuid, subnet_maps in values['subnets'].items():
+                for name, value in subnet_maps.items():
+                    if len(value) > 0:
+                        maps[name][netuid] = {str(k): v for k,v in value.items()}
+                    else:
+                        maps[name].pop(netuid, None)
+                n += 1
+            if values.get('subnet_names') != None:
+                self.state['subnets'] = {str(k): v for k,v in values['subnet_names'].items()}
+                n += 1
+            self.state['block'] = block
+            self.state['block_hash'] = block_hash
+        return {'block': block, 'updates': n}
+
+    def process_block(self, block:int, block_hash:str = None, events:List[dict] = None, values:dict = None) -> dict:
+        """
+        Applies a block: its events are read (unless given), diffed, and the changed entries are read (unless given)
+        """
+        if events == None:
+            substrate = self.get_subspace().get_substrate(network=self.network)
+            block_hash = block_hash or substrate.get_block_hash(block)
+            events = [e.value for e in substrate.get_events(block_hash)]
+        changes = self.changes(events)
+        if values == None:
+            values = self.fetch(changes, block=block, block_hash=block_hash)
+        response = self.apply(changes, values, block=block, block_hash=block_hash)
+        self.save(snapshot=response['updates'] > 0)
+        return response
+
+    def on_block(self, block:int, block_hash:str = None) -> dict:
+        """
+        Catches up to the block (replaying skipped blocks), or reloads everything if it is too far behind
+        """
+        last_block = self.state['block']
+        if last_block == None or block - last_block > self.max_catchup or block - self.state['synced_block'] > self.resync_interval:
+            return self.sync(block)
+        for b in range(last_block + 1, block + 1):
+            self.process_block(b, block_hash=block_hash if b == block else None)
+        return {'success': True, 'block': block}
+
+    def save(self, snapshot:bool = True):
+        """
+        Writes the head (every block) and the snapshot (when it changed) atomically
+        """
+        path = self.state_path(self.network)
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            files = {'head.json': {'block': self.state['block'], 'block_hash': self.state['block_hash'], 'timestamp': c.time()}}
+            if snapshot:
+                files['snapshot.json'] = self.state
+            for name, data in files.items():
+                c.storage_cache().write(f'{path}/{name}', json.dumps(data), data)
+
+    def load(self) -> dict:
+        state = self.get(self.state_path(self.network) + '/snapshot.json', None)
+        if state != None:
+            with self.lock:
+                self.state = state
+        return {'success': state != None, 'block': self.state['block']}
+
+    def follow(self, finalized_only:bool = True):
+        """
+        Subscribes to the new block headers and applies every block (blocking)
+        """
+        self.load()
+        substrate = self.get_subspace().get_substrate(network=self.network, mode='ws')
+        def handler(header, update_nr, subscription_id):
+            block = header['header']['number']
+            try:
+                r = self.on_block(block)
+                c.print(f'Block {block} -> {r}', color='green')
+            except Exception as e:
+                c.print(c.detailed_error(e), color='red')
+        return substrate.subscribe_block_headers(handler, finalized_only=finalized_only)
+
+    def key2uid(self, netuid:int) -> Dict[str, int]:
+        return {k: int(uid) for uid, k in self.state['maps'].get('Keys', {}).get(str(netuid), {}).items()}
+
+    def test(self):
+        """
+        Replays a recorded block (its events and the values read at it) on a small state
+        """
+        self = ChainState(network='test')
+        key0, key1, staker = [c.module('key').new_key().ss58_address for i in range(3)]
+        self.state = {'block': 100, 'block_hash': '0x0', 'synced_block': 100, 'subnets': {'0': 'commune'},
+                      'maps': {'Stake': {'0': {key0: 10}},
+                               'Keys': {'0': {'0': key0}},
+                               'Name': {'0': {'0': 'module0'}},
+                               'Address': {'0': {'0': '0.0.0.0:8000'}}}}
+        events = [{'event': {'module_id': 'SubspaceModule', 'event_id': 'StakeAdded', 'attributes': [staker, key0, 5]}},
+                  {'event': {'module_id': 'SubspaceModule', 'event_id': 'ModuleRegistered', 'attributes': [0, 1, key1]}},
+                  {'event': {'module_id': 'System', 'event_id': 'ExtrinsicSuccess', 'attributes': {}}}]
+        changes = self.changes(events)
+        assert changes['stakes'] == {(None, key0)} and changes['subnets'] == {0}, changes
+        values = {'stakes': {f'0:{key0}': 15},
+                  'modules': {},
+                  'subnets': {'0': {'Stake': {key0: 15, key1: 1}, 'Keys': {0: key0, 1: key1},
+                                    'Name': {0: 'module0', 1: 'module1'}, 'Address': {0: '0.0.0.0:8000', 1: '0.0.0.0:8001'}}},
+                  'subnet_names': None}
+        self.process_block(101, '0x1', events=events, values=values)
+        state = self.read(network='test')
+        assert state['block'] == 101 and state['maps']['Keys']['0']['1'] == key1, state
+        assert state['maps']['Stake']['0'][key0] == 15
+        # a module update only reads its name and address
+        events = [{'event': {'module_id': 'SubspaceModule', 'event_id': 'ModuleUpdated', 'attributes': [0, key1]}}]
+        changes = self.changes(events)
+        assert changes['modules'] == {(0, key1)}, changes
+        self.process_block(102, '0x2', events=events, values={'stakes': {}, 'subnets': {}, 'subnet_names': None,
+                                                               'modules': {f'0:{key1}:Name': 'renamed', f'0:{key1}:Address': '0.0.0.0:9000'}})
+        assert self.read(network='test')['maps']['Name']['0']['1'] == 'renamed'
+        self.rm('test')
+        return {'success': True, 'msg': 'chain state test passed'}
+
+
+if __name__ == '__main__':
+    ChainState.run()
@@ -6,6 +6,9 @@ import os
 import commune as c
 import requests 
 from substrateinterface import SubstrateInterface
+from scalecodec.base import ScaleBytes
+from concurrent.futures import ThreadPoolExecutor
+import threading
 
 U32_MAX = 2**32 - 1
 U16_MAX = 2**16 - 1
@@ -96,34 +99,38 @@ class Subspace(c.Module):
 
     network_mode = 'ws'
 
-    def resolve_url(self, url:str = None, network:str = None, mode=None , **kwargs):
+    def resolve_urls(self, network:str = None, mode=None, **kwargs) -> List[str]:
+        """
+        The node urls of the providers that match the url_search of the config
+        """
         network = network or self.config.network
         mode = mode or self.config.network_mode
-        if url == None:
-            url_search_terms = [x.strip() for x in self.config.url_search.split(',')]
-            is_match = lambda x: any([url in x for url in url_search_terms])
-            urls = []
-            for provider, mode2url in self.config.urls.items():
-                if is_match(provider):
-                    chain = c.module('subspace.chain')
-                    if provider == 'commune':
-                        url = chain.resolve_node_url(url=url, chain=network, mode=mode) 
-                    elif provider == 'local':
-                        url = chain.resolve_node_url(url=url, chain='local', mode=mode)
-                    else:
-                        url = mode2url[mode]
-
-                    if isinstance(url, list):
-                        urls += url
-                    else:
-                        urls += [url] 
+        url_search_terms = [x.strip() for x in self.config.url_search.split(',')]
+        is_match = lambda x: any([url in x for url in url_search_terms])
+        urls = []
+        for provider, mode2url in self.config.urls.items():
+            if is_match(provider):
+                chain = c.module('subspace.chain')
+                if provider == 'commune':
+                    url = chain.resolve_node_url(url=None, chain=network, mode=mode)
+                elif provider == 'local':
+                    url = chain.resolve_node_url(url=None, chain='local', mode=mode)
+                else:
+                    url = mode2url[mode]
 
-            url = c.choice(urls)
+                if isinstance(url, list):
+                    urls += url
+                else:
+                    urls += [url]
+        return urls
 
-        
+    def resolve_url(self, url:str = None, network:str = None, mode=None , **kwargs):
+        if url == None:
+            url = c.choice(self.resolve_urls(network=network, mode=mode))
         return url
-    
-    url2substrate = {}
+
+    url2pool = {}
+    pool_lock = threading.Lock()
     def get_substrate(self, 
                 network:str = 'main',
                 url : str = None,
@@ -138,7 +145,8 @@ class Subspace(c.Module):
                 auto_reconnect=True, 
                 trials:int = 10,
                 cache:bool = True,
-                mode = 'http',):
+                mode = 'http',
+                pool_size:int = None):
 
         
         '''
@@ -169,8 +177,26 @@ class Subspace(c.Module):
         network = network or self.config.network
 
         if cache:
-            if url in self.url2substrate:
-                return self.url2substrate[url]
+            # a pool of connections over the urls of the network, shared by the threads of the process
+            urls = [url] if url != None else self.resolve_urls(network=network, mode=mode)
+            pool_key = f'{network}::{mode}::' + ','.join(urls)
+            with self.pool_lock:
+                if pool_key not in self.url2pool:
+                    connect_kwargs = dict(websocket=websocket,
+                                          ss58_format=ss58_format,
+                                          type_registry=type_registry,
+                                          type_registry_preset=type_registry_preset,
+                                          cache_region=cache_region,
+                                          runtime_config=runtime_config,
+                                          ws_options=ws_options,
+                                          auto_discover=auto_discover,
+                                          auto_reconnect=auto_reconnect)
+                    self.url2pool[pool_key] = c.module('subspace.pool')(urls=urls,
+                                                                        size=pool_size or self.config.get('pool_size', 4),
+                                                                        connect_kwargs=connect_kwargs)
+            self.network = network
+            self.url = urls[0] if len(urls) == 1 else urls
+            return self.url2pool[pool_key].substrate
 
 
         while trials > 0:
@@ -193,15 +219,23 @@ class Subspace(c.Module):
                 if trials > 0:
                     raise e
         
-        if cache:
-            self.url2substrate[url] = substrate
-
         self.network = network
         self.url = url
         
         return substrate
 
 
+    def substrate_lease(self, network:str = None, mode:str = 'http', **kwargs):
+        """
+        Holds one connection of the pool, for calls that depend on each other (like an extrinsic)
+            with self.substrate_lease() as substrate:
+                ...
+        """
+        return self.get_substrate(network=network, mode=mode, **kwargs).pool.lease()
+
+    def pool_info(self) -> Dict[str, List[dict]]:
+        return {k: pool.info() for k, pool in self.url2pool.items()}
+
     def set_network(self, 
                 network:str = 'main',
                 mode = 'http',
@@ -399,7 +433,7 @@ class Subspace(c.Module):
         if len(params) > 0 :
             path = path + f'::params::' + '-'.join([str(p) for p in params])
 
-        value = self.get(path, None, max_age=max_age, update=update)
+        value = self.get(path, None, max_age=max_age, update=update, cache=True)
         if value != None:
             return value
         
@@ -453,6 +487,7 @@ class Subspace(c.Module):
     def query_map(self, name: str = 'StakeFrom', 
                   params: list = None,
                   block: Optional[int] = None, 
+                  block_hash: str = None, # the hash of the block (instead of its number)
                   network:str = 'main',
                   netuid = None,
                   page_size=1000,
@@ -486,16 +521,16 @@ class Subspace(c.Module):
             path = path + f'::params::' + '-'.join([str(p) for p in params])
         path = path+"::block::"
         paths = self.glob(path + '*')
-        update = update or len(paths) == 0 or block != None
+        update = update or len(paths) == 0 or block != None or block_hash != None
         if not update:
             last_path = sorted(paths, reverse=True)[0]
-            value = self.get(last_path, None , max_age=max_age)
+            value = self.get(last_path, None , max_age=max_age, cache=True)
         else:
             value = None
 
         if value == None:
             # block = block or self.block
-            path = path + f'{block}'
+            path = path + f'{block_hash or block}'
             network = self.resolve_network(network)
             # if the value is a tuple then we want to convert it to a list
     
@@ -509,7 +544,7 @@ class Subspace(c.Module):
                         params = params,
                         page_size = page_size,
                         max_results = max_results,
-                        block_hash =substrate.get_block_hash(block)
+                        block_hash = block_hash or substrate.get_block_hash(block)
                     )
                     break
                 except Exception as e:
@@ -574,12 +609,35 @@ class Subspace(c.Module):
         else:
             return self.query( 'N', params=[netuid], block=block , update=update, network=network, **kwargs)
 
+    def followed_state(self, network:str = None, max_age:float = None) -> Optional[dict]:
+        """
+        The state kept by a chain follower (subspace.state), if one is running for the network
+        """
+        network = network or self.config.network
+        return c.module('subspace.state').read(network=network, max_age=max_age)
+
+    def state_map(self, state:dict, name:str, netuid = 0) -> dict:
+        """
+        A map of the followed state, in the format of query_map (int uids and netuids)
+        """
+        to_key = lambda k: int(k) if c.is_int(k) else k
+        subnet2map = state['maps'].get(name, {})
+        # the maps keyed by uid are sorted by uid
+        to_map = lambda m: dict(sorted(((to_key(k), v) for k,v in m.items()), key=lambda x: (isinstance(x[0], str), x[0])))
+        if netuid == 'all':
+            return {int(n): to_map(m) for n, m in sorted(subnet2map.items(), key=lambda x: int(x[0]))}
+        return to_map(subnet2map.get(str(netuid), {}))
+
     ##########################
     #### Account functions ###
     
     """ Returns network Tempo hyper parameter """
     def stakes(self, netuid: int = 0, block: Optional[int] = None, fmt:str='nano', max_age = 100,network=None, update=False, **kwargs) -> int:
-        stakes =  self.query_map('Stake', netuid=netuid, update=update, max_age=max_age, **kwargs)
+        state = self.followed_state(network, max_age=max_age) if block == None and not update else None
+        if state != None:
+            stakes = self.state_map(state, 'Stake', netuid)
+        else:
+            stakes =  self.query_map('Stake', netuid=netuid, update=update, max_age=max_age, **kwargs)
         if netuid == 'all':
             subnet2stakes = c.copy(stakes)
             stakes = {}
@@ -1180,11 +1238,115 @@ class Subspace(c.Module):
                 results = substrate.query_multi(multi_query)
                 break
             except Exception as e:
-                trials -= 1 
-                if trials == 0: 
+                trials -= 1
+                if trials == 0:
                     raise e
         return results
 
+    def query_batch(self,
+                    queries: List[list],
+                    module:str = 'SubspaceModule',
+                    block: Optional[int] = None,
+                    block_hash: str = None,
+                    network:str = 'main',
+                    batch_size:int = 256,
+                    pipeline:int = 8,
+                    max_workers:int = 4,
+                    timeout:int = 30,
+                    trials:int = 4) -> List[Any]:
+        """
+        Reads many storage values at one block.
+        queries : a list of [feature, params] (or [module, feature, params])
+        The storage keys are read with state_queryStorageAt, batch_size keys per call,
+        and pipeline calls are sent in one json-rpc batch request.
+        returns the values in the order of the queries
+        """
+        with self.substrate_lease(network=network) as substrate:
+            block_hash = block_hash or substrate.get_block_hash(block)
+            # the keys are encoded with the metadata of the block
+            substrate.init_runtime(block_hash=block_hash)
+            storage_keys = []
+            for q in queries:
+                if len(q) == 2:
+                    q = [module, *q]
+                params = q[2] if isinstance(q[2], list) else [q[2]]
+                storage_keys.append(substrate.create_storage_key(q[0], q[1], params))
+        key2value = {}
+        hex_keys = [k.to_hex() for k in storage_keys]
+        unique_keys = list(dict.fromkeys(hex_keys))
+        batches = [unique_keys[i:i+batch_size] for i in range(0, len(unique_keys), batch_size)]
+        requests_batches = [batches[i:i+pipeline] for i in range(0, len(batches), pipeline)]
+        url = self.resolve_url(network=network, mode='http')
+
+        def send(request_batches):
+            payload = [{'id': i, 'jsonrpc': '2.0', 'method': 'state_queryStorageAt', 'params': [keys, block_hash]}
+                        for i, keys in enumerate(request_batches)]
+            for i in range(trials):
+                try:
+                    responses = requests.post(url, json=payload, timeout=timeout).json()
+                    changes = {}
+                    for response in responses:
+                        assert 'error' not in response, response['error']
+                        for result_group in response['result']:
+                            changes.update(dict(result_group['changes']))
+                    return changes
+                except Exception as e:
+                    if i == trials - 1:
+                        raise e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for changes in executor.map(send, requests_batches):
+                key2value.update(changes)
+
+        values = []
+        for storage_key, hex_key in zip(storage_keys, hex_keys):
+            data = key2value.get(hex_key)
+            value = storage_key.decode_scale_value(None if data == None else ScaleBytes(data))
+            values.append(value.value if hasattr(value, 'value') else value)
+        return values
+
+    def modules_state(self,
+                     netuid:int = 0,
+                     features: List[str] = None,
+                     block: Optional[int] = None,
+                     network:str = 'main',
+                     uid_features = ['Keys', 'Name', 'Address'],
+                     vector_features = ['Emission', 'Incentive', 'Dividends', 'LastUpdate', 'Trust'],
+                     key_features = ['StakeFrom', 'DelegationFee'],
+                     **kwargs) -> Dict[str, list]:
+        """
+        The modules of a subnet as columns (a list per feature, ordered by uid),
+        read at a single block so the features are consistent with each other
+        """
+        substrate = self.get_substrate(network=network)
+        block_hash = substrate.get_block_hash(block)
+        kwargs = dict(block_hash=block_hash, network=network, **kwargs)
+        if features != None:
+            features = [self.name2feature(f) if f[0].islower() else f for f in features]
+            features = [{'Key': 'Keys', 'Emissions': 'Emission'}.get(f, f) for f in features]
+            uid_features = [f for f in uid_features if f in features or f == 'Keys']
+            vector_features = [f for f in vector_features if f in features]
+            key_features = [f for f in key_features if f in features]
+        n = self.query_batch([['N', [netuid]]], **kwargs)[0]
+        uids = list(range(n))
+        # the uid features and the vectors in one pass
+        queries = [[f, [netuid, uid]] for f in uid_features for uid in uids] + [[f, [netuid]] for f in vector_features]
+        values = self.query_batch(queries, **kwargs)
+        state = {'uid': uids}
+        for i, f in enumerate(uid_features):
+            state[f] = values[i*n:(i+1)*n]
+        for i, f in enumerate(vector_features):
+            vector = values[len(uid_features)*n + i] or []
+            state[f] = [vector[uid] if uid < len(vector) else 0 for uid in uids]
+        # the features that are keyed by the module key
+        if len(key_features) > 0:
+            values = self.query_batch([[f, [netuid, k]] for f in key_features for k in state['Keys']], **kwargs)
+            for i, f in enumerate(key_features):
+                state[f] = values[i*n:(i+1)*n]
+        state = {self.feature2name(k) if k != 'Keys' else 'key': v for k,v in state.items()}
+        state['block_hash'] = block_hash
+        return state
+
     def blocks_until_vote(self, netuid=0, **kwargs):
         netuid = self.resolve_netuid(netuid)
         tempo = self.subnet_params(netuid=netuid, **kwargs)['tempo']
@@ -1748,77 +1910,23 @@ class Subspace(c.Module):
                 ) -> Dict[str, 'ModuleInfo']:
     
 
-        name2feature = {
-            'emission': 'Emission',
-            'incentive': 'Incentive',
-            'dividends': 'Dividends',
-            'last_update': 'LastUpdate',
-            'stake_from': 'StakeFrom',
-            'delegation_fee': 'DelegationFee',
-            'key': 'Keys',
-            'name': 'Name',
-            'address': 'Address',
-        }
-
-        name2default = {
-            'delegation_fee': 20,
-            'name': '',
-            'key': '',
-
-        }
-
-
-
         netuid = self.resolve_netuid(netuid or subnet)
         network = self.resolve_network(network)
-        state = {}
         path = f'query/{network}/SubspaceModule.Modules:{netuid}'
         modules = self.get(path, None, max_age=max_age)
         if modules == None:
-
-            progress = c.tqdm(total=len(features), desc=f'Querying {features}')
-            future2key = {}
-            def query(name, **kwargs):
-                if name in vector_features:
-                    fn = self.query_vector
-                else:
-                    fn = self.query_map
-                name = name2feature.get(name, name)
-                return fn(name=name, **kwargs)
-            key2future = {}
-
-            while not all([f in state for f in features ]):
-                c.print(f'Querying {features}')
-                for feature in features:
-                    if feature in state or feature in key2future:
-                        continue
-                    future = c.submit(query, kwargs=dict(name=feature, netuid=netuid, block=block, max_age=max_age))
-                    key2future[feature] = future
-                futures = list(key2future.values())
-                future2key = {v:k for k,v in key2future.items()}
-                for f in c.as_completed(futures, timeout=timeout):
-                    feature = future2key[f]
-                    key2future.pop(feature)
-                    result = f.result()
-                    if c.is_error(result):
-                        c.print('Failed: ', feature,  color='red')
-                        continue
-                    progress.update(1)
-                    state[feature] = f.result()
-                    break
-
-            uid2key = state['key']
-            uids = list(uid2key.keys())
-            modules = []
-            for uid in uids:
-                module = {}
-                for feature in features:
-                    if uid in state[feature] or isinstance(state[feature], list):
-                        module[feature] = state[feature][uid]
-                    else:
-                        uid_key = uid2key[uid]
-                        module[feature] = state[feature].get(uid_key, name2default.get(uid_key, None))
-                modules.append(module)
+            # all of the features are read at the same block
+            state = self.modules_state(netuid=netuid,
+                                       features=features,
+                                       block=block,
+                                       network=network,
+                                       vector_features=[self.name2feature(f) for f in vector_features],
+                                       timeout=timeout)
+            for feature in [f for f in features if f not in state]:
+                # features without a batched reader are read as maps (by uid or by key), at the same block
+                values = self.query_map(self.name2feature(feature), netuid=netuid, block_hash=state['block_hash'], network=network, max_age=max_age)
+                state[feature] = [values.get(uid, values.get(key, None)) for uid, key in zip(state['uid'], state['key'])]
+            modules = [{f: state[f][i] for f in features} for i in range(len(state['uid']))]
             self.put(path, modules)
 
             
@@ -1885,7 +1993,11 @@ class Subspace(c.Module):
              max_age= 1000,
              **kwargs):
         netuid = self.resolve_netuid(netuid)
-        uid2key =  self.query_map('Keys',  netuid=netuid, update=update, network=network, max_age=max_age, **kwargs)
+        state = self.followed_state(network, max_age=max_age) if not update else None
+        if state != None:
+            uid2key = self.state_map(state, 'Keys', netuid)
+        else:
+            uid2key =  self.query_map('Keys',  netuid=netuid, update=update, network=network, max_age=max_age, **kwargs)
         # sort by uid
         if uid != None:
             return uid2key[uid]
@@ -1941,6 +2053,14 @@ class Subspace(c.Module):
             'addresses': None
         }
         netuid = self.resolve_netuid(netuid)
+        state = self.followed_state(kwargs.get('network', None), max_age=max_age) if not update else None
+        if state != None:
+            names, addresses = self.state_map(state, 'Name', netuid), self.state_map(state, 'Address', netuid)
+            if netuid == 'all':
+                results = {'names': {n: list(m.values()) for n, m in names.items()},
+                           'addresses': {n: list(m.values()) for n, m in addresses.items()}}
+            else:
+                results = {'names': list(names.values()), 'addresses': list(addresses.values())}
         while any([v == None for v in results.values()]):
             future2key = {}
             for k,v in results.items():
@@ -1955,7 +2075,7 @@ class Subspace(c.Module):
 
         
         if netuid == 'all':
-            netuid2subnet = self.netuid2subnet()
+            netuid2subnet = {int(k): v for k,v in state['subnets'].items()} if state != None else self.netuid2subnet()
             namespace = {}
             for netuid, netuid_addresses in results['addresses'].items():
                 for uid,address in enumerate(netuid_addresses):
@@ -3710,44 +3830,45 @@ class Subspace(c.Module):
 
         for t in range(trials):
             try:
-                substrate = self.get_substrate(network=network, mode='ws')
-                call = substrate.compose_call(**compose_kwargs)
-                if sudo:
-                    call = substrate.compose_call(
-                        call_module='Sudo',
-                        call_function='sudo',
-                        call_params={
-                            'call': call,
-                        }
-                    )
-                if unchecked_weight:
-                    # uncheck the weights for set_code
-                    call = substrate.compose_call(
-                        call_module="Sudo",
-                        call_function="sudo_unchecked_weight",
-                        call_params={
-                            "call": call,
-                            'weight': (0,0)
-                        },
-                    )
-                # get nonce 
-                if tip < max_tip:
-                    tip = tip * 1e9
-                extrinsic = substrate.create_signed_extrinsic(call=call,keypair=key,nonce=nonce, tip=tip)
-
-                response = substrate.submit_extrinsic(extrinsic=extrinsic,
-                                                        wait_for_inclusion=wait_for_inclusion, 
-                                                        wait_for_finalization=wait_for_finalization)
-                if wait_for_finalization:
-                    if process_events:
-                        response.process_events()
-
-                    if response.is_success:
-                        response =  {'success': True, 'tx_hash': response.extrinsic_hash, 'msg': f'Called {module}.{fn} on {self.network} with key {key.ss58_address}'}
+                # one connection from the call to the receipt (the receipt reads its events later)
+                with self.substrate_lease(network=network, mode='ws') as substrate:
+                    call = substrate.compose_call(**compose_kwargs)
+                    if sudo:
+                        call = substrate.compose_call(
+                            call_module='Sudo',
+                            call_function='sudo',
+                            call_params={
+                                'call': call,
+                            }
+                        )
+                    if unchecked_weight:
+                        # uncheck the weights for set_code
+                        call = substrate.compose_call(
+                            call_module="Sudo",
+                            call_function="sudo_unchecked_weight",
+                            call_params={
+                                "call": call,
+                                'weight': (0,0)
+                            },
+                        )
+                    # get nonce 
+                    if tip < max_tip:
+                        tip = tip * 1e9
+                    extrinsic = substrate.create_signed_extrinsic(call=call,keypair=key,nonce=nonce, tip=tip)
+
+                    response = substrate.submit_extrinsic(extrinsic=extrinsic,
+                                                            wait_for_inclusion=wait_for_inclusion, 
+                                                            wait_for_finalization=wait_for_finalization)
+                    if wait_for_finalization:
+                        if process_events:
+                            response.process_events()
+
+                        if response.is_success:
+                            response =  {'success': True, 'tx_hash': response.extrinsic_hash, 'msg': f'Called {module}.{fn} on {self.network} with key {key.ss58_address}'}
+                        else:
+                            response =  {'success': False, 'error': response.error_message, 'msg': f'Failed to call {module}.{fn} on {self.network} with key {key.ss58_address}'}
                     else:
-                        response =  {'success': False, 'error': response.error_message, 'msg': f'Failed to call {module}.{fn} on {self.network} with key {key.ss58_address}'}
-                else:
-                    response =  {'success': True, 'tx_hash': response.extrinsic_hash, 'msg': f'Called {module}.{fn} on {self.network} with key {key.ss58_address}'}
+                        response =  {'success': True, 'tx_hash': response.extrinsic_hash, 'msg': f'Called {module}.{fn} on {self.network} with key {key.ss58_address}'}
                 break
             except Exception as e:
                 if t == trials - 1:
@@ -3827,6 +3948,103 @@ class Subspace(c.Module):
         modules = self.get_modules(netuid=0)
         return modules 
 
+    def test_modules(self, network:str = 'test'):
+        """
+        Reads the modules of a subnet from a recorded block: the columns go through the batched reader
+        (the storage keys, the batched and pipelined state_queryStorageAt calls, the decoding and the
+        defaults of the missing values), and a feature without a batched reader is read as a map at its block hash
+        """
+        import hashlib
+        import contextlib
+        from types import SimpleNamespace
+        from unittest import mock
+        from scalecodec.base import RuntimeConfigurationObject
+        from scalecodec.type_registry import load_type_registry_preset
+        block_hash = '0x' + '1' * 64
+        keys = ['5GrwvaEF5zXb26Fz9rcQpDWS57CtERHpNehXCPcNoHGKutQY',
+                '5FHneW46xGXgs5mUiveU4sbTyGBzmstUspZC92UhjJM694ty',
+                '5FLSigC9HGRKVhB9FiEo4Y3koPsNmBmLJbpXg2mp1hXcS59Y']
+        # the scale encoded values of the block (uid 2 has no name, address, stake or fee)
+        recorded = [['N', [0], '0x0300'],
+                    ['Keys', [0, 0], '0xd43593c715fdd31c61141abd04a99fd6822c8558854ccde39a5684e7a56da27d'],
+                    ['Keys', [0, 1], '0x8eaf04151687736326c9fea17e25fc5287613693c912909cb226aa4794f26a48'],
+                    ['Keys', [0, 2], '0x90b5ab205c6974c9ea841be688864633dc9ca8a357843eeacf2314649965fe22'],
+                    ['Name', [0, 0], '0x1c6d6f64756c6530'],
+                    ['Name', [0, 1], '0x1c6d6f64756c6531'],
+                    ['Address', [0, 0], '0x30302e302e302e303a38303030'],
+                    ['Address', [0, 1], '0x30302e302e302e303a38303031'],
+                    ['Emission', [0], '0x0c00ca9a3b0000000000000000000000000500000000000000'],
+                    ['Incentive', [0], '0x0cffff00000000'],
+                    ['Dividends', [0], '0x0c0000ffff0000'],
+                    ['LastUpdate', [0], '0x0c640000000000000063000000000000006200000000000000'],
+                    ['Trust', [0], '0x0c00000000ffff'],
+                    ['StakeFrom', [0, keys[0]], '0x04d43593c715fdd31c61141abd04a99fd6822c8558854ccde39a5684e7a56da27d00ca9a3b00000000'],
+                    ['StakeFrom', [0, keys[1]], '0x04d43593c715fdd31c61141abd04a99fd6822c8558854ccde39a5684e7a56da27d0094357700000000'],
+                    ['DelegationFee', [0, keys[0]], '0x14'],
+                    ['DelegationFee', [0, keys[1]], '0x05']]
+        types = {'N': 'u16', 'Keys': 'AccountId', 'Name': 'Bytes', 'Address': 'Bytes', 'Emission': 'Vec<u64>', 'Incentive': 'Vec<u16>',
+                 'Dividends': 'Vec<u16>', 'LastUpdate': 'Vec<u64>', 'Trust': 'Vec<u16>', 'StakeFrom': 'Vec<(AccountId, u64)>', 'DelegationFee': 'Percent'}
+        defaults = {'Name': '', 'Address': '', 'StakeFrom': [], 'DelegationFee': 20} # the defaults of the metadata
+        runtime_config = RuntimeConfigurationObject(ss58_format=42)
+        for preset in ['core', 'legacy']:
+            runtime_config.update_type_registry(load_type_registry_preset(preset))
+        storage_key = lambda feature, params: '0x' + hashlib.sha256(json.dumps([feature, params]).encode()).hexdigest()
+        key2value = {storage_key(feature, params): value for feature, params, value in recorded}
+
+        def decode(feature:str, data = None):
+            if data == None:
+                return defaults[feature]
+            value = runtime_config.create_scale_object(types[feature], data)
+            value.decode()
+            return value
+        # the keys and the leased connection of the block (no class, as the module is the last class of the file)
+        recorded_key = lambda feature, params: SimpleNamespace(to_hex=lambda: storage_key(feature, params),
+                                                               decode_scale_value=lambda data=None: decode(feature, data))
+        substrate = SimpleNamespace(get_block_hash=lambda block=None: block_hash,
+                                    init_runtime=lambda block_hash=None: None,
+                                    create_storage_key=lambda module, feature, params: recorded_key(feature, params))
+
+        posts = []
+        def post(url:str, **kwargs):
+            # a node returns every key of a call, with null for the missing values
+            posts.append(kwargs['json'])
+            assert all(r['method'] == 'state_queryStorageAt' and r['params'][1] == block_hash for r in kwargs['json'])
+            results = [{'id': r['id'], 'jsonrpc': '2.0', 'result': [{'block': block_hash, 'changes': [[k, key2value.get(k)] for k in r['params'][0]]}]}
+                       for r in kwargs['json']]
+            return mock.Mock(json=lambda: results)
+        block2weights = {block_hash: {0: [[1, U16_MAX]], 1: [], 2: []}}
+        calls = []
+        def query_map(name, block_hash=None, **kwargs):
+            calls.append((name, block_hash))
+            return block2weights[block_hash]
+
+        self.substrate = None # the values are recorded, so there is no connection
+        self.get_substrate = lambda **kwargs: substrate
+        self.substrate_lease = lambda **kwargs: contextlib.nullcontext(substrate)
+        self.resolve_url = lambda **kwargs: 'http://recorded'
+        self.query_map = query_map
+        path = f'query/{network}/SubspaceModule.Modules:0'
+        self.rm(path)
+        try:
+            with mock.patch.object(requests, 'post', post):
+                # 2 keys per call and 2 calls per request, so the columns take several requests
+                state = self.modules_state(netuid=0, network=network, batch_size=2, pipeline=2)
+                # N, then 7 calls for the 14 uid and vector keys, then 3 calls for the 6 key features
+                assert len(posts) == 7 and sum(len(p) for p in posts) == 11, [len(p) for p in posts]
+                assert max(len(r['params'][0]) for p in posts for r in p) == 2
+                assert state['uid'] == [0, 1, 2] and state['key'] == keys and state['block_hash'] == block_hash, state
+                assert state['name'] == ['module0', 'module1', ''] and state['address'] == ['0.0.0.0:8000', '0.0.0.0:8001', ''], state
+                assert state['emission'] == [10**9, 0, 5] and state['incentive'] == [U16_MAX, 0, 0] and state['trust'] == [0, 0, U16_MAX], state
+                assert state['stake_from'][2] == [] and state['delegation_fee'] == [20, 5, 20], state
+                modules = self.modules(network=network, features=self.module_features + ['weights'], fmt='j')
+            assert calls == [('Weights', block_hash)], calls
+            assert [m['weights'] for m in modules] == [[[1, U16_MAX]], [], []], modules
+            assert [m['stake'] for m in modules] == [1, 2, 0] and modules[0]['incentive'] == 1, modules
+            assert modules[1]['key'] == keys[1] and modules[2]['name'] == '', modules
+        finally:
+            self.rm(path)
+        return {'success': True, 'msg': 'modules test passed'}
+
 
             
     
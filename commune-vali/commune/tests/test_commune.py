@@ -3,12 +3,19 @@ import pytest
 import commune as c 
 def test_key():
     c.module('key').test()
+def test_key_ss58_address():
+    # the Module dunders (c.__ss58_format__) resolve on the package
+    assert c.valid_ss58_address(c.module('key').new_key().ss58_address)
 def test_namespace():
     c.module('namespace').test()
 def test_server():
     c.module('server').test()
 def test_subnet():
     c.module('subnet').test()
+def test_tree():
+    c.module('tree').test()
+def test_subspace_modules():
+    c.module('subspace')().test_modules()
 
 
 
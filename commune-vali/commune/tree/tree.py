@@ -1,6 +1,7 @@
 import commune as c
 from typing import *
 import os
+import json
 from copy import deepcopy
 
 class Tree(c.Module):
@@ -29,14 +30,10 @@ class Tree(c.Module):
         if os.path.exists(path + '.py'):
             path =  path + '.py'
         else:
-            root_tree = cls.root_tree()
-            tree = cls.tree()
-            tree.update(root_tree)
-            is_module_in_tree = bool(simple_path in tree)
-            if not is_module_in_tree:
+            tree = cls.tree(include_root=True)
+            if simple_path not in tree:
+                # only the folders that changed are rescanned
                 tree = cls.tree(update=True, include_root=True)
-                tree.update(root_tree)
-
             path = tree[simple_path]
             
         return path
@@ -56,12 +53,13 @@ class Tree(c.Module):
     def root_tree(cls, **kwargs):
         return cls.tree(path = c.libpath, include_root=False, **kwargs)
 
-    _tree_cache = {}    
-
+    path2is_repo = {}
     @classmethod
     def is_repo(cls, libpath:str ):
         # has the .git folder
-        return bool([f for f in cls.ls(libpath) if '.git' in f and os.path.isdir(f)])
+        if libpath not in cls.path2is_repo:
+            cls.path2is_repo[libpath] = bool([f for f in cls.ls(libpath) if '.git' in f and os.path.isdir(f)])
+        return cls.path2is_repo[libpath]
     
     @classmethod
     def tree(cls, 
@@ -76,37 +74,176 @@ class Tree(c.Module):
         is_repo = cls.is_repo(path)
         if not is_repo:
             path = cls.root_tree_path
-        cache_path = path.split('/')[-1]
-        if cache_path in cls._tree_cache:
-            tree = cls._tree_cache[cache_path]
-        else:
-            tree =  c.get(cache_path, {}, max_age=max_age, update=update)
-        if len(tree) == 0:
-            tree = cls.build_tree(path)
-            cls._tree_cache[cache_path] = tree
-            cls.put(cache_path, tree)
+        index = cls.index(path, update=update, max_age=max_age)
+        tree = index['tree']
         if search != None:
             tree = {k:v for k,v in tree.items() if search in k}
-        if include_root:
+        if include_root and path != cls.root_tree_path:
             root_tree = cls.root_tree()
             tree = {**root_tree, **tree}
         return tree
-    
 
-    
+    # THE MODULE INDEX
+    # the modules of a tree are indexed once, and then the index is kept up to date from the mtimes:
+    # a folder is rescanned when its mtime changed (a file was added or removed), and a file is
+    # parsed again when its own mtime changed. A lookup of a module does not walk or import anything.
+
+    index_cache = {} # tree path -> index
+    skip_dirs = ['__pycache__', '.git', 'node_modules']
+
+    @classmethod
+    def index_path(cls, tree_path:str) -> str:
+        return cls.resolve_path('index/' + tree_path.strip('/').replace('/', '_') + '.json')
+
+    @classmethod
+    def index(cls, tree_path:str = None, update:bool = False, max_age:int = None) -> dict:
+        """
+        The index of a tree:
+            files: path -> {simple, mtime, classes} (classes found on first use)
+            dirs: folder -> mtime
+            tree: simple path -> path
+        """
+        tree_path = cls.resolve_path(tree_path or cls.root_tree_path)
+        index = cls.index_cache.get(tree_path)
+        if index == None:
+            index = cls.get(cls.index_path(tree_path), None)
+            if index == None or index.get('root') != tree_path:
+                index = cls.build_index(tree_path)
+            cls.index_cache[tree_path] = index
+        elif max_age != None and c.time() - index['timestamp'] > max_age:
+            update = True
+        if update:
+            cls.refresh_index(index)
+        return index
+
+    @classmethod
+    def build_index(cls, tree_path:str) -> dict:
+        index = {'root': tree_path, 'files': {}, 'dirs': {}, 'tree': {}, 'timestamp': c.time()}
+        cls.scan_dir(index, tree_path)
+        cls.save_index(index)
+        return index
+
+    @classmethod
+    def refresh_index(cls, index:dict) -> dict:
+        """
+        Rescans the folders whose mtime changed (one stat per folder)
+        """
+        n = 0
+        for dirpath, mtime in list(index['dirs'].items()):
+            if dirpath not in index['dirs']:
+                continue # removed with its parent
+            try:
+                new_mtime = os.stat(dirpath).st_mtime_ns
+            except FileNotFoundError:
+                new_mtime = None
+            if new_mtime != mtime:
+                n += cls.scan_dir(index, dirpath)
+        index['timestamp'] = c.time()
+        if n > 0:
+            cls.save_index(index)
+        return {'changed': n}
+
+    @classmethod
+    def is_module_file(cls, filename:str) -> bool:
+        return filename.endswith('.py') and '__init__' not in filename and not filename.startswith('_')
+
+    @classmethod
+    def scan_dir(cls, index:dict, dirpath:str) -> int:
+        """
+        Indexes the modules of a folder (and of its new subfolders), returns the number of changes
+        """
+        n = 0
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+            entries = list(os.scandir(dirpath))
+        except (FileNotFoundError, NotADirectoryError):
+            entries, mtime = None, None
+        if entries == None:
+            # the folder was removed, with everything under it
+            prefix = dirpath + '/'
+            for d in [d for d in index['dirs'] if d == dirpath or d.startswith(prefix)]:
+                del index['dirs'][d]
+            for f in [f for f in index['files'] if f.startswith(prefix)]:
+                cls.rm_file(index, f)
+                n += 1
+            return n
+        index['dirs'][dirpath] = mtime
+        files = set()
+        # the files before the subfolders, in the order of os.walk (so the same module wins a name clash)
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) and cls.is_module_file(entry.name):
+                files.add(entry.path)
+                if cls.index_file(index, entry.path, entry.stat().st_mtime_ns):
+                    n += 1
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in cls.skip_dirs and entry.path not in index['dirs']:
+                    n += cls.scan_dir(index, entry.path)
+        for f in [f for f in index['files'] if os.path.dirname(f) == dirpath and f not in files]:
+            cls.rm_file(index, f)
+            n += 1
+        for d in [d for d in index['dirs'] if os.path.dirname(d) == dirpath and not os.path.isdir(d)]:
+            n += cls.scan_dir(index, d)
+        return n
+
+    @classmethod
+    def index_file(cls, index:dict, path:str, mtime:int = None, parse:bool = False) -> bool:
+        """
+        Indexes the file if it is new or changed (its classes are found when they are first needed).
+        A simple path keeps the file it maps to (the first one scanned), unless that file was removed
+        """
+        mtime = mtime or os.stat(path).st_mtime_ns
+        entry = index['files'].get(path)
+        if entry != None and entry['mtime'] == mtime and (not parse or 'classes' in entry):
+            return False
+        entry = {'simple': cls.path2simple(path), 'mtime': mtime}
+        if parse:
+            entry['classes'] = cls.find_classes(path)
+        index['files'][path] = entry
+        if index['tree'].get(entry['simple']) not in index['files']:
+            index['tree'][entry['simple']] = path
+        return True
+
+    @classmethod
+    def rm_file(cls, index:dict, path:str):
+        entry = index['files'].pop(path, None)
+        if entry != None and index['tree'].get(entry['simple']) == path:
+            del index['tree'][entry['simple']]
+            # another file can have the same simple path
+            for f, e in index['files'].items():
+                if e['simple'] == entry['simple']:
+                    index['tree'][entry['simple']] = f
+                    break
+
+    @classmethod
+    def save_index(cls, index:dict):
+        path = cls.index_path(index['root'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def file_info(cls, path:str) -> Optional[dict]:
+        """
+        The index entry of a file (its classes are found again if it changed since it was indexed)
+        """
+        for index in list(cls.index_cache.values()):
+            if path in index['files']:
+                try:
+                    if cls.index_file(index, path, parse=True):
+                        cls.save_index(index)
+                except FileNotFoundError:
+                    return None
+                return index['files'][path]
+        return None
 
     @classmethod
     def build_tree(cls, tree_path:str = './', **kwargs):
         tree_path = cls.resolve_path(tree_path)
-        module_tree = {}
-        for root, dirs, files in os.walk(tree_path):
-            for file in files:
-                if file.endswith('.py') and '__init__' not in file and not file.split('/')[-1].startswith('_'):
-                    path = os.path.join(root, file)
-                    simple_path = cls.path2simple(path)
-                    module_tree[simple_path] = path
+        return cls.index(tree_path, update=True)['tree']
 
-        return module_tree
     @classmethod
     def tree_paths(cls, update=False, **kwargs) -> List[str]:
         return cls.ls()
@@ -269,7 +406,8 @@ class Tree(c.Module):
     @classmethod
     def simple2objectpath(cls, simple_path:str, **kwargs) -> str:
         object_path = cls.simple2path(simple_path, **kwargs)
-        classes =  cls.find_classes(object_path)
+        info = cls.file_info(object_path)
+        classes = info['classes'] if info != None else cls.find_classes(object_path)
         if object_path.startswith(c.libpath):
             object_path = object_path[len(c.libpath):]
         object_path = object_path.replace('.py', '')
@@ -278,6 +416,56 @@ class Tree(c.Module):
             object_path = object_path[1:]
         object_path = object_path + '.' + classes[-1]
         return object_path
+
+    @classmethod
+    def test(cls):
+        """
+        Refreshes the index of a temporary tree as its files are edited, added and removed
+        """
+        import shutil
+        import tempfile
+        root = tempfile.mkdtemp()
+        def write(path:str, text:str = 'class A: pass'):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path) # as editors save, so the folder mtime changes
+            # the mtimes of the files and folders move forward, even on a coarse clock
+            for p in [path, os.path.dirname(path)]:
+                mtime = os.stat(p).st_mtime_ns + 10**9
+                os.utime(p, ns=(mtime, mtime))
+        a, b = root + '/a/b.py', root + '/a/b/b.py' # two files with the same simple path
+        write(a)
+        write(b)
+        try:
+            index = cls.build_index(root)
+            simple = cls.path2simple(a)
+            assert cls.path2simple(b) == simple and index['tree'][simple] == a, index['tree']
+            # saving the other file does not change which one the name resolves to
+            write(b, 'class B: pass')
+            assert cls.refresh_index(index)['changed'] == 1
+            assert index['tree'][simple] == a, index['tree']
+            # a new file is indexed, and an unchanged tree is not rescanned
+            c_path = root + '/a/c.py'
+            write(c_path)
+            assert cls.refresh_index(index)['changed'] == 1 and index['tree'][cls.path2simple(c_path)] == c_path
+            assert cls.refresh_index(index)['changed'] == 0
+            # the name moves to the other file once its file is removed
+            os.remove(a)
+            write(c_path, 'class C: pass')
+            assert cls.refresh_index(index)['changed'] == 2
+            assert index['tree'][simple] == b, index['tree']
+            # a removed folder removes its files
+            shutil.rmtree(root + '/a/b')
+            mtime = os.stat(root + '/a').st_mtime_ns + 10**9
+            os.utime(root + '/a', ns=(mtime, mtime))
+            cls.refresh_index(index)
+            assert simple not in index['tree'] and b not in index['files'], index
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+            if os.path.exists(cls.index_path(root)):
+                os.remove(cls.index_path(root))
+        return {'success': True, 'msg': 'tree index test passed'}
     
     
 
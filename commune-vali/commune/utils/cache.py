@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+
+class FileCache:
+    """
+    A bounded in-memory tier over files, used by Module.get/put.
+
+    Entries are keyed by path and stamped with the (mtime, size, inode) of the file,
+    so a write from any process invalidates them on the next read. Entries are evicted
+    in lru order once max_items or max_bytes (the file sizes) is exceeded, and expire
+    after ttl seconds if a ttl is set. Values are json-like, and the readers get copies
+    of the dicts and lists, so they can mutate them.
+    """
+
+    def __init__(self, max_items:int = 1024, max_bytes:int = 256 * 1024**2, ttl:float = None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict() # path -> (stamp, value, cached_at)
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> dict:
+        self.hits = self.misses = self.stale = self.evictions = 0
+        return self.stats()
+
+    def stamp(self, path:str):
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def get(self, path:str, loader:Callable[[], Any]) -> Any:
+        """
+        Returns the cached value of the path if the file did not change, otherwise loads it
+        """
+        stamp = self.stamp(path)
+        if stamp == None:
+            self.invalidate(path)
+            return loader()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry != None:
+                if entry[0] == stamp and (self.ttl == None or time.time() - entry[2] < self.ttl):
+                    self.entries.move_to_end(path)
+                    self.hits += 1
+                    return self.copy(entry[1])
+                self.stale += 1
+            self.misses += 1
+        value = loader()
+        self.set(path, value, stamp)
+        return self.copy(value)
+
+    def write(self, path:str, text:str, value:Any) -> str:
+        """
+        Writes the text to the path atomically and caches its value, stamped with the file
+        written here (not the path, which a concurrent writer may have replaced since)
+        """
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+            f.flush()
+            stat = os.fstat(f.fileno())
+        os.replace(tmp_path, path)
+        self.set(path, self.copy(value), (stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        return path
+
+    @classmethod
+    def copy(cls, value:Any) -> Any:
+        if isinstance(value, dict):
+            return {k: cls.copy(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls.copy(v) for v in value]
+        return value
+
+    def set(self, path:str, value:Any, stamp) -> None:
+        if stamp == None or value == None:
+            return self.invalidate(path)
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old != None:
+                self.nbytes -= old[0][1]
+            self.entries[path] = (stamp, value, time.time())
+            self.nbytes += stamp[1]
+            while len(self.entries) > self.max_items or (self.nbytes > self.max_bytes and len(self.entries) > 1):
+                _, (old_stamp, _, _) = self.entries.popitem(last=False)
+                self.nbytes -= old_stamp[1]
+                self.evictions += 1
+
+    def invalidate(self, path:str = None) -> None:
+        with self.lock:
+            if path == None:
+                self.entries.clear()
+                self.nbytes = 0
+            else:
+                entry = self.entries.pop(path, None)
+                if entry != None:
+                    self.nbytes -= entry[0][1]
+
+    clear = invalidate
+
+    def stats(self) -> dict:
+        n = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / n if n > 0 else 0,
+                'items': len(self.entries),
+                'bytes': self.nbytes,
+                'max_items': self.max_items,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl}
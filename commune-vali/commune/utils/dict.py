@@ -5,7 +5,6 @@ import random
 import yaml
 import json
 from copy import deepcopy
-import numpy as np
 from contextlib import contextmanager
 from typing import Dict, List, Union, Any, Tuple, Callable, Optional
 from importlib import import_module
@@ -16,7 +15,6 @@ import datetime
 import munch
 from commune.utils.asyncio import sync_wrapper
 from commune.utils.os import ensure_path, path_exists
-import pandas as pd
 
 def rm_json(path:str, ignore_error:bool=True) -> Union['NoneType', str]:
     import shutil, os
@@ -444,6 +442,7 @@ async def async_get_json(path, return_type='dict', handle_error=True, default =
     if return_type in ['dict', 'json']:
         data = data
     elif return_type in ['pandas', 'pd']:
+        import pandas as pd
         data = pd.DataFrame(data)
     elif return_type in ['torch']:
         raise NotImplemented('Torch Not Implemented')
@@ -460,17 +459,20 @@ async def async_put_json( path, data):
     data_type = type(data)
     if data_type in [dict, list, tuple, set, float, str, int]:
         json_str = json.dumps(data)
-    elif data_type in [pd.DataFrame]:
-        json_str = json.dumps(data.to_dict())
-
-    elif data_type in [np.ndarray]:
-        json_str = json.dumps(data.tolist())
-    elif data_type in [np.float32, np.float64, np.float16]:
-        json_str = json.dumps(float(data))
     elif data_type in [Munch]:
         json_str = json.dumps(data.toDict())
     else:
-        raise NotImplementedError(f"{data_type}, is not supported")
+        # numpy and pandas are only imported for their types
+        import numpy as np
+        import pandas as pd
+        if data_type in [pd.DataFrame]:
+            json_str = json.dumps(data.to_dict())
+        elif data_type in [np.ndarray]:
+            json_str = json.dumps(data.tolist())
+        elif data_type in [np.float32, np.float64, np.float16]:
+            json_str = json.dumps(float(data))
+        else:
+            raise NotImplementedError(f"{data_type}, is not supported")
     
     return await async_write(path, json_str)
 
@@ -493,6 +495,7 @@ async def async_get_yaml(path:str, return_type:str='dict', handle_error: bool =
     if return_type in ['dict', 'yaml']:
         data = data
     elif return_type in ['pandas', 'pd']:
+        import pandas as pd
         data = pd.DataFrame(data)
     elif return_type in ['torch']:
         raise NotImplemented('Torch not implemented')
@@ -509,7 +512,7 @@ async def async_put_yaml( path, data):
     data_type = type(data)
     if data_type in [dict, list, tuple, set, float, str, int]:
         yaml_str = yaml.dump(data)
-    elif data_type in [pd.DataFrame]:
+    elif data_type.__name__ == 'DataFrame':
         yaml_str = yaml.dump(data.to_dict())
     else:
         raise NotImplementedError(f"{data_type}, is not supported")
@@ -0,0 +1,277 @@
+import commune as c
+import numpy as np
+import os
+import json
+import threading
+from typing import *
+
+class Store(c.Module):
+    """
+    The score store of a validator, which keeps the module scores in memory as columns
+    (numpy arrays for numbers, object arrays for the rest) with a row per module.
+
+    Every update is appended to a log (log.jsonl), and the columns are periodically
+    written to a snapshot (snapshot.json), after which the log is truncated.
+    On load the snapshot is read and the log is replayed on top of it.
+    """
+    float_columns = ['w', 'timestamp', 'latency', 'staleness', 'past_w', 'past_timestamp', 'alpha']
+
+    def __init__(self,
+                 path:str = 'scores', # the folder of the snapshot and the log
+                 snapshot_interval:int = 60, # seconds between snapshots
+                 capacity:int = 1024, # the initial number of rows
+                 legacy_path:str = None, # a folder of per module json files to import on first load
+                 **kwargs):
+        self.path = self.resolve_path(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.snapshot_path = self.path + '/snapshot.json'
+        self.log_path = self.path + '/log.jsonl'
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.RLock()
+        self.reset(capacity)
+        self.load(legacy_path=legacy_path)
+
+    def reset(self, capacity:int = 1024):
+        with self.lock:
+            self.capacity = capacity
+            self.n = 0
+            self.key2row = {} # module name -> row
+            self.keys = np.empty(capacity, dtype=object)
+            self.columns = {}
+            self.last_snapshot = c.time()
+        return {'success': True, 'msg': 'reset store'}
+
+    def add_column(self, k:str, v=None):
+        if k in self.float_columns or (type(v) in [int, float, bool] and v is not None):
+            self.columns[k] = np.full(self.capacity, np.nan, dtype=np.float64)
+        else:
+            self.columns[k] = np.empty(self.capacity, dtype=object)
+        return self.columns[k]
+
+    def grow(self):
+        self.capacity *= 2
+        self.keys = np.resize(self.keys, self.capacity)
+        self.keys[self.n:] = None
+        for k, col in self.columns.items():
+            new_col = np.full(self.capacity, np.nan, dtype=np.float64) if col.dtype == np.float64 else np.empty(self.capacity, dtype=object)
+            new_col[:self.n] = col[:self.n]
+            self.columns[k] = new_col
+
+    def set_row(self, key:str, row:dict) -> int:
+        i = self.key2row.get(key)
+        if i == None:
+            if self.n == self.capacity:
+                self.grow()
+            i = self.key2row[key] = self.n
+            self.keys[i] = key
+            self.n += 1
+        for k, v in row.items():
+            if not (v is None or type(v) in [int, float, bool, str]):
+                continue # only scalars are stored
+            col = self.columns.get(k)
+            if col is None:
+                col = self.add_column(k, v)
+            if col.dtype == np.float64:
+                try:
+                    v = np.nan if v is None else float(v)
+                except (TypeError, ValueError):
+                    continue
+            col[i] = v
+        return i
+
+    def update(self, key:str, row:dict) -> dict:
+        """
+        Upserts the row of the module, and appends it to the log
+        """
+        row = {k:v for k,v in row.items() if v is None or type(v) in [int, float, bool, str]}
+        with self.lock:
+            self.set_row(key, row)
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps({'key': key, 'row': row}) + '\n')
+            if c.time() - self.last_snapshot > self.snapshot_interval:
+                self.snapshot()
+        return row
+
+    def rm_rows(self, keys:List[str]) -> int:
+        """
+        Removes the rows by moving the last rows into their place
+        """
+        with self.lock:
+            n = 0
+            for key in keys:
+                i = self.key2row.pop(key, None)
+                if i == None:
+                    continue
+                last = self.n - 1
+                if i != last:
+                    last_key = self.keys[last]
+                    self.keys[i] = last_key
+                    self.key2row[last_key] = i
+                    for col in self.columns.values():
+                        col[i] = col[last]
+                self.keys[last] = None
+                for col in self.columns.values():
+                    col[last] = np.nan if col.dtype == np.float64 else None
+                self.n -= 1
+                n += 1
+        return n
+
+    def row(self, key:str) -> Optional[dict]:
+        # under the lock, as rm_rows moves the last row into the freed slots
+        with self.lock:
+            i = self.key2row.get(key)
+            if i == None:
+                return None
+            row = {}
+            for k, col in self.columns.items():
+                v = col[i]
+                if col.dtype == np.float64:
+                    if np.isnan(v):
+                        continue
+                    v = float(v)
+                elif v is None:
+                    continue
+                row[k] = v
+        return row
+
+    def column(self, k:str) -> np.ndarray:
+        col = self.columns.get(k)
+        if col is None:
+            return np.full(self.n, np.nan)
+        return col[:self.n]
+
+    def snapshot(self) -> dict:
+        """
+        Writes the columns to the snapshot file (atomically), and truncates the log
+        """
+        with self.lock:
+            columns = {}
+            for k, col in self.columns.items():
+                col = col[:self.n]
+                columns[k] = [None if v != v else v for v in col.tolist()] if col.dtype == np.float64 else col.tolist()
+            snapshot = {'keys': self.keys[:self.n].tolist(), 'columns': columns, 'timestamp': c.time()}
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+            open(self.log_path, 'w').close()
+            self.last_snapshot = c.time()
+        return {'success': True, 'n': self.n, 'path': self.snapshot_path}
+
+    def load(self, legacy_path:str = None) -> dict:
+        with self.lock:
+            n_log = 0
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path) as f:
+                    snapshot = json.load(f)
+                keys = snapshot['keys']
+                while self.capacity < len(keys):
+                    self.grow()
+                for k, values in snapshot['columns'].items():
+                    col = self.add_column(k, next((v for v in values if v is not None), None))
+                    if col.dtype == np.float64:
+                        col[:len(values)] = [np.nan if v is None else v for v in values]
+                    else:
+                        col[:len(values)] = values
+                self.keys[:len(keys)] = keys
+                self.key2row = {k:i for i,k in enumerate(keys)}
+                self.n = len(keys)
+            elif legacy_path != None and os.path.isdir(legacy_path):
+                # import the per module json files of the old layout once
+                for path in self.ls(legacy_path):
+                    if path.endswith('.json'):
+                        row = self.get(path, None)
+                        if isinstance(row, dict) and 'name' in row:
+                            self.set_row(row['name'], row)
+            if os.path.exists(self.log_path):
+                with open(self.log_path) as f:
+                    for line in f:
+                        try:
+                            update = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue # a partial line from a crashed writer
+                        self.set_row(update['key'], update['row'])
+                        n_log += 1
+        return {'success': True, 'n': self.n, 'replayed': n_log}
+
+    def leaderboard(self,
+                    keys = ['name', 'w', 'staleness', 'latency'],
+                    max_age:float = None,
+                    min_weight:float = None,
+                    search:str = None,
+                    sort_by = ['w'],
+                    ascending = True,
+                    n:int = None,
+                    page:int = None,
+                    to_dict:bool = False,
+                    rm_expired:bool = True):
+        """
+        Filters, sorts and paginates the rows with array operations
+        """
+        with self.lock:
+            now = c.time()
+            w = self.column('w')
+            timestamp = self.column('timestamp')
+            mask = ~np.isnan(w)
+            if min_weight != None:
+                mask &= w > min_weight
+            if max_age != None:
+                expired = (now - np.nan_to_num(timestamp)) > max_age
+                if rm_expired and expired.any():
+                    self.rm_rows(self.keys[:self.n][expired].tolist())
+                    return self.leaderboard(keys=keys, max_age=max_age, min_weight=min_weight, search=search,
+                                            sort_by=sort_by, ascending=ascending, n=n, page=page, to_dict=to_dict, rm_expired=False)
+                mask &= ~expired
+            if search != None:
+                mask &= np.array([search in str(k) for k in self.keys[:self.n]], dtype=bool)
+            idx = np.nonzero(mask)[0]
+            columns = {}
+            for k in keys:
+                columns[k] = now - timestamp[idx] if k == 'staleness' else self.column(k)[idx]
+            sort_by = [sort_by] if isinstance(sort_by, str) else sort_by
+            sort_keys = [columns[k] if k in columns else self.column(k)[idx] for k in sort_by]
+            if len(sort_keys) > 0 and len(idx) > 0:
+                # lexsort sorts by the last key first
+                order = np.lexsort([np.asarray(s, dtype=np.float64) if s.dtype == np.float64 else s.astype(str) for s in sort_keys[::-1]])
+                if not ascending:
+                    order = order[::-1]
+            else:
+                order = np.arange(len(idx))
+            if n != None:
+                start = page * n if page != None else 0
+                order = order[start:start + n]
+            rows = {k: v[order].tolist() for k,v in columns.items()}
+        if to_dict:
+            return [{k: rows[k][i] for k in keys} for i in range(len(order))]
+        return c.df(rows)
+
+    def test(self, n=1000):
+        path = 'test_store'
+        self.rm(path)
+        self = Store(path=path, snapshot_interval=1e9)
+        for i in range(n):
+            self.update(f'module{i}', {'name': f'module{i}', 'w': i/n, 'timestamp': c.time(), 'latency': 0.1, 'ss58_address': f'addr{i}'})
+        top = self.leaderboard(keys=['name', 'w'], ascending=False, n=10, to_dict=True)
+        assert top[0]['name'] == f'module{n-1}', top[0]
+        assert len(self.leaderboard(n=10, page=2, to_dict=True)) == 10
+        self.rm_rows(['module0'])
+        # a row read while other rows are removed (and their slots refilled) is the row of its key
+        def churn():
+            for i in range(200):
+                key = f'module{i % 10 + 2}'
+                self.rm_rows([key])
+                self.update(key, {'name': key, 'w': 0.5})
+        thread = threading.Thread(target=churn)
+        thread.start()
+        while thread.is_alive():
+            for key in [f'module{n-1}', f'module{n//2}']:
+                row = self.row(key)
+                assert row['name'] == key, row
+        self.snapshot()
+        self.update('module1', {'w': 2.0})
+        # the snapshot and the log are restored
+        store = Store(path=path)
+        assert store.n == n - 1 and store.row('module1')['w'] == 2.0, store.row('module1')
+        assert store.row('module0') == None
+        self.rm(path)
+        return {'success': True, 'msg': 'store test passed'}
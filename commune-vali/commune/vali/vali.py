@@ -1,6 +1,9 @@
 
 import commune as c
 from typing import *
+import asyncio
+import threading
+from functools import partial
 
 class Vali(c.Module):
 
@@ -55,6 +58,10 @@ class Vali(c.Module):
         self.last_error = 0
         self.last_sent = 0 
         self.last_success = 0
+        self.futures = []
+        self.tasks = []
+        self.executor = None # the thread executor (thread engine)
+        self.store = None # the score store (see score_store)
 
 
     @property
@@ -71,9 +78,9 @@ class Vali(c.Module):
             'success_staleness': self.success_staleness,
             'staleness_count': self.staleness_count,
             'epochs': self.epochs,
-            'executor_status': self.executor.status()
-            
-
+            'engine': self.config.engine,
+            'executor_status': self.executor.status() if self.executor != None else None,
+            'pending_tasks': len([t for t in self.tasks if not t.done()]),
         }
 
     def start_workers(self):
@@ -108,8 +115,8 @@ class Vali(c.Module):
                     c.print('Too many stale successes, restarting workers', color='red')
                     self.start_workers()
 
-                df = self.leaderboard()
-                c.print(df.sort_by(['staleness'], ascending=False)[:42])
+                df = self.leaderboard(sort_by=['staleness'], ascending=False, n=42)
+                c.print(df)
                 c.print(run_info)
 
             except Exception as e:
@@ -153,22 +160,28 @@ class Vali(c.Module):
     def worker(self, 
                epochs=1e9,
                id=0):
-        for epoch in range(int(epochs)): 
-            try:
-                t0 = c.time()
-                self.epoch()
-                t1 = c.time()
-                latency = t1 - t0
-            except Exception as e:
-                c.print('Dawg, theres an error in the epoch')
-                c.print(c.detailed_error(e))
+        try:
+            for epoch in range(int(epochs)): 
+                try:
+                    t0 = c.time()
+                    self.epoch()
+                    t1 = c.time()
+                    latency = t1 - t0
+                except Exception as e:
+                    c.print('Dawg, theres an error in the epoch')
+                    c.print(c.detailed_error(e))
+        finally:
+            self.close_loop()
 
     @classmethod
     def run_epoch(cls, network='local', vali=None, **kwargs):
         if vali != None:
             cls = c.module('vali.'+vali)
         self = cls(network=network, **kwargs)
-        return self.epoch()
+        try:
+            return self.epoch()
+        finally:
+            self.close_loop()
 
 
 
@@ -189,8 +202,75 @@ class Vali(c.Module):
             f.cancel()
 
     epoch2results = {}
+    store_lock = threading.Lock()
+
+    def epoch(self, **kwargs):
+        if self.config.engine == 'async':
+            # each worker runs its own loop, on which all of the evals of the epoch are scheduled,
+            # the loop lives across epochs, so the pooled sessions (one per loop) are reused
+            return self.get_loop().run_until_complete(self.async_epoch(**kwargs))
+        return self.thread_epoch(**kwargs)
+
+    def get_loop(self) -> 'asyncio.AbstractEventLoop':
+        """
+        The loop of the worker (thread) that calls it
+        """
+        if not hasattr(self, 'thread2loop'):
+            self.thread2loop = {}
+        thread = threading.get_ident()
+        if thread not in self.thread2loop or self.thread2loop[thread].is_closed():
+            self.thread2loop[thread] = asyncio.new_event_loop()
+        return self.thread2loop[thread]
+
+    def close_loop(self):
+        """
+        Closes the loop of the worker, after the pooled sessions bound to it
+        """
+        loop = getattr(self, 'thread2loop', {}).pop(threading.get_ident(), None)
+        if loop == None or loop.is_closed():
+            return {'success': False, 'msg': 'No loop to close'}
+        c.module('client.pool').close(loop=loop)
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+        return {'success': True, 'msg': 'Closed the loop'}
+
+    async def async_epoch(self, **kwargs):
+        """
+        Evaluates every module in the namespace concurrently on a single event loop, 
+        with at most config.max_concurrency evals in flight and a timeout per module.
+        """
+        self.sync(network=self.config.network)
+        module_addresses = c.shuffle(list(self.namespace.values()))
+        c.print(f'Epoch {self.epochs} with {len(module_addresses)} modules', color='yellow')
+        semaphore = asyncio.Semaphore(self.config.max_concurrency)
+
+        async def eval_module(module_address):
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(self.async_eval(module_address, **kwargs), timeout=self.config.timeout)
+                except asyncio.TimeoutError:
+                    self.errors += 1
+                    self.last_error = c.time()
+                    return {'success': False, 'error': 'timeout', 'address': module_address, 'w': 0}
+
+        self.tasks = [asyncio.ensure_future(eval_module(a)) for a in module_addresses]
+        if len(self.tasks) == 0:
+            return []
+        done, pending = await asyncio.wait(self.tasks, timeout=self.config.epoch_timeout)
+        # cancel the evals that did not finish within the epoch
+        for task in pending:
+            task.cancel()
+        results = [t.result() for t in done if not t.cancelled() and t.exception() == None]
+        self.epochs += 1
+        return results
+
+    def cancel_tasks(self):
+        for t in self.tasks:
+            t.cancel()
+        return {'success': True, 'msg': f'Cancelled {len(self.tasks)} tasks'}
 
-    def epoch(self,  **kwargs):
+    def thread_epoch(self,  **kwargs):
 
         module_addresses = c.shuffle(list(self.namespace.values()))
         c.print(f'Epoch {self.epochs} with {len(module_addresses)} modules', color='yellow')
@@ -327,7 +407,7 @@ class Vali(c.Module):
         module = c.connect(address, key=self.key)
 
         # CONNECT TO THE MODULE
-        info = self.get(path, {})
+        info = self.score_store().row(name) or {}
         if 'ss58_address' not in info:
             info = module.info(timeout=self.config.timeout_info)
         
@@ -349,6 +429,110 @@ class Vali(c.Module):
         setattr(module,'local_info', info) # set the client
         return module
 
+    def get_client(self, address:str):
+        # clients are reused across epochs, their connections are pooled by the client module
+        if not hasattr(self, 'address2client'):
+            self.address2client = {}
+        if address not in self.address2client:
+            self.address2client[address] = c.connect(address, key=self.key, virtual=False)
+        return self.address2client[address]
+
+    async def async_get_module(self, module:str, **kwargs):
+        """
+        The async version of get_module, which returns the client and its info
+        """
+        if module in self.name2address:
+            name = module
+            address = self.name2address[module]
+        else:
+            assert module in self.address2name, f"{module} is not found in {self.config.network}"
+            name = self.address2name[module]
+            address = module
+        path = self.get_module_path(module)
+        client = self.get_client(address)
+        # the store may be loaded from disk, so it is read off the loop
+        info = await asyncio.get_running_loop().run_in_executor(None, lambda: self.score_store().row(name)) or {}
+        if 'ss58_address' not in info:
+            info = await self.async_module_info(client)
+            assert isinstance(info, dict) and 'ss58_address' in info, f'Invalid info {info}'
+
+        info['past_timestamp'] = info.get('timestamp', 0) # for the stalnesss
+        info['timestamp'] = c.timestamp() # the timestamp
+        info['staleness'] = info['timestamp'] - info['past_timestamp']
+        info['w'] = info.get('w', 0) # the weight from the module
+        if info['staleness'] < self.config.max_staleness:
+            self.staleness_count += 1
+            timeleft = self.config.max_staleness - info['staleness']
+            raise Exception({'module': name, 'msg': 'Module is too new', 'staleness': info['staleness'], 'w': info['w'], 'timeleft': timeleft})
+
+        info['past_w'] = info['w'] # for the alpha 
+        info['path'] = path # path of saving the module
+        info['name'] = name # name of the module cleint
+        info['address'] = address # address of the module client
+        info['alpha'] = self.config.alpha # ensure alpha is [0,1]
+        return client, info
+
+    async def async_module_info(self, client: 'Client') -> dict:
+        """
+        Fetches the info of a module, with the etag of its last info, so an unchanged info is not resent
+        """
+        if not hasattr(self, 'address2info'):
+            self.address2info = {}
+        last_info = self.address2info.get(client.address)
+        kwargs = {'etag': last_info['etag']} if last_info != None else {}
+        info = await client.async_forward(fn='info', kwargs=kwargs, timeout=self.config.timeout_info)
+        if isinstance(info, dict):
+            if info.get('unchanged', False) and last_info != None:
+                return dict(last_info)
+            if 'etag' in info:
+                self.address2info[client.address] = info
+                return dict(info)
+        return info
+
+    async def async_score_module(self, module: 'Client', **kwargs):
+        info = await self.async_module_info(module)
+        assert isinstance(info, dict) and 'ss58_address' in info, f'Info must be a dictionary, got {info}'
+        return {'w': 1}
+
+    def score_in_thread(self, module: 'Client', **kwargs):
+        # sync score functions make sync calls, which need their own loop in this thread
+        c.get_event_loop()
+        module = module.virtual()
+        return self.score_module(module, **kwargs)
+
+    async def async_score(self, module: 'Client', **kwargs):
+        """
+        Awaits async score functions, and runs the sync ones (overriden score_module) in a thread
+        """
+        score_fn = self.score_module
+        if asyncio.iscoroutinefunction(score_fn):
+            return await score_fn(module, **kwargs)
+        if type(self).score_module is Vali.score_module:
+            return await self.async_score_module(module, **kwargs)
+        return await asyncio.to_thread(self.score_in_thread, module, **kwargs)
+
+    async def async_eval(self, module:str, **kwargs):
+        """
+        The async version of eval, which evaluates a module on the running loop
+        """
+        info = {}
+        try:
+            client, info = await self.async_get_module(module=module)
+            self.last_sent = c.time()
+            self.requests += 1
+            response = await self.async_score(client, **kwargs)
+            # the score is written to the store (and its log/snapshot on disk) off the loop
+            response = await asyncio.get_running_loop().run_in_executor(None, partial(self.process_response, response=response, info=info))
+        except Exception as e:
+            response = c.detailed_error(e)
+            response['w'] = 0
+            name = info.get('name', module)
+            response_str = '('+' '.join([f"{k}={response[k]}" for k in ['line_text', 'line_no', 'file_name' ]]) + ')'
+            c.print(f'Error (name={name}) --> {response_str}', color='red',  verbose=self.config.verbose)
+            self.errors += 1
+            self.last_error  = c.time()
+        return response
+
     def eval(self, module:str, network:str=None, update=False, **kwargs):
         """
         The following evaluates a module sver
@@ -401,7 +585,7 @@ class Vali(c.Module):
         
         # store modules that have a minimum weight to save storage of stale modules
         if info['w'] > self.config.min_weight:
-            self.put(info['path'], info)
+            self.score_store().update(info['name'], info)
 
         c.print(f'Reward(w={info["w"]}, module={info["name"]} address={info["address"]} latency={c.round(info["latency"], 3)} staleness={info["staleness"]} )' , color='green')
         self.successes += 1
@@ -512,48 +696,40 @@ class Vali(c.Module):
                     **kwargs
                     ):
         max_age = max_age or self.config.max_leaderboard_age
-        paths = self.module_paths(network=network)
-        df = []
-        # chunk the jobs into batches
-        for path in paths:
-            r = self.get(path, {},  max_age=max_age)
-            if isinstance(r, dict) and 'ss58_address' and  r.get('w', 0) > self.config.min_weight  :
-                r['staleness'] = c.time() - r.get('timestamp', 0)
-                if not self.filter_module(r['name']):
-                    continue
-                df += [{k: r.get(k, None) for k in keys}]
-            else :
-                # removing the path as it is not a valid module and is too old
-                self.rm(path)
-        df = c.df(df) 
-        if len(df) == 0:
-            return c.df(df)
-            
-        df = df.sort_values(by=sort_by, ascending=ascending)
-
-        if n != None:
-            if page != None:
-                df = df[page*n:(page+1)*n]
-            else:
-                df = df[:n]
-
-        # if to_dict is true, we return the dataframe as a list of dictionaries
-        if to_dict:
-            return df.to_dict(orient='records')
-
-        return df
-
+        return self.score_store(network=network).leaderboard(keys=keys,
+                                                           max_age=max_age,
+                                                           min_weight=self.config.min_weight,
+                                                           search=self.config.search,
+                                                           sort_by=sort_by,
+                                                           ascending=ascending,
+                                                           n=n,
+                                                           page=page,
+                                                           to_dict=to_dict)
 
-    
     df = l = leaderboard
     
     def module_paths(self, network=None):
         paths = self.ls(self.storage_path(network=network))
         return paths
+
+    def score_store(self, network=None):
+        """
+        The in memory score store of the network, snapshotted under {storage_path}/scores
+        """
+        storage_path = self.storage_path(network=network)
+        # the evals read it from executor threads, so it is created once under the lock
+        with self.store_lock:
+            if not hasattr(self, 'path2store'):
+                self.path2store = {}
+            if storage_path not in self.path2store:
+                self.path2store[storage_path] = c.module('vali.store')(path=storage_path + '/scores',
+                                                                       snapshot_interval=self.config.snapshot_interval,
+                                                                       legacy_path=storage_path)
+        self.store = self.path2store[storage_path]
+        return self.store
     
     def save_module_info(self, k:str, v:dict,):
-        path = self.storage_path() + f'/{k}'
-        self.put(path, v)
+        self.score_store().update(k, v)
     
 
     def __del__(self):
@@ -1,8 +1,10 @@
 from pprint import pp
 import asyncio
+import inspect
 from copy import deepcopy
 from typing import Union, Optional, List
 import os, sys
+import threading
 from typing import *
 from loguru import logger
 import torch
@@ -12,6 +14,9 @@ import commune as c
 # we are inheriting from the base model class which is a c.Module and a torch.nn.Module
 Model = c.module('model')
 class ModelTransformer(Model):
+    # concurrent calls of these are merged into batches by the server (see server.batcher)
+    batch_fns = {'generate': {'max_batch_size': 16, 'max_wait': 0.02}}
+
     def __init__(self,
                  model: str = 'llama2.7b',  # Assuming 'llama2.7b' is a string identifier for the model
                  tag: str = 'base',  # Default value 'base' for the tag
@@ -184,6 +189,8 @@ class ModelTransformer(Model):
         if not hasattr(tokenizer, 'pad_token') or tokenizer.pad_token is None:
             assert hasattr(tokenizer, 'eos_token') and tokenizer.eos_token is not None
             tokenizer.add_special_tokens({'pad_token': tokenizer.eos_token})
+        # held while the padding side of a tokenize call is set
+        self.tokenizer_lock = threading.Lock()
 
         # set padding token
 
@@ -278,15 +285,22 @@ class ModelTransformer(Model):
                 return_tensors='pt',
                 add_special_tokens=False,
                 device:str = None, 
+                padding_side:str = None,
                 **kwargs) -> torch.Tensor:
-        """ Returns tokenized text as torch tensor. """
+        """ Returns tokenized text as torch tensor, padded on the padding_side (default: the tokenizer's). """
         
-        sample = self.tokenizer(text, padding=padding, 
-                                    truncation=truncation, 
-                                    max_length=max_length, 
-                                    return_tensors=return_tensors,
-                                    add_special_tokens=add_special_tokens, 
-                                    **kwargs)  # assume tokenizer.padding_side = 'left'
+        with self.tokenizer_lock:
+            default_padding_side = self.tokenizer.padding_side
+            self.tokenizer.padding_side = padding_side or default_padding_side
+            try:
+                sample = self.tokenizer(text, padding=padding, 
+                                            truncation=truncation, 
+                                            max_length=max_length, 
+                                            return_tensors=return_tensors,
+                                            add_special_tokens=add_special_tokens, 
+                                            **kwargs)
+            finally:
+                self.tokenizer.padding_side = default_padding_side
 
         device = device if device != None else self.device
         
@@ -302,7 +316,7 @@ class ModelTransformer(Model):
     def detokenize(self, input_ids: torch.Tensor, **kwargs) -> torch.Tensor:
         """ Returns tokenized text as torch tensor. """
         
-        text = self.tokenizer.batch_decode(input_ids,**kwargs)  # assume tokenizer.padding_side = 'left'
+        text = self.tokenizer.batch_decode(input_ids,**kwargs)
 
         return text
     
@@ -473,31 +487,122 @@ class ModelTransformer(Model):
     
 
 
-    def generate_stream(self, text: str, 
-                max_length: int = 20, 
+    def sample_token(self, logits: torch.Tensor, 
+                     temperature: float = 0.0, 
+                     top_k: int = None, 
+                     top_p: float = None) -> torch.Tensor:
+        """
+        Samples the next token of each sequence from the logits of its last position [batch, vocab]
+        """
+        if temperature == None or temperature <= 0:
+            return torch.argmax(logits, dim=-1)
+        logits = logits / temperature
+        if top_k != None and top_k > 0:
+            kth = torch.topk(logits, min(top_k, logits.shape[-1]), dim=-1).values[..., -1, None]
+            logits = logits.masked_fill(logits < kth, float('-inf'))
+        if top_p != None and top_p < 1.0:
+            sorted_logits, sorted_idx = torch.sort(logits, descending=True, dim=-1)
+            cum_probs = torch.softmax(sorted_logits, dim=-1).cumsum(dim=-1)
+            # keep the smallest set of tokens whose probability mass exceeds top_p
+            remove = cum_probs - torch.softmax(sorted_logits, dim=-1) > top_p
+            logits = logits.masked_fill(remove.scatter(-1, sorted_idx, remove), float('-inf'))
+        probs = torch.softmax(logits.float(), dim=-1)
+        return torch.multinomial(probs, num_samples=1).squeeze(-1)
+
+    def generate_stream(self, text: Union[str, List[str]], 
                 max_new_tokens: int = None,
-                min_length: int = 0, 
-                min_new_tokens: int = None,
-                early_stopping: bool = True,
+                max_length: int = None, 
+                temperature: float = 0.0,
+                top_k: int = None,
+                top_p: float = None,
                 max_time: float = None,
-                chunk_size: int = 10,
-                **kwargs) -> List[str]:
-        if isinstance(text, str):
+                stop: List[str] = None,
+                **kwargs):
+        """
+        Streams the generated text token by token, keeping the key/value cache of the
+        prompt and of the generated tokens, so each step only runs the newest token.
+
+        Yields the new text of each step (a list of deltas if text is a batch). 
+        Closing the generator (the client disconnected) stops the generation, 
+        as a token is only computed when the next one is requested.
+        """
+        is_string = isinstance(text, str)
+        if is_string:
             text = [text]
-
-         
-        input_ids = self.tokenize(text)['input_ids']
-        for i in range(max_new_tokens):
-            output_ids = self.model.generate(input_ids, 
-                                            max_length=max_length, 
-                                            max_new_tokens=chunk_size,
-                                            min_length=min_length, 
-                                            min_new_tokens=min_new_tokens,
-                                            early_stopping=early_stopping,
-                                            max_time=max_time, **kwargs)
-            output_text = self.decode(output_ids)
-            yield output_text
-            text = output_text
+        max_new_tokens = min(max_new_tokens or self.config.max_new_tokens, self.config.max_new_tokens)
+        max_length = min(max_length or self.config.max_length, self.config.max_length)
+        stop = [stop] if isinstance(stop, str) else (stop or [])
+
+        # causal models generate after the last token, so the prompts are padded on the left
+        sample = self.tokenize(text, max_length=max_length, padding_side='left')
+        input_ids, attention_mask = sample['input_ids'], sample['attention_mask']
+        batch_size = input_ids.shape[0]
+        # the prompts are padded on the left, so the positions start after the padding
+        position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+        use_position_ids = 'position_ids' in inspect.signature(self.model.forward).parameters
+        eos_token_id = self.tokenizer.eos_token_id
+        pad_token_id = self.tokenizer.pad_token_id
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=input_ids.device)
+        generated = [[] for _ in range(batch_size)]
+        offsets = [(0, 0)] * batch_size # (prefix_offset, read_offset) of the decoded tokens
+        texts = [''] * batch_size
+        max_stop_length = max([len(s) for s in stop], default=0)
+        past_key_values = None
+        t0 = c.time()
+        try:
+            with torch.no_grad():
+                for step in range(max_new_tokens):
+                    model_inputs = dict(input_ids=input_ids, 
+                                        attention_mask=attention_mask, 
+                                        past_key_values=past_key_values, 
+                                        use_cache=True)
+                    if use_position_ids:
+                        model_inputs['position_ids'] = position_ids
+                    output = self.model(**model_inputs)
+                    past_key_values = output.past_key_values
+                    next_tokens = self.sample_token(output.logits[:, -1, :], temperature=temperature, top_k=top_k, top_p=top_p)
+                    was_finished = finished.clone()
+                    next_tokens = next_tokens.masked_fill(was_finished, pad_token_id)
+                    if eos_token_id != None:
+                        finished |= next_tokens == eos_token_id
+
+                    # decode only the new tokens (with the last decoded ones as context), so multi token characters are not split
+                    deltas = []
+                    for i, token in enumerate(next_tokens.tolist()):
+                        if was_finished[i]:
+                            deltas.append('')
+                            continue
+                        generated[i].append(token)
+                        delta, prefix_offset, read_offset = self.decode_token(generated[i], *offsets[i])
+                        offsets[i] = (prefix_offset, read_offset)
+                        deltas.append(delta)
+                        texts[i] += delta
+                        # only the end of the text can hold a new stop sequence
+                        if delta and any(s in texts[i][-(len(delta) + max_stop_length):] for s in stop):
+                            finished[i] = True
+                    yield deltas[0] if is_string else deltas
+
+                    if bool(finished.all()) or (max_time != None and c.time() - t0 > max_time):
+                        break
+                    # the next step only feeds the new tokens, the prompt is in the cache
+                    input_ids = next_tokens[:, None]
+                    attention_mask = torch.cat([attention_mask, attention_mask.new_ones((batch_size, 1))], dim=-1)
+                    position_ids = position_ids[:, -1:] + 1
+        finally:
+            # free the cache as soon as the stream ends or is cancelled
+            del past_key_values
+
+    def decode_token(self, token_ids: List[int], prefix_offset: int = 0, read_offset: int = 0) -> Tuple[str, int, int]:
+        """
+        Decodes the tokens after read_offset, with the tokens from prefix_offset as context (so
+        the spaces are the ones of the full text), and returns (new text, prefix_offset, read_offset).
+        The new text is held back while it ends in an unfinished utf-8 character
+        """
+        prefix_text = self.tokenizer.decode(token_ids[prefix_offset:read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(token_ids[prefix_offset:], skip_special_tokens=True)
+        if len(new_text) > len(prefix_text) and not new_text.endswith('\ufffd'):
+            return new_text[len(prefix_text):], read_offset, len(token_ids)
+        return '', prefix_offset, read_offset
 
     hf = c.module('hf')()
     def generate(self, text: str, 
@@ -510,7 +615,7 @@ class ModelTransformer(Model):
         if stream:
             return self.generate_stream(text, 
                                         max_new_tokens=max_new_tokens, 
-                                        early_stopping=early_stopping, **kwargs)
+                                        max_length=max_length, **kwargs)
 
         is_string = isinstance(text, str)
         if is_string:
@@ -524,8 +629,8 @@ class ModelTransformer(Model):
         if max_new_tokens > self.config.max_new_tokens:
             max_new_tokens = self.config.max_new_tokens
 
-        # get tokens
-        input_ids = self.tokenize(text, max_length=max_length)
+        # get tokens (padded on the left, as the model generates after the last token)
+        input_ids = self.tokenize(text, max_length=max_length, padding_side='left')
 
         # generate
         output_ids = self.model.generate(**input_ids, 
@@ -537,8 +642,7 @@ class ModelTransformer(Model):
         output_text = self.detokenize(output_ids, skip_special_tokens=True)
 
         # remove input text
-        for t, ot in zip(text, output_text):
-            output_text = ot.replace(t, '')
+        output_text = [ot.replace(t, '') for t, ot in zip(text, output_text)]
 
         if is_string and isinstance(output_text, list):
             output_text = output_text[0]
@@ -550,6 +654,20 @@ class ModelTransformer(Model):
         output_text = self.generate(text=text, max_new_tokens=100, early_stopping=False)
         return output_text
 
+    @classmethod
+    def test_batching(cls, model='sshleifer/tiny-gpt2', n=8):
+        """
+        Runs concurrent generate calls through the batcher on cpu with a tiny model
+        """
+        self = cls(model=model, device_map='cpu', test=False)
+        batcher = c.module('server.batcher')(fn=self.generate, **self.batch_fns['generate'])
+        texts = [f'hey {i}' for i in range(n)]
+        futures = [batcher.submit(t, max_new_tokens=4) for t in texts]
+        batched = [f.result(timeout=60) for f in futures]
+        assert batched == self.generate(texts, max_new_tokens=4), 'batched outputs should match the unbatched batch'
+        assert batcher.info()['batches'] < n, batcher.info()
+        return {'success': True, 'msg': 'batching test passed', 'info': batcher.info()}
+
     @classmethod
     def test_encode(cls, model='gpt2.7b', text='Whadup?', **kwargs):
         '''
@@ -1,84 +1,458 @@
 import commune as c
 from typing import *
 import os
+import json
+import bisect
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 class Storage(c.Module):
-    whitelist: List = ['put_item', 'get_item', 'hash', 'items']
-    replica_prefix = 'replica'
-    shard_prefix = 'shard::'
+    """
+    A content addressed store. An item is split into chunks that are stored under their sha256
+    (so equal chunks are stored once), and a signed manifest maps the key to its chunks.
+    The manifests and the chunk reference counts are kept in a local sqlite index, so listing
+    and lookups never walk the directories.
 
-    def __init__(self, store_dir = 'base', **kwargs):
+    put/get spread the items over the storage servers of the namespace with a consistent hash ring,
+    each item is written to `replicas` servers, and a get repairs the replicas that are missing
+    the item or have an older version of it.
+    """
+    whitelist: List = ['put_item', 'get_item', 'hash', 'hash_item', 'items', 'exists', 'stats',
+                       'put_chunk', 'get_chunk', 'missing_chunks', 'put_manifest', 'get_manifest', 'get_stream']
+    chunk_dir = 'chunks'
+    index_file = 'index.db'
+    chunk_grace = 3600 # seconds an unreferenced chunk is kept (for the manifest of its put)
+    gc_interval = 600 # seconds between the collections of unreferenced chunks
+    max_clock_skew = 60 # seconds a manifest timestamp can be ahead of our clock
+
+    def __init__(self,
+                 store_dir = 'base', # the folder of the chunks and the index
+                 chunk_size:int = 1024**2, # the max bytes per chunk
+                 replicas:int = 2, # the number of servers that hold each item
+                 network:str = 'local', # the network of the storage servers
+                 search:str = 'storage', # the name of the storage servers in the namespace
+                 peers:List[str] = None, # the storage servers (defaults to the namespace search)
+                 vnodes:int = 64, # the points per server on the hash ring
+                 max_workers:int = 8,
+                 **kwargs):
         self.store_dir = store_dir
+        self.chunk_size = chunk_size
+        self.replicas = replicas
+        self.network = network
+        self.search = search
+        self.vnodes = vnodes
+        self.set_peers(peers)
         self.serializer = c.module('serializer')()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.store_path = self.resolve_path(store_dir)
+        os.makedirs(self.store_path + '/' + self.chunk_dir, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.store_path + '/' + self.index_file, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, manifest TEXT, hash TEXT, size INTEGER, timestamp REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, size INTEGER, refs INTEGER, timestamp REAL)')
+        if 'timestamp' not in [r[1] for r in self.db.execute('PRAGMA table_info(chunks)').fetchall()]:
+            self.db.execute('ALTER TABLE chunks ADD COLUMN timestamp REAL')
+        self.db.commit()
+        self.last_gc = c.time()
+        self.import_legacy_items()
+
+    ## LOCAL STORE
 
     def resolve_item_path(self, path: str) -> str:
         store_dir = self.store_dir
-        path = path if  path.startswith(store_dir) else f'{store_dir}/{path}' 
+        path = path if  path.startswith(store_dir) else f'{store_dir}/{path}'
         path = self.resolve_path(path)
         return path
-    
-    def files(self) -> List:
-        return sorted(c.ls(self.store_dir))
-    
-    def file2size(self, fmt:str='b') -> int:
-        files = self.files()
-        file2size = {}
-        for file in files:
-            file2size[file] = c.format_data_size(c.filesize(file), fmt=fmt)
-        return file2size
 
+    def chunk_path(self, h:str) -> str:
+        # two levels of folders, so no folder holds millions of files
+        return f'{self.store_path}/{self.chunk_dir}/{h[:2]}/{h[2:4]}/{h}'
+
+    def encode(self, v) -> Tuple[bytes, bool]:
+        if isinstance(v, (bytes, bytearray)):
+            return bytes(v), True
+        return json.dumps(self.serializer.serialize(v, mode=None)).encode(), False
+
+    def decode(self, data:bytes, raw:bool = False):
+        if raw:
+            return data
+        return self.serializer.deserialize(json.loads(data.decode()))
 
-    def put_item(self, k,  v: Dict, encrypt:bool=False):
-        timestamp = c.timestamp()
-        path = self.resolve_item_path(k)    
-        # encrypt it if you want
+    def split(self, data:bytes) -> List[bytes]:
+        return [data[i:i+self.chunk_size] for i in range(0, max(len(data), 1), self.chunk_size)]
+
+    def put_chunk(self, h:str, data:bytes) -> dict:
+        """
+        Stores a chunk under its hash (a no-op if the chunk is already stored)
+        """
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+        assert hashlib.sha256(data).hexdigest() == h, f'chunk does not match its hash {h}'
+        path = self.chunk_path(h)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO chunks VALUES (?, ?, 0, ?)', (h, len(data), c.time()))
+            # an unreferenced chunk that is put again waits for the manifest of this put
+            self.db.execute('UPDATE chunks SET timestamp = ? WHERE hash = ? AND refs <= 0', (c.time(), h))
+            self.db.commit()
+        self.maybe_gc()
+        return {'success': True, 'hash': h, 'size': len(data)}
+
+    def gc_chunks(self, grace:float = None) -> dict:
+        """
+        Removes the chunks that no manifest references after the grace period (of failed or abandoned puts)
+        """
+        grace = self.chunk_grace if grace == None else grace
+        with self.lock:
+            self.last_gc = c.time()
+            hashes = [r[0] for r in self.db.execute('SELECT hash FROM chunks WHERE refs <= 0 AND COALESCE(timestamp, 0) <= ?', 
+                                                     (c.time() - grace,)).fetchall()]
+            for h in hashes:
+                self.db.execute('DELETE FROM chunks WHERE hash = ?', (h,))
+                if os.path.exists(self.chunk_path(h)):
+                    os.remove(self.chunk_path(h))
+            self.db.commit()
+        return {'success': True, 'removed': len(hashes)}
+
+    def maybe_gc(self):
+        if c.time() - self.last_gc > self.gc_interval:
+            self.last_gc = c.time()
+            self.executor.submit(self.gc_chunks)
+
+    def get_chunk(self, h:str) -> bytes:
+        with open(self.chunk_path(h), 'rb') as f:
+            data = f.read()
+        assert hashlib.sha256(data).hexdigest() == h, f'chunk {h} is corrupted'
+        return data
+
+    def missing_chunks(self, hashes:List[str]) -> List[str]:
+        """
+        The chunks that are not stored yet (so only those are sent)
+        """
+        with self.lock:
+            stored = set()
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i+500]
+                rows = self.db.execute(f'SELECT hash FROM chunks WHERE hash IN ({",".join("?"*len(batch))})', batch).fetchall()
+                stored.update(r[0] for r in rows)
+        return [h for h in hashes if h not in stored or not os.path.exists(self.chunk_path(h))]
+
+    def sign_manifest(self, k:str, h:str, size:int, chunks:List[str], raw:bool = False) -> dict:
+        manifest = {'key': k, 'hash': h, 'size': size, 'chunks': chunks, 'raw': raw,
+                    'timestamp': c.time(), 'address': self.key.ss58_address}
+        manifest['signature'] = self.key.sign(self.manifest_message(manifest)).hex()
+        return manifest
+
+    def manifest_message(self, manifest:dict) -> str:
+        return f"{manifest['key']}:{manifest['hash']}:{manifest['timestamp']}"
+
+    def verify_manifest(self, manifest:dict) -> bool:
+        return bool(c.verify(self.manifest_message(manifest), signature=manifest['signature'], address=manifest['address']))
+
+    def put_manifest(self, k:str, manifest:dict) -> dict:
+        """
+        Points the key to the chunks of the manifest, once they are all stored
+        """
+        assert manifest['key'] == k, f'the manifest is for {manifest["key"]}, not {k}'
+        assert self.valid_timestamp(manifest), f'the manifest timestamp is more than {self.max_clock_skew}s in the future'
+        assert self.verify_manifest(manifest), 'invalid manifest signature'
+        with self.lock:
+            # checked under the lock, so the chunks are not collected before they are referenced
+            missing = self.missing_chunks(manifest['chunks'])
+            if len(missing) > 0:
+                return {'success': False, 'error': 'missing chunks', 'missing': missing}
+            row = self.db.execute('SELECT manifest, timestamp FROM items WHERE key = ?', (k,)).fetchone()
+            # a stored version from the future (before the skew check) does not block the writes
+            if row != None and row[1] > manifest['timestamp'] and self.valid_timestamp({'timestamp': row[1]}):
+                return {'success': False, 'error': 'a newer version is stored', 'timestamp': row[1]}
+            self.db.executemany('UPDATE chunks SET refs = refs + 1 WHERE hash = ?', [(h,) for h in manifest['chunks']])
+            self.db.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)',
+                            (k, json.dumps(manifest), manifest['hash'], manifest['size'], manifest['timestamp']))
+            if row != None:
+                self.release_chunks(json.loads(row[0])['chunks'])
+            self.db.commit()
+        return {'success': True, 'key': k, 'hash': manifest['hash'], 'size': manifest['size']}
+
+    def valid_timestamp(self, manifest:dict) -> bool:
+        return manifest['timestamp'] <= c.time() + self.max_clock_skew
+
+    def release_chunks(self, hashes:List[str]):
+        """
+        Drops a reference to the chunks, and removes the ones that are no longer used
+        """
+        self.db.executemany('UPDATE chunks SET refs = refs - 1 WHERE hash = ?', [(h,) for h in hashes])
+        for h in set(hashes):
+            row = self.db.execute('SELECT refs FROM chunks WHERE hash = ?', (h,)).fetchone()
+            if row != None and row[0] <= 0:
+                self.db.execute('DELETE FROM chunks WHERE hash = ?', (h,))
+                if os.path.exists(self.chunk_path(h)):
+                    os.remove(self.chunk_path(h))
+
+    def get_manifest(self, k:str) -> Optional[dict]:
+        with self.lock:
+            row = self.db.execute('SELECT manifest FROM items WHERE key = ?', (k,)).fetchone()
+        return json.loads(row[0]) if row != None else None
+
+    def put_stream(self, k:str, stream:Iterable[bytes]) -> dict:
+        """
+        Stores a stream of bytes as raw item, holding at most a chunk in memory
+        """
+        chunks, buffer, size = [], b'', 0
+        item_hash = hashlib.sha256()
+        def flush(data):
+            h = hashlib.sha256(data).hexdigest()
+            self.put_chunk(h, data)
+            chunks.append(h)
+        for data in stream:
+            item_hash.update(data)
+            size += len(data)
+            buffer += data
+            while len(buffer) >= self.chunk_size:
+                flush(buffer[:self.chunk_size])
+                buffer = buffer[self.chunk_size:]
+        if len(buffer) > 0 or len(chunks) == 0:
+            flush(buffer)
+        manifest = self.sign_manifest(k, item_hash.hexdigest(), size, chunks, raw=True)
+        return self.put_manifest(k, manifest)
+
+    def get_stream(self, k:str) -> Iterator[bytes]:
+        """
+        Yields the chunks of the item
+        """
+        manifest = self.get_manifest(k)
+        assert manifest != None, f'item {k} does not exist'
+        for h in manifest['chunks']:
+            yield self.get_chunk(h)
+
+    def put_item(self, k, v, encrypt:bool=False):
         if encrypt:
-            data = self.key.encrypt(data)   
-        # sign it for verif
-        v = self.key.sign(v, return_json=True)
-        self.put_json(path, v)
-        return {'success': True, 'path': path, 'timestamp': timestamp}
-    
-
-    def get_item(self,k:str) -> Any:
-        k = self.resolve_item_path(k)
-        v = self.get_json(k, {})
-        if 'ticket' in v:
-            c.ticket2address(v['ticket'])
-        v = v['data']
-        v = self.serializer.deserialize(v) 
-        return v
-    
-    
+            v = self.key.encrypt(v)
+        data, raw = self.encode(v)
+        pieces = self.split(data)
+        hashes = [hashlib.sha256(chunk).hexdigest() for chunk in pieces]
+        chunks = dict(zip(hashes, pieces))
+        for h in self.missing_chunks(list(chunks)):
+            self.put_chunk(h, chunks[h])
+        manifest = self.sign_manifest(k, hashlib.sha256(data).hexdigest(), len(data), hashes, raw=raw)
+        response = self.put_manifest(k, manifest)
+        response['timestamp'] = manifest['timestamp']
+        return response
+
+    def get_item(self, k:str, default=None) -> Any:
+        manifest = self.get_manifest(k)
+        if manifest == None:
+            return default
+        return self.decode(b''.join(self.get_chunk(h) for h in manifest['chunks']), raw=manifest.get('raw', False))
+
     def hash_item(self, k: str = None, seed : int= None , seed_sep:str = '<SEED>', data=None, tag=None) -> str:
         """
-        Hash a string
+        The hash of an item. With a seed, the hash is computed over the stored chunks,
+        so it proves that the item is held (without a seed, the indexed hash is returned)
         """
-        data = self.get_item(k)
-        if seed != None:
-            data = f'{data}{seed_sep}{seed}'
-        return c.hash(data)
+        if seed == None:
+            manifest = self.get_manifest(k)
+            assert manifest != None, f'item {k} does not exist'
+            return manifest['hash']
+        h = hashlib.sha256()
+        for chunk in self.get_stream(k):
+            h.update(chunk)
+        h.update(f'{seed_sep}{seed}'.encode())
+        return h.hexdigest()
 
     def exists(self, k) -> bool:
-        path = self.resolve_item_path(k)
-        return c.exists(path)
-    
-    def test(self):
-        results = []
-        results.append(self.test_storage())
-        results.append(self.test_hash())
-        return results
-    
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM items WHERE key = ?', (k,)).fetchone() != None
+
+    def items(self, search=None, include_replicas:bool=True, tag=None, n:int = None, page:int = 0) -> List:
+        """
+        List the item names
+        """
+        query, params = 'SELECT key FROM items', []
+        if search != None:
+            query += " WHERE key LIKE ? ESCAPE '\\'"
+            params.append('%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        query += ' ORDER BY key'
+        if n != None:
+            query += ' LIMIT ? OFFSET ?'
+            params += [n, page * n]
+        with self.lock:
+            return [r[0] for r in self.db.execute(query, params).fetchall()]
+
+    def files(self) -> List:
+        return self.items()
+
+    def file2size(self, fmt:str='b') -> int:
+        with self.lock:
+            rows = self.db.execute('SELECT key, size FROM items').fetchall()
+        return {k: c.format_data_size(size, fmt=fmt) for k, size in rows}
+
+    def stats(self) -> dict:
+        with self.lock:
+            n_items, item_bytes = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM items').fetchone()
+            n_chunks, chunk_bytes = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chunks').fetchone()
+        return {'items': n_items, 'item_bytes': item_bytes, 'chunks': n_chunks, 'chunk_bytes': chunk_bytes}
+
     def rm_item(self, k):
-        k = self.resolve_item_path(k)
-        return c.rm(k)
+        with self.lock:
+            row = self.db.execute('SELECT manifest FROM items WHERE key = ?', (k,)).fetchone()
+            if row == None:
+                return {'success': False, 'error': f'item {k} does not exist'}
+            self.db.execute('DELETE FROM items WHERE key = ?', (k,))
+            self.release_chunks(json.loads(row[0])['chunks'])
+            self.db.commit()
+        return {'success': True, 'key': k}
 
     def rm_many(self, search):
         items = self.items(search=search)
         for item in items:
             self.rm_item(item)
         return {'success': True, 'items': items}
-    
+
+    def import_legacy_items(self) -> int:
+        """
+        Moves the items of the old layout (a signed json file per item) into the store, once
+        """
+        n = 0
+        for path in c.ls(self.store_path):
+            if not path.endswith('.json') or os.path.isdir(path):
+                continue
+            v = self.get_json(path, {})
+            if isinstance(v, dict) and 'data' in v:
+                self.put_item(os.path.basename(path)[:-len('.json')], self.serializer.deserialize(v['data']))
+                os.remove(path)
+                n += 1
+        return n
+
+    ## DISTRIBUTED STORE
+
+    def set_peers(self, peers:List[str] = None):
+        self.peers = peers
+        self.ring_cache = (None, [], [])
+        return {'success': True, 'peers': peers}
+
+    def get_peers(self) -> List[str]:
+        if self.peers != None:
+            return self.peers
+        return sorted(c.get_namespace(search=self.search, network=self.network).keys())
+
+    def ring(self) -> Tuple[List[int], List[str]]:
+        """
+        The hash ring of the peers, rebuilt only when the peers change
+        """
+        peers = tuple(self.get_peers())
+        if self.ring_cache[0] != peers:
+            points = sorted((self.ring_hash(f'{peer}:{i}'), peer) for peer in peers for i in range(self.vnodes))
+            self.ring_cache = (peers, [p[0] for p in points], [p[1] for p in points])
+        return self.ring_cache[1], self.ring_cache[2]
+
+    def ring_hash(self, k:str) -> int:
+        return int(hashlib.sha256(k.encode()).hexdigest()[:16], 16)
+
+    def nodes(self, k:str, replicas:int = None) -> List[str]:
+        """
+        The servers of the key, the first distinct servers clockwise from its hash
+        """
+        replicas = replicas or self.replicas
+        positions, peers = self.ring()
+        nodes = []
+        start = bisect.bisect(positions, self.ring_hash(k))
+        for i in range(len(peers)):
+            peer = peers[(start + i) % len(peers)]
+            if peer not in nodes:
+                nodes.append(peer)
+                if len(nodes) == replicas:
+                    break
+        return nodes
+
+    def client(self, node:str):
+        return c.connect(node, network=self.network)
+
+    def push(self, node:str, k:str, manifest:dict, chunks:Dict[str, bytes] = None) -> dict:
+        """
+        Sends the missing chunks and then the manifest of the item to a node
+        """
+        client = self.client(node)
+        for h in client.missing_chunks(manifest['chunks']):
+            chunk = chunks[h] if chunks != None else self.get_chunk(h)
+            response = client.put_chunk(h, chunk.hex())
+            assert isinstance(response, dict) and response.get('success', False), response
+        return client.put_manifest(k, manifest)
+
+    def put(self, k:str, v, replicas:int = None) -> dict:
+        """
+        Writes the item to its replicas on the ring
+        """
+        nodes = self.nodes(k, replicas)
+        if len(nodes) == 0:
+            return self.put_item(k, v)
+        data, raw = self.encode(v)
+        pieces = self.split(data)
+        hashes = [hashlib.sha256(chunk).hexdigest() for chunk in pieces]
+        chunks = dict(zip(hashes, pieces))
+        manifest = self.sign_manifest(k, hashlib.sha256(data).hexdigest(), len(data), hashes, raw=raw)
+        futures = {node: self.executor.submit(self.push, node, k, manifest, chunks) for node in nodes}
+        results = {}
+        for node, future in futures.items():
+            try:
+                results[node] = future.result()
+            except Exception as e:
+                results[node] = c.detailed_error(e)
+        n_success = sum([isinstance(r, dict) and r.get('success', False) for r in results.values()])
+        return {'success': n_success > 0, 'key': k, 'hash': manifest['hash'], 'replicas': n_success, 'nodes': results}
+
+    def get(self, k:str, default=None, replicas:int = None, repair:bool = True):
+        """
+        Reads the newest valid version of the item from its replicas, and repairs the stale ones
+        """
+        nodes = self.nodes(k, replicas)
+        if len(nodes) == 0:
+            return self.get_item(k, default)
+        futures = {node: self.executor.submit(lambda node: self.client(node).get_manifest(k), node) for node in nodes}
+        manifests = {}
+        for node, future in futures.items():
+            try:
+                manifest = future.result()
+                if isinstance(manifest, dict) and 'chunks' in manifest and self.valid_timestamp(manifest) and self.verify_manifest(manifest):
+                    manifests[node] = manifest
+            except Exception as e:
+                c.print(f'Error getting {k} from {node}: {e}', color='red')
+        if len(manifests) == 0:
+            return default
+        node = max(manifests, key=lambda node: manifests[node]['timestamp'])
+        manifest = manifests[node]
+        client = self.client(node)
+        chunks = {}
+        for h in manifest['chunks']:
+            chunk = client.get_chunk(h)
+            chunk = bytes.fromhex(chunk) if isinstance(chunk, str) else chunk
+            assert hashlib.sha256(chunk).hexdigest() == h, f'chunk {h} from {node} is corrupted'
+            chunks[h] = chunk
+        data = b''.join(chunks[h] for h in manifest['chunks'])
+        assert hashlib.sha256(data).hexdigest() == manifest['hash'], f'item {k} from {node} is corrupted'
+        if repair:
+            stale = [n for n in nodes if n not in manifests or manifests[n]['hash'] != manifest['hash']]
+            for n in stale:
+                self.executor.submit(self.push, n, k, manifest, chunks)
+        return self.decode(data, raw=manifest.get('raw', False))
+
+    ## TESTS
+
+    def test(self):
+        results = []
+        results.append(self.test_storage())
+        results.append(self.test_hash())
+        results.append(self.test_chunks())
+        results.append(self.test_ring())
+        return results
 
     def test_storage(self):
         key = 'test'
@@ -86,8 +460,9 @@ class Storage(c.Module):
         self.put_item(key, value)
         new_value = self.get_item(key)
         assert value == new_value, f'Error: {value} != {new_value}'
+        assert self.exists(key) and key in self.items(search='tes')
         return {'success': True, 'msg': 'Storage test passed'}
-    
+
     def test_hash(self):
         k = 'test'
         value = 'value'
@@ -100,21 +475,50 @@ class Storage(c.Module):
         assert hash1 != hash3, f'Error: {hash1} == {hash3}'
 
         return {'success': True, 'msg': 'Storage hash test passed'}
-    
-    def items(self, search=None, include_replicas:bool=True, tag=None) -> List:
-        """
-        List the item names
-        """
-        store_dir = self.store_dir
-
-        items = [x.split('/')[-1] for x in c.ls(store_dir)]
-        
-        if search != None:
-            items = [x for x in items if search in x]
 
-        return items
-    
+    def test_chunks(self):
+        store = Storage(store_dir='test_chunks', chunk_size=16)
+        data = os.urandom(100)
+        store.put_stream('a', [data[:30], data[30:]])
+        assert b''.join(store.get_stream('a')) == data and store.get_item('a') == data
+        # the same content is stored once
+        store.put_item('b', data)
+        assert store.stats()['chunks'] == 7, store.stats()
+        store.rm_item('a')
+        assert store.stats()['chunks'] == 7 and store.get_item('b') == data
+        store.rm_item('b')
+        assert store.stats()['chunks'] == 0 and not store.exists('b')
+        # the unreferenced chunks are collected after the grace period
+        chunk = os.urandom(10)
+        store.put_chunk(hashlib.sha256(chunk).hexdigest(), chunk)
+        assert store.gc_chunks()['removed'] == 0 and store.gc_chunks(grace=0)['removed'] == 1
+        assert store.stats()['chunks'] == 0
+        # a manifest from the future is rejected
+        store.put_item('c', data)
+        manifest = store.get_manifest('c')
+        manifest['timestamp'] = c.time() + 10 * store.max_clock_skew
+        manifest['signature'] = store.key.sign(store.manifest_message(manifest)).hex()
+        try:
+            store.put_manifest('c', manifest)
+            assert False, 'a manifest from the future should be rejected'
+        except AssertionError as e:
+            assert 'future' in str(e), e
+        store.rm_item('c')
+        self.rm('test_chunks')
+        return {'success': True, 'msg': 'Storage chunks test passed'}
 
+    def test_ring(self, n_peers=5, n_keys=1000):
+        peers = [f'storage::{i}' for i in range(n_peers)]
+        self.set_peers(peers)
+        before = {k: self.nodes(k) for k in map(str, range(n_keys))}
+        assert all(len(set(v)) == self.replicas for v in before.values())
+        # removing a peer only moves the keys it held
+        self.set_peers(peers[:-1])
+        after = {k: self.nodes(k) for k in before}
+        moved = [k for k in before if before[k] != after[k]]
+        assert all(peers[-1] in before[k] for k in moved), 'keys moved between remaining peers'
+        self.set_peers(None)
+        return {'success': True, 'msg': 'Storage ring test passed', 'moved': len(moved) / n_keys}
 
 
-Storage.run(__name__)
\ No newline at end of file
+Storage.run(__name__)
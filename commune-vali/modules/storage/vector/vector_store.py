@@ -1,112 +1,405 @@
 import commune as c
-import torch
+import numpy as np
+import os
+import json
+from typing import *
+
+
+class IVFIndex:
+    """
+    An inverted file index in numpy: the vectors are clustered around nlist centroids,
+    and a query only scores the vectors of its nprobe closest clusters.
+    """
+
+    def __init__(self, nlist:int = 256, nprobe:int = 8, iters:int = 10, seed:int = 0, **kwargs):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iters = iters
+        self.rng = np.random.default_rng(seed)
+        self.centroids = None
+        self.lists = [] # list -> set of ids
+        self.id2list = {}
+        self.list_arrays = {} # list -> array of ids (rebuilt when the list changes)
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def min_train_size(self) -> int:
+        return self.nlist * 8
+
+    def train(self, vectors: np.ndarray, max_samples:int = None):
+        """
+        Clusters a sample of the vectors with (inner product) kmeans
+        """
+        max_samples = max_samples or self.nlist * 64
+        sample = vectors[self.rng.choice(len(vectors), min(len(vectors), max_samples), replace=False)]
+        nlist = min(self.nlist, len(sample))
+        centroids = sample[self.rng.choice(len(sample), nlist, replace=False)].copy()
+        for i in range(self.iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(assign, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # reseed the empty clusters with random vectors
+            if empty.any():
+                centroids[empty] = sample[self.rng.choice(len(sample), int(empty.sum()))]
+        self.centroids = centroids.astype(np.float32)
+        self.lists = [set() for _ in range(nlist)]
+        self.id2list = {}
+        self.list_arrays = {}
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        if not self.trained:
+            return
+        for i, l in zip(ids.tolist(), self.assign(vectors).tolist()):
+            self.lists[l].add(i)
+            self.id2list[i] = l
+            self.list_arrays.pop(l, None)
+
+    def remove(self, ids: np.ndarray):
+        for i in ids.tolist():
+            l = self.id2list.pop(i, None)
+            if l != None:
+                self.lists[l].discard(i)
+                self.list_arrays.pop(l, None)
+
+    def list_array(self, l:int) -> np.ndarray:
+        if l not in self.list_arrays:
+            self.list_arrays[l] = np.fromiter(self.lists[l], dtype=np.int64, count=len(self.lists[l]))
+        return self.list_arrays[l]
+
+    def search(self, queries: np.ndarray, top_k:int, vectors: np.ndarray, nprobe:int = None) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        all_scores, all_ids = [], []
+        for q, probe in zip(queries, probes):
+            ids = np.concatenate([self.list_array(l) for l in probe.tolist()])
+            scores = vectors[ids] @ q
+            top = topk(scores, top_k)
+            all_scores.append(scores[top])
+            all_ids.append(ids[top])
+        return all_scores, all_ids
+
+    def state(self) -> dict:
+        return {'centroids': self.centroids, 'id2list': self.id2list}
+
+    def load_state(self, centroids: np.ndarray, ids: np.ndarray, lists: np.ndarray):
+        self.centroids = centroids
+        self.lists = [set() for _ in range(len(centroids))]
+        self.id2list = dict(zip(ids.tolist(), lists.tolist()))
+        for i, l in self.id2list.items():
+            self.lists[l].add(i)
+        self.list_arrays = {}
+
+
+class FaissIndex:
+    """
+    The faiss version of the ivf index (used when faiss is installed)
+    """
+
+    def __init__(self, dim:int, nlist:int = 256, nprobe:int = 8, **kwargs):
+        import faiss
+        self.faiss = faiss
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.quantizer = faiss.IndexFlatIP(dim)
+        self.index = faiss.IndexIVFFlat(self.quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        self.index.nprobe = nprobe
+
+    @property
+    def trained(self) -> bool:
+        return self.index.is_trained
+
+    def min_train_size(self) -> int:
+        return self.nlist * 39
+
+    def train(self, vectors: np.ndarray, **kwargs):
+        self.index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        if self.trained:
+            self.index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids.astype(np.int64))
+
+    def remove(self, ids: np.ndarray):
+        self.index.remove_ids(ids.astype(np.int64))
+
+    def search(self, queries: np.ndarray, top_k:int, vectors: np.ndarray = None, nprobe:int = None):
+        self.index.nprobe = nprobe or self.nprobe
+        scores, ids = self.index.search(np.ascontiguousarray(queries, dtype=np.float32), top_k)
+        mask = ids >= 0
+        return [s[m] for s, m in zip(scores, mask)], [i[m] for i, m in zip(ids, mask)]
+
+    def state(self) -> dict:
+        return {'faiss': self.faiss.serialize_index(self.index)}
+
+
+def topk(scores: np.ndarray, k:int) -> np.ndarray:
+    """
+    The indices of the k highest scores (sorted), with a partial selection instead of a full sort
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind='stable')]
+
 
 class VectorStore(c.Module):
-    def __init__(self, 
+    """
+    A vector store with preallocated (amortized growth) storage, and an optional
+    approximate index (ivf in numpy, or faiss when installed) for large stores.
+    The vectors and the index are saved to .npy files, which are memory mapped on load.
+    """
+    index_types = ['flat', 'ivf', 'faiss']
+
+    def __init__(self,
                     config = None,
                     **kwargs
                  ):
-        self.set_config(config=config, kwargs=kwargs)
+        config = self.set_config(config=config, kwargs=kwargs)
+        self.model = None # connected when text is encoded (see resolve_model)
+        self.reset(dim=config.get('dim', None), capacity=config.get('capacity', 1024))
+
+    def reset(self, dim:int = None, capacity:int = 1024):
+        self.dim = dim
+        self.capacity = capacity
+        self.n = 0
+        self.vectors = None if dim == None else np.zeros((capacity, dim), dtype=np.float32)
+        self.keys = np.empty(capacity, dtype=object)
         self.k2index = {}
-        self.index2k = {}
-        self.vectors = []
-        self.example_vector = None
-        config = self.set_config(config)
-        self.set_model(config.model)
-        
-        
+        self.set_index(self.config.get('index', 'flat'))
+        return {'success': True, 'msg': 'reset vector store'}
+
+    @property
+    def index2k(self) -> dict:
+        return dict(enumerate(self.keys[:self.n].tolist()))
+
+    def set_index(self, index:str = 'flat'):
+        assert index in self.index_types, f'Invalid index {index}, options are {self.index_types}'
+        kwargs = {'nlist': self.config.get('nlist', 256), 'nprobe': self.config.get('nprobe', 8)}
+        if index == 'faiss' and self.dim != None:
+            try:
+                self.index = FaissIndex(dim=self.dim, **kwargs)
+            except ImportError:
+                c.print('faiss is not installed, using the numpy ivf index', color='yellow')
+                index = 'ivf'
+        if index == 'ivf' or (index == 'faiss' and self.dim == None):
+            self.index = IVFIndex(**kwargs)
+        elif index == 'flat':
+            self.index = None
+        self.index_type = index
+        return {'success': True, 'index': index}
 
     def set_model(self, model='model'):
         self.model = c.connect(model)
-        
-        
-        
-    def encode(self, text:str, **kwargs):
-        return self.model.encode(text, **kwargs)
-    
-
-    def resolve_vector(self, v:torch.Tensor):
-        
-        if isinstance(v, list):
-            v = torch.tensor(v)
-        elif isinstance(v, np.ndarray):
-            v = torch.from_numpy(v)
-            
-        assert isinstance(v, torch.Tensor), f'Expected a torch.Tensor, got {type(v)}'
-        if self.example_vector == None:
-            self.example_vector = v
-        assert self.example_vector.shape == v.shape, f'Expected a vector of shape {self.example_vector.shape}, got {v.shape}'
-        
-        return v
-    
-    @classmethod
+
     def resolve_model(self, model=None):
         if model == None:
+            if self.model == None:
+                self.set_model(self.config.model)
             model = self.model
         elif isinstance(model, str):
             model = c.connect(model)
-            
         return model
-        
+
+    def encode(self, text:str, model=None, **kwargs):
+        return self.resolve_model(model).encode(text, **kwargs)
 
     def embed(self, text:str, model=None, **kwargs):
-        model = self.resolve_model(model)
-        vectors = self.model.embed(text, **kwargs)
-    
-    def add_vector(self, k, v , verbose=True):
-    
-
-        v = self.resolve_vector(v)
-        stacked_vectors = []
-        if len(self.vectors) == 0:
-            stacked_vectors = [v]
-        else:
-            stacked_vectors = [self.vectors, v]
-        
-        self.vectors = torch.stack(stacked_vectors)
-        idx = len(self.vectors) - 1
-        if verbose:
-            c.print(f'Adding vector {k} at index {idx}, {self.vectors}')
-        self.k2index[k] = idx
-        self.index2k[idx] = k
-        
+        return self.resolve_model(model).embed(text, **kwargs)
+
+    def resolve_vectors(self, v) -> np.ndarray:
+        if hasattr(v, 'detach'):
+            v = v.detach().cpu().numpy()
+        v = np.asarray(v, dtype=np.float32)
+        if v.ndim == 1:
+            v = v[None, :]
+        if self.dim == None:
+            self.reset(dim=v.shape[-1], capacity=self.capacity)
+        assert v.shape[-1] == self.dim, f'Expected vectors of dimension {self.dim}, got {v.shape}'
+        if self.config.get('metric', 'ip') == 'cosine':
+            v = v / np.maximum(np.linalg.norm(v, axis=-1, keepdims=True), 1e-12)
+        return v
+
+    def grow(self, n:int):
+        """
+        Doubles the capacity until n vectors fit, so appends are amortized O(1)
+        """
+        capacity = self.capacity
+        while capacity < n:
+            capacity *= 2
+        if capacity == self.capacity and self.vectors.flags.writeable:
+            return
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.n] = self.vectors[:self.n]
+        keys = np.empty(capacity, dtype=object)
+        keys[:self.n] = self.keys[:self.n]
+        self.vectors, self.keys, self.capacity = vectors, keys, capacity
+
+    def add_vectors(self, keys:List[str], vectors) -> dict:
+        """
+        Adds (or replaces) a batch of vectors
+        """
+        vectors = self.resolve_vectors(vectors)
+        assert len(keys) == len(vectors), f'Got {len(keys)} keys for {len(vectors)} vectors'
+        # a key repeated in the batch keeps its last vector (one row per key)
+        k2i = {k: i for i, k in enumerate(keys)}
+        if len(k2i) < len(keys):
+            keys, vectors = list(k2i.keys()), vectors[list(k2i.values())]
+        existing = [k for k in keys if k in self.k2index]
+        if len(existing) > 0:
+            self.rm_vectors(existing)
+        self.grow(self.n + len(keys))
+        ids = np.arange(self.n, self.n + len(keys))
+        self.vectors[ids] = vectors
+        self.keys[ids] = keys
+        for k, i in zip(keys, ids.tolist()):
+            self.k2index[k] = i
+        self.n += len(keys)
+        if self.index != None:
+            self.index.add(ids, vectors)
+        return {'success': True, 'n': self.n, 'added': len(keys)}
+
+    def add_vector(self, k, v , verbose=False):
+        c.print(f'Adding vector {k} at index {self.n}', verbose=verbose)
+        return self.add_vectors([k], v)
+
+    def rm_vectors(self, keys:List[str]) -> dict:
+        """
+        Removes a batch of vectors, by moving the last vectors into their rows
+        """
+        n_removed = 0
+        for k in keys:
+            idx = self.k2index.pop(k, None)
+            if idx == None:
+                continue
+            last_idx = self.n - 1
+            if self.index != None:
+                self.index.remove(np.array([idx, last_idx]) if idx != last_idx else np.array([idx]))
+            if idx != last_idx:
+                last_k = self.keys[last_idx]
+                self.vectors[idx] = self.vectors[last_idx]
+                self.keys[idx] = last_k
+                self.k2index[last_k] = idx
+                if self.index != None:
+                    self.index.add(np.array([idx]), self.vectors[idx:idx+1])
+            self.keys[last_idx] = None
+            self.n -= 1
+            n_removed += 1
+        return {'success': True, 'n': self.n, 'removed': n_removed}
+
     def rm_vector(self, k):
-        last_idx = len(self.vectors) - 1
-        print(f'last_idx: {last_idx}')
-        # swap the vector to be removed with the last vector
-        idx = self.k2index[k]
-        last_k = self.index2k[last_idx]
-        last_v = self.vectors[last_idx]
-        self.vectors[idx] = last_v
-        self.k2index[last_k] = idx
-        self.index2k[idx] = last_k
-        # remove the last vector
-        del self.index2k[last_idx]
-        del self.k2index[last_k]
-        
-        self.vectors = self.vectors[:-1]
-
-
-
-
-    def search(self, query, top_k=10, chunks=1):
-        assert len(self.vectors) > 0, 'No vectors stored in the vector store'
-        c.print(f'query: {query}', 'vector shape:', self.vectors.shape)
-        query_vector = torch.tensor(query) 
-        if len(query_vector.shape) == 1:
-            query_vector = query_vector.unsqueeze(0)
-        # Convert the query into a tensor (assuming it's a vector representation)
-        print(query_vector.shape, self.vectors.shape)
-        similarities = torch.einsum('ij,kj->i', query_vector, self.vectors)  # Compute the similarity scores between the query and stored vectors
-        indices = similarities.argsort(descending=True)[:top_k]  # Sort the similarity scores and retrieve the indices of the top-k results
-        results = {}  # Create an empty dictionary to store the results
-        indices = indices.tolist()  # Convert the indices tensor to a list
-        for idx in indices:
-            key = self.index2k[idx]  # Retrieve the key corresponding to the index
-            score = similarities[idx].item()  # Retrieve the similarity score for the corresponding index
-            results[key] = score  # Store the key-score pair in the results dictionary
-        return results  # Return the dictionary of results
+        return self.rm_vectors([k])
+
+    def train(self) -> dict:
+        """
+        Trains the approximate index on the stored vectors
+        """
+        assert self.index != None, 'The flat index does not need training'
+        t0 = c.time()
+        self.index.train(self.vectors[:self.n])
+        self.index.add(np.arange(self.n), self.vectors[:self.n])
+        return {'success': True, 'n': self.n, 'seconds': c.time() - t0}
 
+    def search(self, query, top_k:int = 10, exact:bool = False, nprobe:int = None, chunks=1):
+        """
+        Returns the top_k keys and their scores (a list of results for a batch of queries)
+        """
+        assert self.n > 0, 'No vectors stored in the vector store'
+        queries = self.resolve_vectors(query)
+        if self.index != None and not exact and not self.index.trained and self.n >= self.index.min_train_size():
+            self.train()
+        if self.index != None and not exact and self.index.trained:
+            all_scores, all_ids = self.index.search(queries, top_k, self.vectors, nprobe=nprobe)
+        else:
+            scores = queries @ self.vectors[:self.n].T
+            all_ids = [topk(s, top_k) for s in scores]
+            all_scores = [s[ids] for s, ids in zip(scores, all_ids)]
+        results = [{self.keys[i]: float(s) for i, s in zip(ids.tolist(), scores.tolist())}
+                   for scores, ids in zip(all_scores, all_ids)]
+        is_batch = np.asarray(query if not hasattr(query, 'shape') else np.zeros(query.shape)).ndim > 1
+        return results if is_batch else results[0]
+
+    def save(self, path:str = 'store') -> dict:
+        """
+        Saves the vectors, keys and index under the path (as .npy files)
+        """
+        path = self.resolve_path(path)
+        os.makedirs(path, exist_ok=True)
+        np.save(path + '/vectors.npy', self.vectors[:self.n])
+        with open(path + '/keys.json', 'w') as f:
+            json.dump({'keys': self.keys[:self.n].tolist(), 'index': self.index_type, 'dim': self.dim}, f)
+        if self.index != None and self.index.trained:
+            state = self.index.state()
+            if 'faiss' in state:
+                np.save(path + '/faiss.npy', state['faiss'])
+            else:
+                np.save(path + '/centroids.npy', state['centroids'])
+                np.save(path + '/lists.npy', np.array([list(state['id2list'].keys()), list(state['id2list'].values())], dtype=np.int64))
+        return {'success': True, 'path': path, 'n': self.n}
+
+    def load(self, path:str = 'store') -> dict:
+        """
+        Loads a saved store, the vectors are memory mapped (copy on write) until the store grows
+        """
+        path = self.resolve_path(path)
+        with open(path + '/keys.json') as f:
+            meta = json.load(f)
+        vectors = np.load(path + '/vectors.npy', mmap_mode='c')
+        self.dim = meta['dim']
+        self.n = self.capacity = len(vectors)
+        self.vectors = vectors
+        self.keys = np.empty(self.n, dtype=object)
+        self.keys[:] = meta['keys']
+        self.k2index = {k:i for i,k in enumerate(meta['keys'])}
+        self.set_index(meta['index'])
+        if os.path.exists(path + '/faiss.npy') and isinstance(self.index, FaissIndex):
+            self.index.index = self.index.faiss.deserialize_index(np.load(path + '/faiss.npy'))
+        elif os.path.exists(path + '/centroids.npy') and isinstance(self.index, IVFIndex):
+            lists = np.load(path + '/lists.npy')
+            self.index.load_state(np.load(path + '/centroids.npy'), lists[0], lists[1])
+        return {'success': True, 'path': path, 'n': self.n}
+
+    def bench(self, n:int = 100000, dim:int = 128, queries:int = 100, top_k:int = 10,
+              index:str = 'ivf', nlist:int = None, nprobe:int = 8, clusters:int = 1000) -> dict:
+        """
+        Compares the recall@top_k and the query latency of the index against exact search
+        """
+        rng = np.random.default_rng(0)
+        # clustered data, as real embeddings are
+        centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+        data = centers[rng.integers(0, clusters, n)] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+        query_vectors = data[rng.integers(0, n, queries)] + 0.1 * rng.standard_normal((queries, dim)).astype(np.float32)
+        store = VectorStore(index=index, nlist=nlist or int(4 * np.sqrt(n)), nprobe=nprobe, capacity=1024)
+        t0 = c.time()
+        store.add_vectors([str(i) for i in range(n)], data)
+        add_seconds = c.time() - t0
+        train_seconds = store.train()['seconds']
+        latencies = {'exact': [], index: []}
+        recalls = []
+        for q in query_vectors:
+            t0 = c.time()
+            exact = store.search(q, top_k=top_k, exact=True)
+            latencies['exact'].append(c.time() - t0)
+            t0 = c.time()
+            approx = store.search(q, top_k=top_k)
+            latencies[index].append(c.time() - t0)
+            recalls.append(len(set(exact) & set(approx)) / top_k)
+        return {'n': n, 'dim': dim, 'index': index, 'nlist': store.index.nlist, 'nprobe': nprobe,
+                f'recall@{top_k}': float(np.mean(recalls)),
+                'exact_ms': 1000 * float(np.mean(latencies['exact'])),
+                f'{index}_ms': 1000 * float(np.mean(latencies[index])),
+                'add_seconds': add_seconds, 'train_seconds': train_seconds}
 
     @classmethod
     def test(cls):
@@ -114,8 +407,30 @@ class VectorStore(c.Module):
         self.add_vector('test', [1,2,3])
         assert self.search([1,2,3]) == {'test': 14.0}
         self.rm_vector('test')
-        assert len(self.vectors) == 0
+        assert self.n == 0
+        # the duplicates of a batch are one row (the last one)
+        self.add_vectors(['a', 'a', 'b'], [[0,1,0], [1,0,0], [0,0,1]])
+        assert self.n == 2 and self.search([1,0,0], top_k=2) == {'a': 1.0, 'b': 0.0}
+        self.rm_vector('a')
+        assert self.n == 1 and list(self.search([1,0,0], top_k=2).keys()) == ['b']
         print('test passed')
-        
-        
-        
+        return {'success': True, 'msg': 'vector store test passed'}
+
+    @classmethod
+    def test_index(cls, n=5000, dim=32):
+        self = cls(index='ivf', nlist=32, nprobe=32)
+        vectors = np.random.randn(n, dim).astype(np.float32)
+        self.add_vectors([str(i) for i in range(n)], vectors)
+        self.train()
+        # with every list probed, the ivf search is exact
+        assert self.search(vectors[0], top_k=5) == self.search(vectors[0], top_k=5, exact=True)
+        self.rm_vectors([str(i) for i in range(0, n, 2)])
+        assert self.n == n // 2 and '0' not in self.search(vectors[0], top_k=5)
+        self.save('test_store')
+        store = cls(index='ivf', nlist=32, nprobe=32)
+        store.load('test_store')
+        assert store.search(vectors[1], top_k=5) == self.search(vectors[1], top_k=5)
+        store.add_vector('new', vectors[0])
+        assert list(store.search(vectors[0], top_k=1).keys()) == ['new']
+        self.rm('test_store')
+        return {'success': True, 'msg': 'vector index test passed'}
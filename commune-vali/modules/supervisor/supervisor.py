@@ -0,0 +1,695 @@
+import os
+import sys
+import json
+import fcntl
+import shutil
+import signal
+import socket
+import threading
+import subprocess
+from typing import *
+import commune as c
+
+
+class ProcessTable:
+    """
+    The in-memory process table of the supervisor daemon.
+
+    Each process writes its stdout/stderr to its own log files (opened in append mode, so they can be
+    rotated by copy + truncate), and runs in its own session, so it survives a restart of the daemon
+    and is adopted again (by pid and start time) when the daemon loads the saved table.
+    A monitor thread reaps the processes, restarts the ones that exit with an exponential backoff
+    (reset once a process stays up for min_uptime), samples their cpu/rss and rotates their logs.
+    """
+    runtime_keys = ['cpu', 'rss', 'cpu_ticks', 'sampled']
+
+    def __init__(self,
+                 path:str, # the dir of the table and logs
+                 interval:float = 0.5, # seconds between monitor ticks
+                 min_backoff:float = 1, # seconds before the first restart
+                 max_backoff:float = 60, # max seconds between restarts
+                 min_uptime:float = 10, # seconds up before a process is considered stable
+                 max_log_size:int = 10_000_000, # bytes of a log before it is rotated
+                 max_log_files:int = 3, # rotated logs kept per log
+                 kill_timeout:float = 5): # seconds between SIGTERM and SIGKILL
+        self.path = path
+        self.logs_path = os.path.join(path, 'logs')
+        os.makedirs(self.logs_path, exist_ok=True)
+        self.interval = interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.min_uptime = min_uptime
+        self.max_log_size = max_log_size
+        self.max_log_files = max_log_files
+        self.kill_timeout = kill_timeout
+        self.procs = {} # name -> process
+        self.children = {} # pid -> Popen (for the processes started by this daemon)
+        self.lock = threading.RLock() # held while the table is read or updated
+        self.name2lock = {} # name -> lock, held through a start/stop/restart/delete of the process
+        self.ticks = 0
+        self.running = True
+
+    # PROCESSES
+
+    def name_lock(self, name:str) -> threading.Lock:
+        with self.lock:
+            return self.name2lock.setdefault(name, threading.Lock())
+
+    def start(self, name:str, cmd:List[str], cwd:str = None, env:dict = None, autorestart:bool = True, max_restarts:int = None, refresh:bool = True) -> dict:
+        with self.name_lock(name):
+            with self.lock:
+                old = self.procs.get(name)
+                if old != None and not refresh and old['status'] == 'online':
+                    return self.row(old)
+            if old != None:
+                self.terminate(old)
+            with self.lock:
+                proc = {'name': name,
+                        'cmd': cmd,
+                        'cwd': cwd,
+                        'env': env,
+                        'autorestart': autorestart,
+                        'max_restarts': max_restarts,
+                        'restarts': 0,
+                        'failures': 0, # exits in a row before min_uptime
+                        'out_log': self.log_path(name, 'out'),
+                        'error_log': self.log_path(name, 'error')}
+                self.procs[name] = proc
+                self.spawn(proc)
+                self.save()
+                return self.row(proc)
+
+    def spawn(self, proc:dict):
+        with open(proc['out_log'], 'ab') as out, open(proc['error_log'], 'ab') as err:
+            # only the overrides are kept in the table, the environment is merged here
+            p = subprocess.Popen(proc['cmd'],
+                                 cwd=proc['cwd'],
+                                 env={**os.environ, **(proc['env'] or {})},
+                                 stdin=subprocess.DEVNULL,
+                                 stdout=out,
+                                 stderr=err,
+                                 start_new_session=True)
+        self.children[p.pid] = p
+        proc.update({'pid': p.pid,
+                     'start_time': self.proc_start_time(p.pid),
+                     'started': c.time(),
+                     'status': 'online',
+                     'exit_code': None,
+                     'next_start': None})
+        for k in self.runtime_keys:
+            proc.pop(k, None)
+
+    def alive(self, proc:dict) -> bool:
+        pid = proc.get('pid')
+        if pid == None:
+            return False
+        if pid in self.children:
+            exit_code = self.children[pid].poll()
+            if exit_code == None:
+                return True
+            proc['exit_code'] = exit_code
+            self.children.pop(pid)
+            return False
+        # adopted from a previous daemon, the start time guards against a reused pid
+        return self.proc_start_time(pid) not in [None, -1] and self.proc_start_time(pid) == proc.get('start_time')
+
+    def terminate(self, proc:dict):
+        """
+        Stops the process group with SIGTERM, and SIGKILL after kill_timeout.
+        The table lock is only held to check the process, not while waiting for it to exit
+        """
+        with self.lock:
+            proc['status'] = 'stopped'
+            if not self.alive(proc):
+                return
+            pid = proc['pid']
+        for sig, timeout in [(signal.SIGTERM, self.kill_timeout), (signal.SIGKILL, self.kill_timeout)]:
+            try:
+                os.killpg(pid, sig)
+            except (ProcessLookupError, PermissionError):
+                try:
+                    os.kill(pid, sig)
+                except ProcessLookupError:
+                    return
+            deadline = c.time() + timeout
+            while c.time() < deadline:
+                with self.lock:
+                    if not self.alive(proc):
+                        return
+                c.sleep(0.02)
+
+    def stop(self, name:str) -> dict:
+        with self.name_lock(name):
+            with self.lock:
+                proc = self.procs[name]
+            self.terminate(proc)
+            with self.lock:
+                self.save()
+                return self.row(proc)
+
+    def restart(self, name:str) -> dict:
+        with self.name_lock(name):
+            with self.lock:
+                proc = self.procs[name]
+            self.terminate(proc)
+            with self.lock:
+                proc['restarts'] += 1
+                proc['failures'] = 0
+                self.spawn(proc)
+                self.save()
+                return self.row(proc)
+
+    def delete(self, name:str, rm_logs:bool = True) -> dict:
+        with self.name_lock(name):
+            with self.lock:
+                proc = self.procs.get(name)
+            if proc == None:
+                return {'success': False, 'msg': f'{name} not found'}
+            self.terminate(proc)
+            with self.lock:
+                self.procs.pop(name, None)
+                if rm_logs:
+                    for path in self.log_paths(name):
+                        os.remove(path)
+                self.save()
+            return {'success': True, 'msg': f'Deleted {name}'}
+
+    # MONITOR
+
+    def on_exit(self, proc:dict):
+        now = c.time()
+        proc['failures'] = 1 if now - proc['started'] >= self.min_uptime else proc['failures'] + 1
+        max_restarts = proc['max_restarts']
+        if proc['autorestart'] and (max_restarts == None or proc['restarts'] < max_restarts):
+            proc['status'] = 'waiting'
+            proc['next_start'] = now + min(self.max_backoff, self.min_backoff * 2 ** (proc['failures'] - 1))
+        else:
+            proc['status'] = 'stopped' if proc['exit_code'] == 0 else 'errored'
+        self.save()
+
+    def tick(self):
+        with self.lock:
+            now = c.time()
+            for proc in list(self.procs.values()):
+                if proc['status'] == 'online':
+                    if self.alive(proc):
+                        self.sample(proc, now)
+                    else:
+                        self.on_exit(proc)
+                elif proc['status'] == 'waiting' and now >= proc['next_start']:
+                    proc['restarts'] += 1
+                    self.spawn(proc)
+                    self.save()
+            # reap the children that were replaced (e.g. by a restart)
+            for pid, p in list(self.children.items()):
+                if p.poll() != None and not any(x.get('pid') == pid for x in self.procs.values()):
+                    self.children.pop(pid)
+            self.ticks += 1
+        if self.ticks % 10 == 0:
+            self.rotate_logs()
+            self.set_ports()
+
+    def run_loop(self):
+        while self.running:
+            try:
+                self.tick()
+            except Exception as e:
+                c.print(f'Supervisor tick error: {c.detailed_error(e)}', color='red')
+            c.sleep(self.interval)
+
+    @staticmethod
+    def proc_stat(pid:int) -> Optional[List[str]]:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # the name (field 2) can have spaces, the fields after it are split by spaces
+                return f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            return None
+
+    @classmethod
+    def proc_start_time(cls, pid:int) -> Optional[int]:
+        stat = cls.proc_stat(pid)
+        if stat == None:
+            # no /proc, so the pid is all we have
+            try:
+                os.kill(pid, 0)
+                return -1
+            except ProcessLookupError:
+                return None
+            except PermissionError:
+                return -1
+        return int(stat[19])
+
+    def sample(self, proc:dict, now:float):
+        """
+        Samples the cpu (% of one core since the last sample) and rss (bytes) of the process
+        """
+        stat = self.proc_stat(proc['pid'])
+        if stat == None:
+            return
+        ticks = int(stat[11]) + int(stat[12]) # utime + stime
+        if proc.get('sampled') != None and now > proc['sampled']:
+            proc['cpu'] = round(100 * (ticks - proc['cpu_ticks']) / os.sysconf('SC_CLK_TCK') / (now - proc['sampled']), 1)
+        proc['cpu_ticks'], proc['sampled'] = ticks, now
+        proc['rss'] = int(stat[21]) * os.sysconf('SC_PAGE_SIZE')
+
+    def set_ports(self):
+        try:
+            pid2port = {e['pid']: port for port, e in c.module('server.ports').registry().items() if e['state'] == 'serving'}
+        except Exception:
+            return
+        with self.lock:
+            for proc in self.procs.values():
+                proc['port'] = pid2port.get(proc.get('pid'))
+
+    # LOGS
+
+    def log_path(self, name:str, stream:str) -> str:
+        return os.path.join(self.logs_path, f'{name.replace("/", "-").replace(":", "-")}-{stream}.log')
+
+    def log_paths(self, name:str) -> List[str]:
+        paths = []
+        for stream in ['out', 'error']:
+            path = self.log_path(name, stream)
+            paths += [p for p in [path] + [f'{path}.{i}' for i in range(1, self.max_log_files + 1)] if os.path.exists(p)]
+        return paths
+
+    def rotate_logs(self):
+        """
+        Rotates the logs over max_log_size (copy + truncate, as the processes keep them open)
+        """
+        for proc in list(self.procs.values()):
+            for path in [proc['out_log'], proc['error_log']]:
+                try:
+                    if os.path.getsize(path) < self.max_log_size:
+                        continue
+                except OSError:
+                    continue
+                for i in range(self.max_log_files - 1, 0, -1):
+                    if os.path.exists(f'{path}.{i}'):
+                        os.replace(f'{path}.{i}', f'{path}.{i+1}')
+                shutil.copyfile(path, f'{path}.1')
+                os.truncate(path, 0)
+
+    # STATUS
+
+    def row(self, proc:dict) -> dict:
+        online = proc['status'] == 'online'
+        return {'name': proc['name'],
+                'status': proc['status'],
+                'pid': proc.get('pid') if online else None,
+                'port': proc.get('port') if online else None,
+                'uptime': round(c.time() - proc['started'], 1) if online else 0,
+                'restarts': proc['restarts'],
+                'cpu': proc.get('cpu') if online else None,
+                'rss': proc.get('rss') if online else None,
+                'exit_code': proc.get('exit_code')}
+
+    def status(self, name:str = None) -> Union[dict, List[dict]]:
+        with self.lock:
+            if name != None:
+                return self.row(self.procs[name])
+            return [self.row(p) for p in self.procs.values()]
+
+    def names(self) -> List[str]:
+        return list(self.procs.keys())
+
+    def logs_path_map(self) -> Dict[str, dict]:
+        return {name: {'out': p['out_log'], 'error': p['error_log']} for name, p in self.procs.items()}
+
+    def ping(self) -> dict:
+        return {'success': True, 'pid': os.getpid(), 'n': len(self.procs)}
+
+    api_fns = ['start', 'stop', 'restart', 'delete', 'status', 'names', 'logs_path_map', 'ping']
+
+    # PERSISTENCE
+
+    def save(self):
+        path = os.path.join(self.path, 'processes.json')
+        procs = {name: {k: v for k, v in p.items() if k not in self.runtime_keys} for name, p in self.procs.items()}
+        # the env overrides can hold secrets, so only the user can read the table
+        fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(procs))
+        os.replace(path + '.tmp', path)
+
+    def load(self):
+        """
+        Loads the saved table, adopting the processes that still run, and restarting the others
+        """
+        try:
+            with open(os.path.join(self.path, 'processes.json')) as f:
+                procs = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            for name, proc in procs.items():
+                self.procs[name] = proc
+                if proc['status'] == 'online' and self.alive(proc):
+                    continue
+                if proc['status'] in ['online', 'waiting'] and proc['autorestart']:
+                    self.spawn(proc)
+                elif proc['status'] == 'online':
+                    proc['status'] = 'stopped'
+            self.save()
+
+    # API
+
+    def handle(self, conn:socket.socket):
+        """
+        Answers one request: a json line {'fn', 'kwargs'} -> a json line {'result'} or {'error'}
+        """
+        try:
+            with conn, conn.makefile('rb') as f:
+                request = json.loads(f.readline())
+                try:
+                    assert request['fn'] in self.api_fns, f'{request["fn"]} not in {self.api_fns}'
+                    response = {'result': getattr(self, request['fn'])(**request.get('kwargs', {}))}
+                except Exception as e:
+                    response = {'error': c.detailed_error(e)}
+                conn.sendall(json.dumps(response, default=str).encode() + b'\n')
+        except Exception as e:
+            c.print(f'Supervisor request error: {e}', color='red')
+
+    def serve(self, socket_path:str):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(128)
+        self.server = server
+        threading.Thread(target=self.run_loop, daemon=True).start()
+        while self.running:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self.running = False
+        if hasattr(self, 'server'):
+            self.server.close()
+
+
+class Supervisor(c.Module):
+    """
+    A process supervisor for commune servers, with the commands of the pm2 module.
+
+    A daemon (started on the first call) keeps the process table in memory, and answers the
+    commands over a unix socket, so a status query is a local round trip instead of running pm2.
+    It restarts the processes that exit (with backoff), tracks their pid/port/cpu/rss and rotates their logs.
+    """
+    def __init__(self, **kwargs):
+        pass
+
+    @classmethod
+    def socket_path(cls) -> str:
+        return cls.resolve_path('supervisor.sock')
+
+    @classmethod
+    def daemon(cls, **kwargs):
+        """
+        Runs the daemon (one per user, the others exit)
+        """
+        path = cls.resolve_path('')
+        lock = open(os.path.join(path, 'daemon.lock'), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return {'success': False, 'msg': 'The supervisor daemon is already running'}
+        table = ProcessTable(path=path, **kwargs)
+        table.load()
+        for sig in [signal.SIGTERM, signal.SIGINT]:
+            signal.signal(sig, lambda *args: table.close())
+        table.serve(cls.socket_path())
+        return {'success': True, 'msg': 'The supervisor daemon stopped'}
+
+    @classmethod
+    def start_daemon(cls, timeout:float = 10):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([c.libpath] + [p for p in [env.get('PYTHONPATH')] if p])
+        with open(cls.resolve_path('daemon.log'), 'ab') as log:
+            subprocess.Popen([sys.executable, '-c', 'import commune as c; c.module("supervisor").daemon()'],
+                             env=env,
+                             stdin=subprocess.DEVNULL,
+                             stdout=log,
+                             stderr=log,
+                             start_new_session=True)
+        deadline = c.time() + timeout
+        while c.time() < deadline:
+            try:
+                return cls.call('ping', start=False)
+            except (FileNotFoundError, ConnectionRefusedError):
+                c.sleep(0.05)
+        raise TimeoutError(f'The supervisor daemon did not start in {timeout}s (see {cls.resolve_path("daemon.log")})')
+
+    @classmethod
+    def kill_daemon(cls) -> dict:
+        try:
+            pid = cls.call('ping', start=False)['pid']
+        except (FileNotFoundError, ConnectionRefusedError):
+            return {'success': False, 'msg': 'The supervisor daemon is not running'}
+        os.kill(pid, signal.SIGTERM)
+        return {'success': True, 'msg': f'Stopped the supervisor daemon ({pid})'}
+
+    @classmethod
+    def call(cls, fn:str, socket_path:str = None, start:bool = True, timeout:float = 30, **kwargs):
+        """
+        Calls fn of the daemon over its socket (starting the daemon if it is not running)
+        """
+        socket_path = socket_path or cls.socket_path()
+        try:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(timeout)
+            conn.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            conn.close()
+            if not start:
+                raise e
+            cls.start_daemon()
+            return cls.call(fn, socket_path=socket_path, start=False, timeout=timeout, **kwargs)
+        with conn, conn.makefile('rb') as f:
+            conn.sendall(json.dumps({'fn': fn, 'kwargs': kwargs}).encode() + b'\n')
+            response = json.loads(f.readline())
+        if 'error' in response:
+            raise Exception(response['error'])
+        return response['result']
+
+    # PM2 COMMANDS
+
+    @classmethod
+    def start(cls,
+              path:str,
+              name:str,
+              cmd_kwargs:str = None,
+              refresh: bool = True,
+              verbose:bool = True,
+              force : bool = True,
+              current_dir: str = True,
+              interpreter : str = None,
+              autorestart: bool = True,
+              env: dict = None,
+              **kwargs):
+        cmd = [interpreter or sys.executable, path] if (interpreter or path.endswith('.py')) else [path]
+        if isinstance(cmd_kwargs, dict):
+            for k, v in cmd_kwargs.items():
+                cmd += [f'--{k}', str(v)]
+        elif isinstance(cmd_kwargs, str):
+            cmd += cmd_kwargs.split(' ')
+        c.print(f'[bold cyan]Starting[/bold cyan] [bold yellow]{name}[/bold yellow]', color='green', verbose=verbose)
+        return cls.call('start',
+                        name=name,
+                        cmd=cmd,
+                        cwd=c.dirpath(path) if current_dir else None,
+                        env=env or {},
+                        autorestart=autorestart,
+                        refresh=refresh or force)
+
+    @classmethod
+    def launch(cls,
+               module:str = None,
+               fn: str = 'serve',
+               name:Optional[str]=None,
+               tag : str = None,
+               args : list = None,
+               kwargs: dict = None,
+               device:str=None,
+               interpreter:str=None,
+               autorestart: bool = True,
+               max_restarts: int = None,
+               verbose: bool = False ,
+               force:bool = True,
+               meta_fn: str = 'module_fn',
+               tag_seperator:str = '::',
+               cwd = None,
+               refresh:bool=True ):
+        if hasattr(module, 'module_path'):
+            module = module.module_path()
+        kwargs = {'module': module, 'fn': fn, 'args': args or [], 'kwargs': kwargs or {}}
+        kwargs_str = json.dumps(kwargs).replace('"', "'")
+        name = cls.resolve_server_name(module=module, name=name, tag=tag, tag_seperator=tag_seperator)
+        env = {}
+        if device != None:
+            env['CUDA_VISIBLE_DEVICES'] = ','.join(map(str, device)) if isinstance(device, list) else str(device)
+        cmd = [interpreter or sys.executable, c.filepath(), '--fn', meta_fn, '--kwargs', kwargs_str]
+        row = cls.call('start',
+                       name=name,
+                       cmd=cmd,
+                       cwd=cwd or c.module().dirpath(),
+                       env=env,
+                       autorestart=autorestart,
+                       max_restarts=max_restarts,
+                       refresh=refresh or force)
+        return {'success':True, 'message':f'Launched {module}', 'command': ' '.join(cmd), 'process': row}
+
+    @classmethod
+    def servers(cls, search=None, verbose:bool = False) -> List[str]:
+        names = cls.call('names')
+        if search != None:
+            search = [search] if isinstance(search, str) else search
+            names = [n for n in names if any([s in n for s in search])]
+        return names
+
+    @classmethod
+    def exists(cls, name:str) -> bool:
+        return name in cls.servers()
+
+    @classmethod
+    def status(cls, name:str = None, verbose:bool = False):
+        status = cls.call('status', name=name)
+        if verbose:
+            c.print(status, color='green')
+        return status
+
+    @classmethod
+    def stop(cls, name:str):
+        return cls.call('stop', name=name)
+
+    @classmethod
+    def restart(cls, name:str, verbose:bool = False, prefix_match:bool = True):
+        names = cls.servers()
+        if name in names:
+            names = [name]
+        elif prefix_match:
+            names = [n for n in names if n.startswith(name)]
+        else:
+            raise Exception(f'process {name} not found')
+        for n in names:
+            c.print(f'Restarting {n}', color='cyan', verbose=verbose)
+            cls.call('restart', name=n)
+        return {'success':True, 'message':f'Restarted {name}', 'restarted': names}
+
+    @classmethod
+    def restart_prefix(cls, name:str = None, verbose:bool=False):
+        names = [n for n in cls.servers() if name in ['all', None] or n.startswith(name)]
+        for n in names:
+            c.print(f'Restarting {n}', color='cyan', verbose=verbose)
+            cls.call('restart', name=n)
+        return names
+
+    @classmethod
+    def restart_many(cls, search:str = None, **kwargs):
+        return [cls.restart(n, prefix_match=False) for n in cls.servers(search)]
+
+    @classmethod
+    def kill(cls, name:str, verbose:bool = False, **kwargs):
+        if name == 'all':
+            return cls.kill_all(verbose=verbose)
+        return cls.call('delete', name=name)
+
+    @classmethod
+    def kill_many(cls, search=None, verbose:bool = True, timeout=10):
+        names = cls.servers(search=search)
+        for name in names:
+            c.print(f'[bold cyan]Killing[/bold cyan] [bold yellow]{name}[/bold yellow]', color='green', verbose=verbose)
+        # the daemon stops them in parallel (each request is a thread)
+        return c.wait([c.submit(cls.kill, kwargs={'name': name}, return_future=True, timeout=timeout) for name in names])
+
+    @classmethod
+    def kill_all(cls, verbose:bool = True, timeout=10):
+        return cls.kill_many(search=None, verbose=verbose, timeout=timeout)
+
+    @classmethod
+    def logs_path_map(cls, name=None):
+        logs_path_map = cls.call('logs_path_map')
+        if name != None:
+            return logs_path_map.get(name, {})
+        return logs_path_map
+
+    @classmethod
+    def rm_logs(cls, name):
+        for path in cls.logs_path_map(name).values():
+            if os.path.exists(path):
+                os.truncate(path, 0)
+
+    @classmethod
+    def logs(cls, module:str, tail: int =100, verbose: bool=True, mode: str ='local', **kwargs):
+        text = ''
+        for stream, path in cls.logs_path_map(module).items():
+            try:
+                text += c.get_text(path, tail=tail)
+            except Exception as e:
+                c.print(e)
+        return text
+
+    @classmethod
+    def test(cls):
+        import tempfile
+        path = tempfile.mkdtemp()
+        table = ProcessTable(path=path, interval=0.05, min_backoff=0.1, max_backoff=0.4, min_uptime=1, max_log_size=1000, max_log_files=2, kill_timeout=1)
+        socket_path = os.path.join(path, 'test.sock')
+        threading.Thread(target=table.serve, args=(socket_path,), daemon=True).start()
+        while not os.path.exists(socket_path):
+            c.sleep(0.01)
+        call = lambda fn, **kwargs: cls.call(fn, socket_path=socket_path, start=False, **kwargs)
+        try:
+            # a process is monitored, and restarted when it is killed
+            row = call('start', name='sleeper', cmd=[sys.executable, '-c', 'import time\nwhile True: print("x" * 100, flush=True); time.sleep(0.01)'], env={'SUPERVISOR_TEST': '1'})
+            assert row['status'] == 'online', row
+            # only the env overrides are saved (readable by the user only), and merged at spawn
+            table_path = os.path.join(path, 'processes.json')
+            assert os.stat(table_path).st_mode & 0o077 == 0 and json.load(open(table_path))['sleeper']['env'] == {'SUPERVISOR_TEST': '1'}
+            if os.path.exists(f'/proc/{row["pid"]}/environ'):
+                environ = open(f'/proc/{row["pid"]}/environ', 'rb').read().split(b'\0')
+                assert b'SUPERVISOR_TEST=1' in environ and any(v.startswith(b'PATH=') for v in environ)
+            c.sleep(0.6)
+            row = call('status', name='sleeper')
+            assert row['rss'] > 0 and row['cpu'] != None, row
+            os.kill(row['pid'], signal.SIGKILL)
+            c.sleep(0.6)
+            new_row = call('status', name='sleeper')
+            assert new_row['status'] == 'online' and new_row['pid'] != row['pid'] and new_row['restarts'] == 1, new_row
+            # the logs are rotated
+            assert os.path.exists(table.log_path('sleeper', 'out') + '.1')
+            # a crashing process is restarted with backoff, until max_restarts
+            call('start', name='crasher', cmd=[sys.executable, '-c', 'import sys; sys.exit(3)'], max_restarts=2)
+            c.sleep(1.5)
+            row = call('status', name='crasher')
+            assert row['status'] == 'errored' and row['restarts'] == 2 and row['exit_code'] == 3, row
+            # the processes are killed in parallel, and the status is answered while they stop
+            stubborn = [sys.executable, '-c', 'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(100)']
+            for name in ['stubborn0', 'stubborn1']:
+                call('start', name=name, cmd=stubborn)
+            c.sleep(0.3)
+            t0 = c.time()
+            futures = [c.submit(call, kwargs={'fn': 'delete', 'name': name}) for name in ['stubborn0', 'stubborn1']]
+            c.sleep(0.2)
+            t1 = c.time()
+            assert call('status', name='sleeper')['status'] == 'online' and c.time() - t1 < 0.5
+            assert all(r['success'] for r in c.wait(futures)) and c.time() - t0 < 1.8, c.time() - t0
+            # a new daemon adopts the running processes
+            pid = call('status', name='sleeper')['pid']
+            table2 = ProcessTable(path=path)
+            table2.load()
+            assert table2.status('sleeper')['pid'] == pid and table2.status('sleeper')['status'] == 'online'
+            assert call('delete', name='sleeper')['success'] and call('delete', name='crasher')['success']
+            assert call('names') == []
+            assert ProcessTable.proc_stat(pid) == None or ProcessTable.proc_stat(pid)[0] == 'Z'
+        finally:
+            for name in table.names():
+                table.delete(name)
+            table.close()
+            shutil.rmtree(path, ignore_errors=True)
+        return {'success': True, 'msg': 'supervisor test passed'}